@@ -0,0 +1,81 @@
+#!/usr/bin/env python
+# Copyright (c) 2014 Nick Douma < n.douma [at] nekoconeko . nl >
+#
+# This file is part of chaos, a.k.a. python-chaos .
+#
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation; either
+# version 3.0 of the License, or (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with this library. If not, see
+# <http://www.gnu.org/licenses/>.
+
+
+"""
+Compare the write, random read and iteration throughput of the SimpleDb backends, and
+the size of the resulting files.
+
+Usage: python benchmarks/backends.py [values] [bytes per value]
+"""
+
+from __future__ import absolute_import, print_function
+import os, random, shutil, sys, tempfile, time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from chaos.db import SimpleDb
+from chaos.db.backend import backend_list
+
+def measure(backend, keys, value, directory):
+	path = os.path.join(directory, backend)
+
+	start = time.time()
+	with SimpleDb(path, mode="n", sync=False, codec="marshal", backend=backend) as db:
+		for key in keys:
+			db[key] = value
+	write_time = time.time() - start
+
+	shuffled = list(keys)
+	random.shuffle(shuffled)
+	with SimpleDb(path, mode="r") as db:
+		start = time.time()
+		for key in shuffled:
+			db[key]
+		read_time = time.time() - start
+
+		start = time.time()
+		for key in db:
+			db[key]
+		iterate_time = time.time() - start
+
+	size = sum(os.path.getsize(name) for name in backend_list[backend].files(path) if os.path.exists(name))
+	return write_time, read_time, iterate_time, size
+
+def main():
+	count = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+	value_size = int(sys.argv[2]) if len(sys.argv) > 2 else 256
+	keys = ["key-{0:08d}".format(i) for i in range(count)]
+	value = {"payload": "x" * value_size}
+	directory = tempfile.mkdtemp()
+
+	print("{0:>8} {1:>12} {2:>12} {3:>12} {4:>10}".format("backend", "write/s", "read/s", "iterate/s", "file MB"))
+	try:
+		for backend in sorted(backend_list):
+			try:
+				write_time, read_time, iterate_time, size = measure(backend, keys, value, directory)
+			except Exception as e:
+				print("{0:>8} skipped: {1}".format(backend, e))
+				continue
+			print("{0:>8} {1:>12.0f} {2:>12.0f} {3:>12.0f} {4:>10.1f}".format(
+				backend, count / write_time, count / read_time, count / iterate_time, size / 1048576.0))
+	finally:
+		shutil.rmtree(directory)
+
+if __name__ == "__main__":
+	main()
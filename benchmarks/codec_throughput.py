@@ -0,0 +1,82 @@
+#!/usr/bin/env python
+# Copyright (c) 2014 Nick Douma < n.douma [at] nekoconeko . nl >
+#
+# This file is part of chaos, a.k.a. python-chaos .
+#
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation; either
+# version 3.0 of the License, or (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with this library. If not, see
+# <http://www.gnu.org/licenses/>.
+
+"""
+Compare the encode and decode throughput of the SimpleDb codecs, and the size of a
+database written with each of them.
+
+Usage: python benchmarks/codec_throughput.py [values]
+"""
+
+from __future__ import absolute_import, print_function
+import os, shutil, sys, tempfile, time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from chaos.db import SimpleDb
+from chaos.db.codec import codec_list, get_codec
+
+def make_value(i):
+	# Resembles the state records of a daemon
+	return {
+		"id": i,
+		"name": u"worker-{0}".format(i),
+		"enabled": i % 2 == 0,
+		"load": [0.5 * i, 0.25, 1.0 / (i + 1)],
+		"tags": [u"alpha", u"beta", u"gamma"],
+		"stats": {"runs": i * 10, "failures": i % 7, "last": None}
+	}
+
+def measure(codec, values, directory):
+	start = time.time()
+	encoded = [codec.encode(value) for value in values]
+	encode_time = time.time() - start
+
+	start = time.time()
+	for data in encoded:
+		codec.decode(data)
+	decode_time = time.time() - start
+
+	path = os.path.join(directory, codec.name)
+	with SimpleDb(path, mode="n", sync=False, codec=codec.name) as db:
+		for i, value in enumerate(values):
+			db[str(i)] = value
+
+	return encode_time, decode_time, sum(len(data) for data in encoded), os.path.getsize(path)
+
+def main():
+	count = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+	values = [make_value(i) for i in range(count)]
+	directory = tempfile.mkdtemp()
+
+	print("{0:>8} {1:>12} {2:>12} {3:>12} {4:>12}".format("codec", "encode/s", "decode/s", "bytes/value", "file MB"))
+	try:
+		for name in sorted(codec_list):
+			try:
+				codec = get_codec(name)
+			except Exception as e:
+				print("{0:>8} skipped: {1}".format(name, e))
+				continue
+			encode_time, decode_time, size, file_size = measure(codec, values, directory)
+			print("{0:>8} {1:>12.0f} {2:>12.0f} {3:>12.1f} {4:>12.1f}".format(
+				name, count / encode_time, count / decode_time, float(size) / count, file_size / 1048576.0))
+	finally:
+		shutil.rmtree(directory)
+
+if __name__ == "__main__":
+	main()
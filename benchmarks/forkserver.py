@@ -0,0 +1,66 @@
+#!/usr/bin/env python
+# Copyright (c) 2014 Nick Douma < n.douma [at] nekoconeko . nl >
+#
+# This file is part of chaos, a.k.a. python-chaos .
+#
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation; either
+# version 3.0 of the License, or (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with this library. If not, see
+# <http://www.gnu.org/licenses/>.
+
+"""
+Compare the time it takes to start and join workers forked from a large main process
+with multiprocessing.Process, and forked from a ForkServer that preloaded the module
+the workers need.
+
+Usage: python benchmarks/forkserver.py [megabytes allocated by the main process] [workers]
+"""
+
+from __future__ import absolute_import, print_function
+import importlib, multiprocessing, os, sys, time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from chaos.multiprocessing.forkserver import ForkServer, ForkServerProcess
+
+# The module every worker needs, but the main process does not import
+MODULE = "decimal"
+
+def run(processes):
+	start = time.time()
+	for process in processes:
+		process.start()
+	for process in processes:
+		process.join()
+	return time.time() - start
+
+def main():
+	megabytes = int(sys.argv[1]) if len(sys.argv) > 1 else 512
+	count = int(sys.argv[2]) if len(sys.argv) > 2 else 50
+
+	server = ForkServer(preload=[MODULE])
+	start = time.time()
+	server.start()
+	print("Fork server started in {0:.3f} seconds".format(time.time() - start))
+
+	# Simulate a main process that has grown large
+	ballast = [b"x" * 1024 for i in range(megabytes * 1024)]
+
+	fork_time = run([multiprocessing.Process(target=importlib.import_module, args=(MODULE,)) for i in range(count)])
+	server_time = run([ForkServerProcess(server, target=importlib.import_module, args=(MODULE,)) for i in range(count)])
+	server.stop()
+
+	print("{0:>16} {1:>10} {2:>14} {3:>16} {4:>8}".format("main process MB", "workers", "fork ms/worker", "server ms/worker", "speedup"))
+	print("{0:>16} {1:>10} {2:>14.2f} {3:>16.2f} {4:>7.1f}x".format(
+		megabytes, count, 1000 * fork_time / count, 1000 * server_time / count, fork_time / server_time))
+
+if __name__ == "__main__":
+	main()
@@ -0,0 +1,81 @@
+#!/usr/bin/env python
+# Copyright (c) 2014 Nick Douma < n.douma [at] nekoconeko . nl >
+#
+# This file is part of chaos, a.k.a. python-chaos .
+#
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation; either
+# version 3.0 of the License, or (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with this library. If not, see
+# <http://www.gnu.org/licenses/>.
+
+"""
+Compare passing messages from the parent to a Worker through a RingBuffer and
+through a multiprocessing.Queue, for small and large messages.
+
+Usage: python benchmarks/ringbuffer.py [total megabytes per run]
+"""
+
+from __future__ import absolute_import, print_function
+import multiprocessing, os, sys, time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from chaos.multiprocessing.workers import Workers
+from chaos.multiprocessing.ringbuffer import RingBuffer
+
+SIZES = [64, 1024, 16384, 262144]
+
+def ring_consumer(count):
+	ring = Workers().getRing("consumer")
+	for i in range(count):
+		with ring.read() as view:
+			len(view)
+
+def queue_consumer(queue, count):
+	for i in range(count):
+		len(queue.get())
+
+def run(process, produce, count, ring=None):
+	workers = Workers()
+	workers.registerWorker("consumer", process)
+	if ring:
+		workers.attachRing("consumer", ring)
+
+	start = time.time()
+	workers.startAll()
+	for i in range(count):
+		produce()
+	workers.getWorker("consumer").join()
+	duration = time.time() - start
+	workers.stopAll()
+	return duration
+
+def main():
+	megabytes = int(sys.argv[1]) if len(sys.argv) > 1 else 64
+
+	print("{0:>10} {1:>10} {2:>14} {3:>14} {4:>8}".format("size", "messages", "queue msg/s", "ring msg/s", "speedup"))
+	for size in SIZES:
+		count = max(1000, megabytes * 1024 * 1024 // size)
+		message = b"x" * size
+
+		queue = multiprocessing.Queue(1000)
+		process = multiprocessing.Process(target=queue_consumer, args=(queue, count))
+		queue_time = run(process, lambda: queue.put(message), count)
+
+		ring = RingBuffer(max(1048576, size * 16))
+		process = multiprocessing.Process(target=ring_consumer, args=(count,))
+		ring_time = run(process, lambda: ring.put(message), count, ring)
+
+		print("{0:>10} {1:>10} {2:>14.0f} {3:>14.0f} {4:>7.1f}x".format(
+			size, count, count / queue_time, count / ring_time, queue_time / ring_time))
+
+if __name__ == "__main__":
+	main()
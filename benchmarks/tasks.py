@@ -0,0 +1,87 @@
+#!/usr/bin/env python
+# Copyright (c) 2014 Nick Douma < n.douma [at] nekoconeko . nl >
+#
+# This file is part of chaos, a.k.a. python-chaos .
+#
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation; either
+# version 3.0 of the License, or (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with this library. If not, see
+# <http://www.gnu.org/licenses/>.
+
+"""
+Compare running many tiny tasks on worker processes fed by one shared
+multiprocessing.Queue, with running them on a TaskPool.
+
+Usage: python benchmarks/tasks.py [tasks] [workers]
+"""
+
+from __future__ import absolute_import, print_function
+import multiprocessing, os, sys, time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from chaos.multiprocessing.tasks import TaskPool
+
+def square(x):
+	return x * x
+
+def queue_worker(tasks, results):
+	while True:
+		task = tasks.get()
+		if task is None:
+			return
+		task_id, action, args = task
+		results.put((task_id, action(*args)))
+
+def run_queue(count, workers):
+	tasks, results = multiprocessing.Queue(), multiprocessing.Queue()
+	processes = [multiprocessing.Process(target=queue_worker, args=(tasks, results)) for i in range(workers)]
+	for process in processes:
+		process.start()
+
+	start = time.time()
+	for i in range(count):
+		tasks.put((i, square, (i,)))
+	values = dict(results.get() for i in range(count))
+	duration = time.time() - start
+
+	for process in processes:
+		tasks.put(None)
+	for process in processes:
+		process.join()
+	assert values[count - 1] == (count - 1) ** 2
+	return duration
+
+def run_pool(count, workers, batch_size):
+	pool = TaskPool("benchmark", workers, batch_size)
+	pool.start()
+
+	start = time.time()
+	values = list(pool.map(square, range(count)))
+	duration = time.time() - start
+
+	pool.shutdown()
+	assert values[count - 1] == (count - 1) ** 2
+	return duration
+
+def main():
+	count = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+	workers = int(sys.argv[2]) if len(sys.argv) > 2 else 4
+
+	queue_time = run_queue(count, workers)
+	print("{0:>24} {1:>12.0f} tasks/s".format("shared queue", count / queue_time))
+	for batch_size in (1, 16, 256):
+		pool_time = run_pool(count, workers, batch_size)
+		print("{0:>24} {1:>12.0f} tasks/s {2:>7.1f}x".format(
+			"TaskPool, batch {0}".format(batch_size), count / pool_time, queue_time / pool_time))
+
+if __name__ == "__main__":
+	main()
@@ -0,0 +1,265 @@
+# Copyright (c) 2014 Nick Douma < n.douma [at] nekoconeko . nl >
+#
+# This file is part of chaos, a.k.a. python-chaos .
+#
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation; either
+# version 3.0 of the License, or (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with this library. If not, see
+# <http://www.gnu.org/licenses/>.
+
+"""
+Helper functions for running actions periodically on an asyncio event loop.
+
+On Python 2, the trollius backport of asyncio is used.
+"""
+
+from __future__ import absolute_import
+import datetime, functools, logging, time
+from ..threading.scheduler import SchedulePolicy
+
+try:
+	import asyncio
+except ImportError:
+	import trollius as asyncio
+
+def _exc_info(exception):
+	"""
+	Return the exc_info tuple for logging an exception taken from a Future. Python 2
+	does not keep the traceback on the exception, so it is left out there.
+	"""
+	return (type(exception), exception, getattr(exception, "__traceback__", None))
+
+class Scheduler(SchedulePolicy):
+	"""
+	Calls an action periodically on an asyncio event loop, without using a Thread.
+
+	The timing semantics are the same as those of chaos.threading.scheduler.Scheduler,
+	including setPolicy(), setSpread(), triggers and getStats().
+
+	Coroutine functions are run on the event loop. Other functions are assumed to be
+	blocking, and are run on an executor, see setExecutor().
+
+	To stop scheduling new runs, set stop to True, or use shutdown() to also wait for
+	running runs and call the stop action.
+	"""
+	def __init__(self, delay, action, name, startNow=False, *args, **kwargs):
+		"""
+		Initialize a new Scheduler. Nothing is scheduled until start() is called.
+
+		Parameters
+		----------
+		delay: int or trigger
+			The delay between consequtive runs, in seconds. Alternatively, a trigger
+			such as CronTrigger that determines when to run.
+		action: function pointer or coroutine function
+			The function to call.
+		name: string
+			Descriptive name of this Scheduler.
+		startNow: boolean
+			When True, the first run will take place immediately when start() is called.
+			When False, the first run will take place now+interval seconds.
+		*args
+			Positional arguments to pass to action.
+		**kwargs:
+			Keyword arguments to pass to action.
+		"""
+		self.logger = logging.getLogger(name)
+		self._initPolicy(delay)
+
+		self.delay = delay
+		self.main_action = action
+		self.name = name
+		self.main_args = args
+		self.main_kwargs = kwargs
+		self.startNow = startNow
+
+		self.loop = None
+		self.executor = None
+		self.handle = None
+		self.runs = set()
+		self.finished = None
+		self.lastRun = None
+		self.nextRun = None
+
+		self.stop = False
+
+	def setStartAction(self, action, *args, **kwargs):
+		"""
+		Set a function to call when start() is called, before the main action is called.
+
+		Parameters
+		----------
+		action: function pointer or coroutine function
+			The function to call.
+		*args
+			Positional arguments to pass to action.
+		**kwargs:
+			Keyword arguments to pass to action.
+		"""
+		self.init_action = action
+		self.init_args = args
+		self.init_kwargs = kwargs
+
+	def setStopAction(self, action, *args, **kwargs):
+		"""
+		Set a function to call when shutdown() is called, after all runs have finished.
+
+		Parameters
+		----------
+		action: function pointer or coroutine function
+			The function to call.
+		*args
+			Positional arguments to pass to action.
+		**kwargs:
+			Keyword arguments to pass to action.
+		"""
+		self.stop_action = action
+		self.stop_args = args
+		self.stop_kwargs = kwargs
+
+	def setExecutor(self, executor):
+		"""
+		Set the executor used for running functions that are not coroutine functions.
+		Defaults to None, which is the default executor of the event loop.
+
+		Parameters
+		----------
+		executor: concurrent.futures.Executor
+			The executor to use.
+		"""
+		self.executor = executor
+
+	def start(self, loop=None):
+		"""
+		Call the start action, and schedule the first run. Returns a Future that
+		completes when the start action is done.
+
+		Parameters
+		----------
+		loop: asyncio event loop
+			The loop to run on. Defaults to the current event loop.
+		"""
+		self.loop = loop or asyncio.get_event_loop()
+		self.logger.debug("Scheduler {0} is starting".format(self.name))
+
+		if hasattr(self, "init_action"):
+			self.logger.debug("Scheduler {0} is calling its init action".format(self.name))
+			started = self._call(self.init_action, self.init_args, self.init_kwargs)
+		else:
+			started = self.loop.create_future()
+			started.set_result(None)
+
+		def schedule(future):
+			if future.cancelled() or future.exception() is not None:
+				self.logger.error("Scheduler {0} failed to call its init action".format(self.name))
+				return
+			self.nextRun = self._planFirst(self.startNow)
+			self._scheduleNext()
+		started.add_done_callback(schedule)
+		return started
+
+	def shutdown(self):
+		"""
+		Stop scheduling new runs, and call the stop action once all running runs have
+		finished. Returns a Future that completes when the stop action is done. If the
+		Scheduler was never started, the Future is done already.
+		"""
+		self.stop = True
+		if self.handle:
+			self.handle.cancel()
+			self.handle = None
+
+		if self.loop is None:
+			# Never started, so there are no runs to wait for and no stop action to call
+			if not self.finished:
+				self.finished = asyncio.get_event_loop().create_future()
+				self.finished.set_result(None)
+			return self.finished
+
+		if not self.finished:
+			self.finished = self.loop.create_future()
+			self._checkFinished()
+		return self.finished
+
+	def _call(self, action, args, kwargs):
+		"""
+		Call the given action, and return a Future for its result.
+		"""
+		if asyncio.iscoroutinefunction(action):
+			return asyncio.ensure_future(action(*args, **kwargs), loop=self.loop)
+		return self.loop.run_in_executor(self.executor, functools.partial(action, *args, **kwargs))
+
+	def _scheduleNext(self):
+		if self.stop:
+			return
+		self.handle = self.loop.call_later(max(0, self.nextRun - time.time()), self._due)
+
+	def _due(self):
+		self.handle = None
+		if self.stop:
+			return
+
+		now = time.time()
+		if self.concurrency > 1:
+			if self._acquireRun():
+				self._launch(self.nextRun, True)
+			self.nextRun = self._planAfterDispatch(now)
+			self._scheduleNext()
+		else:
+			self._launch(self.nextRun, False)
+
+	def _launch(self, planned, concurrent):
+		self.logger.debug("Scheduler {0} is running".format(self.name))
+		started = time.time()
+		run = self._call(self.main_action, self.main_args, self.main_kwargs)
+		self.runs.add(run)
+
+		def done(future):
+			finished = time.time()
+			self.runs.discard(future)
+
+			failed = future.cancelled() or future.exception() is not None
+			if failed:
+				self.logger.error("Scheduler {0} generated an exception!".format(self.name),
+					exc_info=None if future.cancelled() else _exc_info(future.exception()))
+			self.stats.record(planned, started, finished, failed)
+			self.lastRun = datetime.datetime.now()
+			self.logger.debug("Scheduler {0} is done".format(self.name))
+
+			if concurrent:
+				self._releaseRun(started, finished)
+			else:
+				self.nextRun = self._planAfterRun(started, finished)
+				self._scheduleNext()
+
+			if self.finished:
+				self._checkFinished()
+		run.add_done_callback(done)
+
+	def _checkFinished(self):
+		if self.runs or self.finished.done():
+			return
+
+		if not hasattr(self, "stop_action"):
+			self.finished.set_result(None)
+			self.logger.debug("Scheduler {0} has stopped".format(self.name))
+			return
+
+		self.logger.debug("Scheduler {0} is calling its stop action".format(self.name))
+		stopped = self._call(self.stop_action, self.stop_args, self.stop_kwargs)
+
+		def done(future):
+			if future.cancelled() or future.exception() is not None:
+				self.logger.error("Scheduler {0} failed to call its stop action".format(self.name))
+			self.finished.set_result(None)
+			self.logger.debug("Scheduler {0} has stopped".format(self.name))
+		stopped.add_done_callback(done)
@@ -0,0 +1,27 @@
+# Copyright (c) 2014 Nick Douma < n.douma [at] nekoconeko . nl >
+#
+# This file is part of chaos, a.k.a. python-chaos .
+#
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation; either
+# version 3.0 of the License, or (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with this library. If not, see
+# <http://www.gnu.org/licenses/>.
+
+""" Simple key/value stores based on GDBM. """
+
+from __future__ import absolute_import
+from .simpledb import SimpleDb, ReadOnlyDict, dump_simple_db, migrate_simple_db, CACHE_COPY, CACHE_READONLY
+from .simpledb import iter_simple_db, export_simple_db, import_simple_db, FORMAT_TEXT, FORMAT_JSONL
+from .sharded import ShardedDb
+from .snapshot import Snapshot, write_snapshot
+from .codec import Codec, register_codec, get_codec
+from .backend import Backend, register_backend, get_backend, detect_backend
@@ -0,0 +1,469 @@
+# Copyright (c) 2014 Nick Douma < n.douma [at] nekoconeko . nl >
+#
+# This file is part of chaos, a.k.a. python-chaos .
+#
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation; either
+# version 3.0 of the License, or (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with this library. If not, see
+# <http://www.gnu.org/licenses/>.
+
+"""
+Storage backends of a SimpleDb.
+
+A backend stores encoded keys and values in a file. Opening a backend returns an object
+with the subset of the interface of a GDBM database that SimpleDb uses: item access,
+in, len(), firstkey(), nextkey(), sync(), reorganize() and close(). Like GDBM, a
+database opened for writing is locked against other writers.
+
+Existing databases are recognized by the first bytes of their file, see
+detect_backend(), so the backend only has to be chosen when creating a database.
+"""
+
+from __future__ import absolute_import
+import fcntl, os, sqlite3, struct, threading, zlib
+
+try:
+	import gdbm
+except ImportError:
+	gdbm = None
+
+class Backend(object):
+	"""
+	Base class for backends. Subclasses set name, error and magic, and implement the
+	methods below, or override open() to return an object that does.
+	"""
+	name = None
+	# Raised when a database is locked by another process
+	error = Exception
+	# The first bytes of every file of this backend, None if they are not fixed
+	magic = None
+
+	def __init__(self, path, mode):
+		"""
+		Open the database.
+
+		Arguments
+		---------
+		path: string
+			Path of the database.
+		mode: string
+			One of "r", "w", "c" or "n", like gdbm.open().
+		"""
+		raise NotImplementedError()
+
+	@classmethod
+	def open(cls, path, mode):
+		"""
+		Open a database with this backend.
+		"""
+		return cls(path, mode)
+
+	@classmethod
+	def files(cls, path):
+		"""
+		Return the paths of all files that may belong to the database at $path.
+		"""
+		return [path]
+
+	@classmethod
+	def data_files(cls, path):
+		"""
+		Return the paths of the files of files() that hold the data of the database at
+		$path, which only change when the data changes.
+		"""
+		return cls.files(path)
+
+	def firstkey(self):
+		"""
+		Return the first key, or None if the database is empty.
+		"""
+		raise NotImplementedError()
+
+	def nextkey(self, key):
+		"""
+		Return the key after $key, or None if it is the last key.
+		"""
+		raise NotImplementedError()
+
+	def sync(self):
+		"""
+		Write all changes to disk.
+		"""
+		raise NotImplementedError()
+
+	def changed_elsewhere(self):
+		"""
+		Return True if other connections changed the database since it was opened. Only
+		needed for backends that allow other writers while a database is open.
+		"""
+		return False
+
+	def reorganize(self):
+		"""
+		Give space used by deleted values back to the file system.
+		"""
+		raise NotImplementedError()
+
+	def close(self):
+		"""
+		Sync and close the database.
+		"""
+		raise NotImplementedError()
+
+class GdbmBackend(Backend):
+	"""
+	Stores values in a GDBM file. Requires the gdbm module.
+	"""
+	name = "gdbm"
+	error = gdbm.error if gdbm else Exception
+
+	@classmethod
+	def open(cls, path, mode):
+		if gdbm is None:
+			raise Exception("The gdbm backend requires the gdbm module")
+		# GDBM databases implement the interface themselves, without a wrapper around
+		# every call
+		return gdbm.open(path, mode)
+
+class SqliteBackend(Backend):
+	"""
+	Stores values in an SQLite database in WAL mode, where readers are not blocked by a
+	writer. Changes are committed by sync().
+	"""
+	name = "sqlite"
+	error = sqlite3.OperationalError
+	magic = b"SQLite format 3\0"
+
+	def __init__(self, path, mode, timeout=10):
+		if mode == "n":
+			for name in self.files(path):
+				if os.path.exists(name):
+					os.unlink(name)
+		elif mode in ("r", "w") and not os.path.exists(path):
+			raise sqlite3.OperationalError("Database {0} does not exist".format(path))
+
+		self.lock = threading.Lock()
+		self.connection = sqlite3.connect(path, timeout=timeout, check_same_thread=False)
+		# Keys and values are byte strings, also when stored as TEXT
+		self.connection.text_factory = bytes
+		self.connection.execute("PRAGMA journal_mode=WAL")
+		self.connection.execute("PRAGMA synchronous=NORMAL")
+		if mode == "r":
+			self.connection.execute("PRAGMA query_only=1")
+		else:
+			self.connection.execute("CREATE TABLE IF NOT EXISTS kv (key TEXT PRIMARY KEY, value BLOB) WITHOUT ROWID")
+			self.connection.commit()
+		# Only changes when other connections commit
+		self.data_version = self._one("PRAGMA data_version")[0]
+
+	@classmethod
+	def files(cls, path):
+		return [path, path + "-wal", path + "-shm"]
+
+	@classmethod
+	def data_files(cls, path):
+		# The shared memory file changes whenever a connection opens the database
+		return [path, path + "-wal"]
+
+	def _one(self, query, args=()):
+		with self.lock:
+			return self.connection.execute(query, args).fetchone()
+
+	def __getitem__(self, key):
+		row = self._one("SELECT value FROM kv WHERE key = ?", (key,))
+		if row is None:
+			raise KeyError(key)
+		return row[0]
+
+	def __setitem__(self, key, value):
+		with self.lock:
+			self.connection.execute("INSERT OR REPLACE INTO kv VALUES (?, ?)", (key, value))
+
+	def __delitem__(self, key):
+		with self.lock:
+			if self.connection.execute("DELETE FROM kv WHERE key = ?", (key,)).rowcount == 0:
+				raise KeyError(key)
+
+	def __contains__(self, key):
+		return self._one("SELECT 1 FROM kv WHERE key = ?", (key,)) is not None
+
+	def __len__(self):
+		return self._one("SELECT COUNT(*) FROM kv")[0]
+
+	def firstkey(self):
+		row = self._one("SELECT key FROM kv ORDER BY key LIMIT 1")
+		return row[0] if row else None
+
+	def nextkey(self, key):
+		row = self._one("SELECT key FROM kv WHERE key > ? ORDER BY key LIMIT 1", (key,))
+		return row[0] if row else None
+
+	def sync(self):
+		with self.lock:
+			self.connection.commit()
+
+	def changed_elsewhere(self):
+		return self._one("PRAGMA data_version")[0] != self.data_version
+
+	def reorganize(self):
+		with self.lock:
+			self.connection.commit()
+			self.connection.execute("VACUUM")
+
+	def close(self):
+		with self.lock:
+			self.connection.commit()
+			self.connection.close()
+
+# Record of the log backend: checksum, operation, key length and value length, followed
+# by the key and value.
+LOG_RECORD = struct.Struct("<IBII")
+LOG_SET = 1
+LOG_DELETE = 2
+
+class LogBackend(Backend):
+	"""
+	Stores values in an append-only log, in pure Python. All keys are kept in memory,
+	with the position of their value in the file, so a lookup is a single read. Every
+	change is appended, and the log is compacted by reorganize(), or by sync() when more
+	than half of it is taken by old values.
+
+	Records that were not written completely, because of a crash, are removed when the
+	log is opened for writing.
+	"""
+	name = "log"
+	error = IOError
+	magic = b"CHLOG001"
+	# sync() compacts the log when it has at least this many bytes of old values
+	compact_min = 1048576
+
+	def __init__(self, path, mode):
+		self.path = path
+		self.readonly = mode == "r"
+		if mode in ("c", "n"):
+			self.file = os.fdopen(os.open(path, os.O_RDWR | os.O_CREAT, 0o644), "r+b")
+		else:
+			self.file = open(path, "rb" if self.readonly else "r+b")
+
+		try:
+			fcntl.flock(self.file.fileno(), (fcntl.LOCK_SH if self.readonly else fcntl.LOCK_EX) | fcntl.LOCK_NB)
+			# Only truncate or initialize the file once it is locked
+			if mode == "n":
+				self.file.truncate(0)
+			if os.fstat(self.file.fileno()).st_size == 0 and not self.readonly:
+				self.file.write(self.magic)
+			self.file.seek(0)
+			if self.file.read(len(self.magic)) != self.magic:
+				raise IOError("{0} is not a log database".format(path))
+			self._load()
+		except Exception:
+			self.file.close()
+			raise
+		self.lock = threading.Lock()
+		self.scan = []
+		self.scan_position = 0
+
+	def _load(self):
+		# Builds the key directory by reading the whole log
+		self.keys = {}
+		self.garbage = 0
+		f = self.file
+		offset = len(self.magic)
+		while True:
+			header = f.read(LOG_RECORD.size)
+			if len(header) < LOG_RECORD.size:
+				break
+			checksum, operation, key_length, value_length = LOG_RECORD.unpack(header)
+			key = f.read(key_length)
+			value = f.read(value_length)
+			if len(value) < value_length or checksum != zlib.crc32(value, zlib.crc32(key, zlib.crc32(header[4:]))) & 0xffffffff:
+				break
+
+			old = self.keys.pop(key, None)
+			if old:
+				self.garbage += LOG_RECORD.size + len(key) + old[1]
+			if operation == LOG_SET:
+				self.keys[key] = (offset + LOG_RECORD.size + key_length, value_length)
+			else:
+				self.garbage += LOG_RECORD.size + key_length
+			offset += LOG_RECORD.size + key_length + value_length
+
+		self.end = offset
+		if not self.readonly and offset < os.fstat(f.fileno()).st_size:
+			f.truncate(offset)
+
+	def _append(self, operation, key, value):
+		# Must be called with self.lock held
+		if self.readonly:
+			raise IOError("Log database {0} was opened read-only".format(self.path))
+		header = struct.pack("<BII", operation, len(key), len(value))
+		checksum = zlib.crc32(value, zlib.crc32(key, zlib.crc32(header))) & 0xffffffff
+		self.file.seek(self.end)
+		self.file.write(struct.pack("<I", checksum) + header + key + value)
+		offset = self.end + LOG_RECORD.size + len(key)
+		self.end = offset + len(value)
+		return offset
+
+	def __getitem__(self, key):
+		# The offset is looked up under the lock, as reorganize() replaces the file
+		with self.lock:
+			offset, length = self.keys[key]
+			self.file.seek(offset)
+			return self.file.read(length)
+
+	def __setitem__(self, key, value):
+		with self.lock:
+			offset = self._append(LOG_SET, key, value)
+			old = self.keys.get(key)
+			if old:
+				self.garbage += LOG_RECORD.size + len(key) + old[1]
+			self.keys[key] = (offset, len(value))
+
+	def __delitem__(self, key):
+		with self.lock:
+			old = self.keys[key]
+			self._append(LOG_DELETE, key, b"")
+			del(self.keys[key])
+			self.garbage += 2 * LOG_RECORD.size + 2 * len(key) + old[1]
+
+	def __contains__(self, key):
+		return key in self.keys
+
+	def __len__(self):
+		return len(self.keys)
+
+	def firstkey(self):
+		self.scan = list(self.keys)
+		self.scan_position = 0
+		return self.scan[0] if self.scan else None
+
+	def nextkey(self, key):
+		if self.scan_position >= len(self.scan) or self.scan[self.scan_position] != key:
+			# Another scan was started meanwhile
+			try:
+				self.scan_position = self.scan.index(key)
+			except ValueError:
+				return None
+		self.scan_position += 1
+		# Skip keys that were deleted since the scan started
+		while self.scan_position < len(self.scan) and not self.scan[self.scan_position] in self.keys:
+			self.scan_position += 1
+		return self.scan[self.scan_position] if self.scan_position < len(self.scan) else None
+
+	def sync(self):
+		if self.readonly:
+			return
+		if self.garbage >= self.compact_min and self.garbage * 2 > self.end:
+			self.reorganize()
+			return
+		with self.lock:
+			self.file.flush()
+			os.fsync(self.file.fileno())
+
+	def reorganize(self):
+		"""
+		Compact the log, by writing all current values to a new file, which then
+		atomically replaces the log.
+		"""
+		if self.readonly:
+			raise IOError("Log database {0} was opened read-only".format(self.path))
+		with self.lock:
+			temp_path = "{0}.{1}.compact".format(self.path, os.getpid())
+			output = open(temp_path, "w+b")
+			try:
+				fcntl.flock(output.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+				output.write(self.magic)
+				end = len(self.magic)
+				keys = {}
+				for key, (offset, length) in self.keys.items():
+					self.file.seek(offset)
+					value = self.file.read(length)
+					header = struct.pack("<BII", LOG_SET, len(key), length)
+					checksum = zlib.crc32(value, zlib.crc32(key, zlib.crc32(header))) & 0xffffffff
+					output.write(struct.pack("<I", checksum) + header + key + value)
+					keys[key] = (end + LOG_RECORD.size + len(key), length)
+					end += LOG_RECORD.size + len(key) + length
+				output.flush()
+				os.fsync(output.fileno())
+				os.rename(temp_path, self.path)
+			except Exception:
+				output.close()
+				if os.path.exists(temp_path):
+					os.unlink(temp_path)
+				raise
+			self.file.close()
+			self.file = output
+			self.keys = keys
+			self.end = end
+			self.garbage = 0
+
+	def close(self):
+		self.sync()
+		self.file.close()
+
+backend_list = {}
+
+def register_backend(backend):
+	"""
+	Register a Backend class under its name, so that databases can be created with it,
+	and recognized by detect_backend().
+
+	Arguments
+	---------
+	backend: class
+		Subclass of Backend.
+	"""
+	backend_list[backend.name] = backend
+
+def get_backend(name):
+	"""
+	Return the Backend class registered under the given name.
+
+	Arguments
+	---------
+	name: string
+		Name of the backend.
+	"""
+	if not name in backend_list:
+		raise Exception("Unknown backend {0}".format(name))
+	return backend_list[name]
+
+def get_default_backend():
+	"""
+	Return the name of the backend for new databases: gdbm, or sqlite if the gdbm
+	module is not available.
+	"""
+	return "gdbm" if gdbm else "sqlite"
+
+def detect_backend(path):
+	"""
+	Return the name of the backend of the database at $path, from the first bytes of its
+	file, or None if it does not exist. Files of backends without magic bytes are
+	assumed to be GDBM files.
+	"""
+	if not os.path.exists(path):
+		return None
+	with open(path, "rb") as f:
+		start = f.read(64)
+	for backend in backend_list.values():
+		if backend.magic and start.startswith(backend.magic):
+			return backend.name
+	return "gdbm"
+
+def get_backend_errors():
+	"""
+	Return a tuple of the exceptions raised by all backends when a database is locked.
+	"""
+	return tuple(set(backend.error for backend in backend_list.values()))
+
+for backend in (GdbmBackend, SqliteBackend, LogBackend):
+	register_backend(backend)
@@ -0,0 +1,144 @@
+# Copyright (c) 2014 Nick Douma < n.douma [at] nekoconeko . nl >
+#
+# This file is part of chaos, a.k.a. python-chaos .
+#
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation; either
+# version 3.0 of the License, or (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with this library. If not, see
+# <http://www.gnu.org/licenses/>.
+
+"""
+Codecs for encoding the values of a SimpleDb as strings.
+
+Every codec has a name, which is stored in the format header of a database, so a
+database is always read with the codec it was written with.
+"""
+
+from __future__ import absolute_import
+import json, marshal
+
+try:
+	import cPickle as pickle
+except ImportError:
+	import pickle
+
+try:
+	import msgpack
+except ImportError:
+	msgpack = None
+
+class Codec(object):
+	"""
+	Base class for codecs. Subclasses set name, and implement encode() and decode().
+	"""
+	name = None
+
+	def encode(self, value):
+		"""
+		Return the given value encoded as a string.
+		"""
+		raise NotImplementedError()
+
+	def decode(self, data):
+		"""
+		Return the value encoded in the given string.
+		"""
+		raise NotImplementedError()
+
+class JsonCodec(Codec):
+	"""
+	Stores values as JSON. Slow, but readable and portable. This is the codec of
+	databases without a format header.
+	"""
+	name = "json"
+
+	def encode(self, value):
+		return json.dumps(value)
+
+	def decode(self, data):
+		return json.loads(data)
+
+class MarshalCodec(Codec):
+	"""
+	Stores values in marshal format. Very fast, but only supports builtin types, and the
+	format may change between Python versions.
+	"""
+	name = "marshal"
+	version = 2
+
+	def encode(self, value):
+		return marshal.dumps(value, self.version)
+
+	def decode(self, data):
+		return marshal.loads(data)
+
+class PickleCodec(Codec):
+	"""
+	Stores values as pickles. Supports most Python objects, but never open a database
+	from an untrusted source with this codec.
+	"""
+	name = "pickle"
+
+	def __init__(self, protocol=2):
+		self.protocol = protocol
+
+	def encode(self, value):
+		return pickle.dumps(value, self.protocol)
+
+	def decode(self, data):
+		return pickle.loads(data)
+
+class MsgpackCodec(Codec):
+	"""
+	Stores values as MessagePack. Fast and compact, and portable like JSON. Requires the
+	msgpack module.
+	"""
+	name = "msgpack"
+
+	def __init__(self):
+		if msgpack is None:
+			raise Exception("The msgpack codec requires the msgpack module")
+
+	def encode(self, value):
+		return msgpack.packb(value, use_bin_type=True)
+
+	def decode(self, data):
+		return msgpack.unpackb(data, raw=False)
+
+codec_list = {}
+
+def register_codec(codec):
+	"""
+	Register a Codec class under its name, so that databases using it can be opened.
+
+	Arguments
+	---------
+	codec: class
+		Subclass of Codec.
+	"""
+	codec_list[codec.name] = codec
+
+def get_codec(name):
+	"""
+	Return a new instance of the Codec registered under the given name.
+
+	Arguments
+	---------
+	name: string
+		Name of the codec.
+	"""
+	if not name in codec_list:
+		raise Exception("Unknown codec {0}".format(name))
+	return codec_list[name]()
+
+for codec in (JsonCodec, MarshalCodec, PickleCodec, MsgpackCodec):
+	register_codec(codec)
@@ -0,0 +1,316 @@
+# Copyright (c) 2014 Nick Douma < n.douma [at] nekoconeko . nl >
+#
+# This file is part of chaos, a.k.a. python-chaos .
+#
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation; either
+# version 3.0 of the License, or (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with this library. If not, see
+# <http://www.gnu.org/licenses/>.
+
+""" A key/value store spread over multiple SimpleDb files. """
+
+from __future__ import absolute_import
+import collections, contextlib, glob, heapq, json, os, time, zlib
+from .simpledb import SimpleDb, MISSING
+from .backend import get_backend_errors
+
+MANIFEST = "shards.json"
+
+class ShardedDb(collections.MutableMapping):
+	"""
+	Implements the same dict-like interface as SimpleDb, but hashes keys over a number
+	of SimpleDb files in a directory.
+
+	Backends allow a single writer per file, which keeps the file locked while it is open.
+	Shards are therefore only opened when a key in them is first used, so independent
+	processes can write to different shards at the same time. Opening a shard that is
+	locked by another process is retried for lock_timeout seconds. Use release() to
+	close all opened shards, and let other processes use them.
+
+	The number of shards of an existing store is read from its manifest, and can not be
+	changed. Iteration goes over all shards one by one. Scans over all shards, such as
+	iteration and len(), only keep a shard open while scanning it, unless it was open
+	already.
+	"""
+
+	def __init__(self, path, shards=16, mode="c", sync=True, lock_timeout=10, **kwargs):
+		"""
+		Store the given parameters internally and prepare for opening the store later.
+
+		Arguments
+		---------
+		path: string
+			Directory holding the shards, created if needed.
+		shards: int
+			Number of shards of a new store.
+		mode: string
+			What mode to use when opening the shards, see SimpleDb. Only "c" and "n"
+			create a missing store. With "n", all shards are removed when the store is
+			opened.
+		sync: boolean
+			If set to True, data will be flushed to disk after every change.
+		lock_timeout: int
+			Maximum number of seconds to wait for a shard that is locked by another
+			process.
+		**kwargs
+			Other keyword arguments to pass to every SimpleDb, such as cache_size or
+			codec.
+		"""
+		self.path = path
+		self.shards = shards
+		self.mode = mode
+		self.sync = sync
+		self.lock_timeout = lock_timeout
+		self.kwargs = kwargs
+		self.dbs = None
+
+	def _checkopen(self):
+		if self.dbs == None:
+			raise RuntimeError("ShardedDb was not opened")
+
+	def open(self):
+		"""
+		Prepare the store for use. Shards are opened when they are first used.
+		"""
+		return self.__enter__()
+
+	def close(self):
+		"""
+		Close all opened shards.
+		"""
+		self.__exit__(None, None, None)
+
+	def __enter__(self):
+		manifest = os.path.join(self.path, MANIFEST)
+		if self.mode == "n":
+			# Including the files next to the shards, such as indexes and SQLite logs
+			for shard in glob.glob(os.path.join(self.path, "shard-*.db*")):
+				os.unlink(shard)
+			if os.path.exists(manifest):
+				os.unlink(manifest)
+
+		if os.path.exists(manifest):
+			with open(manifest) as f:
+				self.shards = json.load(f)["shards"]
+		elif not self.mode in ("c", "n"):
+			raise RuntimeError("ShardedDb {0} does not exist".format(self.path))
+		else:
+			if not os.path.isdir(self.path):
+				os.makedirs(self.path)
+			self.dbs = {}
+			# Create all shards up front, so readers never find a shard missing
+			for index in range(self.shards):
+				self._shard(index)
+			self.release()
+			# Write the manifest atomically, other processes may be opening the store too
+			temp = "{0}.{1}".format(manifest, os.getpid())
+			with open(temp, "w") as f:
+				json.dump({"shards": self.shards, "version": 1}, f)
+			os.rename(temp, manifest)
+
+		self.dbs = {}
+		return self
+
+	def __exit__(self, exc_type, exc_value, traceback):
+		self._checkopen()
+		self.release()
+		self.dbs = None
+
+	def release(self):
+		"""
+		Close all opened shards, syncing them to disk. They are opened again when they
+		are used.
+		"""
+		self._checkopen()
+		dbs, self.dbs = self.dbs, {}
+		for db in dbs.values():
+			db.close()
+
+	def shard_for(self, key):
+		"""
+		Returns the number of the shard the given key is stored in.
+		"""
+		return (zlib.crc32(key) & 0xffffffff) % self.shards
+
+	def _shard(self, index):
+		self._checkopen()
+		if index in self.dbs:
+			return self.dbs[index]
+
+		db = SimpleDb(os.path.join(self.path, "shard-{0:03d}.db".format(index)),
+			mode="c" if self.mode == "n" else self.mode, sync=self.sync, **self.kwargs)
+		deadline = time.time() + self.lock_timeout
+		pause = 0.001
+		while True:
+			try:
+				db.open()
+				break
+			except get_backend_errors():
+				if time.time() > deadline:
+					raise
+				time.sleep(pause)
+				pause = min(pause * 2, 0.1)
+		self.dbs[index] = db
+		return db
+
+	@contextlib.contextmanager
+	def _visit(self, index):
+		# Yields a shard for a scan over all shards. A shard that was not open yet is
+		# closed again afterwards, so a scan does not keep every shard locked.
+		opened = not index in self.dbs
+		db = self._shard(index)
+		try:
+			yield db
+		finally:
+			if opened and self.dbs is not None and self.dbs.get(index) is db:
+				del(self.dbs[index])
+				db.close()
+
+	def _each(self, action):
+		# Returns a list with the result of action for every shard, see _visit()
+		self._checkopen()
+		results = []
+		for index in range(self.shards):
+			with self._visit(index) as db:
+				results.append(action(db))
+		return results
+
+	def _group(self, keys):
+		# Returns a dict of shard number to the list of keys in that shard
+		groups = collections.defaultdict(list)
+		for key in keys:
+			groups[self.shard_for(key)].append(key)
+		return groups
+
+	def flush(self):
+		"""
+		Sync all opened shards to disk, see SimpleDb.flush().
+		"""
+		self._checkopen()
+		for db in self.dbs.values():
+			db.flush()
+
+	def get_many(self, keys, default=MISSING, ordered=False):
+		"""
+		Retrieve the values of many keys at once, see SimpleDb.get_many().
+		"""
+		keys = list(keys)
+		values = {}
+		for index, shard_keys in self._group(keys).items():
+			values.update(self._shard(index).get_many(shard_keys, default))
+		if not ordered:
+			return values
+		if len(values) < len(set(keys)):
+			raise KeyError(next(key for key in keys if not key in values))
+		return [values[key] for key in keys]
+
+	def set_many(self, items, ttl=None):
+		"""
+		Set many keys at once, with a single sync per shard, see SimpleDb.set_many().
+		"""
+		if isinstance(items, collections.Mapping):
+			items = items.items()
+		groups = collections.defaultdict(list)
+		for key, value in items:
+			groups[self.shard_for(key)].append((key, value))
+		for index, shard_items in groups.items():
+			self._shard(index).set_many(shard_items, ttl)
+
+	def delete_many(self, keys, ignore_missing=True):
+		"""
+		Delete many keys at once, with a single sync per shard, see SimpleDb.delete_many().
+		Returns the number of keys that were deleted.
+		"""
+		groups = self._group(keys)
+		if not ignore_missing:
+			for index, shard_keys in groups.items():
+				missing = set(shard_keys) - set(self._shard(index).get_many(shard_keys))
+				if missing:
+					raise KeyError(missing.pop())
+		return sum(self._shard(index).delete_many(shard_keys) for index, shard_keys in groups.items())
+
+	def set(self, key, value, ttl=None):
+		"""
+		Set a key with a ttl, see SimpleDb.set().
+		"""
+		self._shard(self.shard_for(key)).set(key, value, ttl)
+
+	def sweep(self, reorganize=True):
+		"""
+		Remove all expired keys from all shards, one shard at a time, see SimpleDb.sweep().
+		Returns the number of keys removed.
+		"""
+		return sum(self._each(lambda db: db.sweep(reorganize)))
+
+	def expiry_stats(self):
+		"""
+		Returns the sums of SimpleDb.expiry_stats() over the opened shards, with the size of
+		all shard files together. last_sweep is left out.
+		"""
+		self._checkopen()
+		stats = {"expired": 0, "swept": 0, "sweeps": 0, "size": 0}
+		for db in self.dbs.values():
+			for name, value in db.expiry_stats().items():
+				if name in stats:
+					stats[name] += value or 0
+		return stats
+
+	def update(self, *args, **kwargs):
+		"""
+		Like dict.update(), but all changes are applied at once, see set_many().
+		"""
+		self.set_many(dict(*args, **kwargs).items())
+
+	def iter_range(self, start=None, end=None):
+		"""
+		Iterate over the keys from $start up to, but not including, $end, in sorted
+		order, by merging the shards. See SimpleDb.iter_range(), which is cheap when the
+		shards are opened with index=True.
+		"""
+		return heapq.merge(*self._each(lambda db: list(db.iter_range(start, end))))
+
+	def iter_prefix(self, prefix):
+		"""
+		Iterate over the keys starting with $prefix, in sorted order. See iter_range().
+		"""
+		return heapq.merge(*self._each(lambda db: list(db.iter_prefix(prefix))))
+
+	def count_range(self, start=None, end=None):
+		"""
+		Count the keys from $start up to, but not including, $end.
+		"""
+		return sum(self._each(lambda db: db.count_range(start, end)))
+
+	def count_prefix(self, prefix):
+		"""
+		Count the keys starting with $prefix.
+		"""
+		return sum(self._each(lambda db: db.count_prefix(prefix)))
+
+	def __getitem__(self, key):
+		return self._shard(self.shard_for(key))[key]
+
+	def __setitem__(self, key, value):
+		self._shard(self.shard_for(key))[key] = value
+
+	def __delitem__(self, key):
+		del(self._shard(self.shard_for(key))[key])
+
+	def __iter__(self):
+		self._checkopen()
+		for index in range(self.shards):
+			with self._visit(index) as db:
+				for key in db:
+					yield key
+
+	def __len__(self):
+		return sum(self._each(len))
@@ -0,0 +1,1160 @@
+# Copyright (c) 2014 Nick Douma < n.douma [at] nekoconeko . nl >
+#
+# This file is part of chaos, a.k.a. python-chaos .
+#
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation; either
+# version 3.0 of the License, or (at your option) any later version.
+# 
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# Lesser General Public License for more details.
+# 
+# You should have received a copy of the GNU Lesser General Public
+# License along with this library. If not, see 
+# <http://www.gnu.org/licenses/>.
+
+from __future__ import absolute_import
+import json, bisect, collections, contextlib, marshal, os, struct, threading, time
+from ..threading.scheduler import Scheduler
+from .codec import JsonCodec, get_codec
+from .backend import get_backend, get_default_backend, detect_backend
+
+# Cache modes
+CACHE_COPY = "copy"
+CACHE_READONLY = "readonly"
+
+# Marks a key that was deleted in a transaction
+DELETED = object()
+# Marks that no default was given to get_many()
+MISSING = object()
+
+# Export formats
+FORMAT_TEXT = "text"
+FORMAT_JSONL = "jsonl"
+
+# Reserved key holding the format header, a JSON encoded dict with the keys codec,
+# version and ttl. Databases without a header are JSON encoded.
+HEADER_KEY = "__chaos_simpledb__"
+# Version 2 adds ttl, databases without it are still written as version 1
+FORMAT_VERSION = 2
+
+# In databases with ttl in their header, every value is prefixed by the UNIX timestamp
+# at which it expires, or 0 if it never expires.
+EXPIRY = struct.Struct("<d")
+
+# Suffix of the file holding the sorted key index, see SimpleDb.index
+INDEX_SUFFIX = ".keys"
+INDEX_VERSION = 1
+
+def dump_simple_db(path):
+	"""
+	Dumps a SimpleDb as string in the following format:
+	<key>: <json-encoded string>
+
+	The whole dump is kept in memory, use export_simple_db() for large databases.
+	"""
+	return "\n".join(iter_simple_db(path))
+
+def iter_simple_db(path, format=FORMAT_TEXT):
+	"""
+	Generate the lines of a dump of a SimpleDb one by one, without a trailing newline.
+	Only one value is kept in memory at a time.
+
+	Arguments
+	---------
+	path: string
+		Path of the database.
+	format: string
+		- FORMAT_TEXT: <key>: <json-encoded value>, like dump_simple_db().
+		- FORMAT_JSONL: {"key": <key>, "value": <value>}, one JSON object per line.
+		  Unlike FORMAT_TEXT, this can be imported for any key.
+	"""
+	if not format in (FORMAT_TEXT, FORMAT_JSONL):
+		raise Exception("Unknown format {0}".format(format))
+
+	with SimpleDb(path, mode="r", sync=False) as db:
+		for key in db:
+			# For JSON databases, dumpvalue() returns the stored string without decoding it
+			try:
+				value = db.dumpvalue(key)
+			except KeyError:
+				# Expired
+				continue
+			if format == FORMAT_TEXT:
+				yield "{0}: {1}".format(key, value)
+			else:
+				yield '{{"key": {0}, "value": {1}}}'.format(json.dumps(key), value)
+
+def export_simple_db(path, output, format=FORMAT_TEXT):
+	"""
+	Write a dump of a SimpleDb to a file object, line by line. Returns the number of
+	keys written.
+
+	Arguments
+	---------
+	path: string
+		Path of the database.
+	output: file object
+		File to write to.
+	format: string
+		FORMAT_TEXT or FORMAT_JSONL, see iter_simple_db().
+	"""
+	count = 0
+	for line in iter_simple_db(path, format):
+		output.write(line)
+		output.write("\n")
+		count += 1
+	return count
+
+def _parse_text_line(line):
+	# Returns the key and value of a line in FORMAT_TEXT
+	start = 0
+	while True:
+		index = line.find(": ", start)
+		if index < 0:
+			raise ValueError("Invalid line: {0}".format(line))
+		try:
+			return line[:index], json.loads(line[index + 2:])
+		except ValueError:
+			start = index + 1
+
+def import_simple_db(path, input, format=FORMAT_JSONL, batch_size=1000, mode="c", codec="json", backend=None):
+	"""
+	Read a dump made by export_simple_db() from a file object, and write it to a
+	SimpleDb, using set_many() for every $batch_size keys. Returns the number of keys
+	read.
+
+	In FORMAT_TEXT, the key ends at the first ": " that is followed by valid JSON, so
+	keys containing ": " may be imported incorrectly. Empty lines are skipped.
+
+	Arguments
+	---------
+	path: string
+		Path of the database.
+	input: file object
+		File to read from.
+	format: string
+		FORMAT_TEXT or FORMAT_JSONL, see iter_simple_db().
+	batch_size: int
+		Number of keys to write at once.
+	mode: string
+		Mode to open the database with, see SimpleDb. Use "n" to replace its contents.
+	codec: string
+		Codec to use if a new database is created, see SimpleDb.
+	backend: string
+		Backend to use if a new database is created, see SimpleDb.
+	"""
+	if not format in (FORMAT_TEXT, FORMAT_JSONL):
+		raise Exception("Unknown format {0}".format(format))
+
+	count = 0
+	batch = []
+	# Syncing once when closing is enough for a bulk import
+	with SimpleDb(path, mode=mode, sync=False, codec=codec, backend=backend) as db:
+		for line in input:
+			line = line.rstrip("\r\n")
+			if not line:
+				continue
+			if format == FORMAT_TEXT:
+				batch.append(_parse_text_line(line))
+			else:
+				item = json.loads(line)
+				batch.append((item["key"].encode("utf-8"), item["value"]))
+			if len(batch) >= batch_size:
+				db.set_many(batch)
+				count += len(batch)
+				batch = []
+		db.set_many(batch)
+		count += len(batch)
+	return count
+
+def migrate_simple_db(path, codec):
+	"""
+	Rewrite a SimpleDb using the given codec. The database is converted into a new file,
+	which then atomically replaces the original, using the same backend. No other process may use the database
+	during the migration. Returns False if the database already uses the codec.
+
+	Expiry times are kept, and keys that already expired are left out.
+
+	Arguments
+	---------
+	path: string
+		Path of the database.
+	codec: string
+		Name of the codec to convert to, see chaos.db.codec.
+	"""
+	target_path = path + ".migrate"
+	with SimpleDb(path, mode="r", sync=False) as source:
+		if source.codec.name == codec:
+			return False
+		ttl = 0 if source.expires else None
+		with SimpleDb(target_path, mode="n", sync=False, codec=codec, ttl=ttl, backend=source.backend.name) as target:
+			for key in source:
+				try:
+					expires_at, value = source._unpack(key, source.db[key])
+				except KeyError:
+					continue
+				value = target.codec.encode(source.codec.decode(value))
+				if target.expires:
+					value = EXPIRY.pack(expires_at) + value
+				target.db[key] = value
+	os.rename(target_path, path)
+	return True
+
+class ReadOnlyDict(collections.Mapping):
+	"""
+	Read-only view of a dict, as returned by a SimpleDb with a read-only cache.
+	"""
+	def __init__(self, data):
+		self._data = data
+
+	def __getitem__(self, key):
+		return self._data[key]
+
+	def __iter__(self):
+		return iter(self._data)
+
+	def __len__(self):
+		return len(self._data)
+
+	def __repr__(self):
+		return "ReadOnlyDict({0!r})".format(self._data)
+
+def _freeze(value):
+	"""
+	Read-only version of a decoded JSON value: dicts become ReadOnlyDicts, and lists
+	become tuples.
+	"""
+	if isinstance(value, dict):
+		return ReadOnlyDict(dict((key, _freeze(item)) for key, item in value.items()))
+	if isinstance(value, list):
+		return tuple(_freeze(item) for item in value)
+	return value
+
+class SimpleDb(collections.MutableMapping):
+	"""
+	Implements a simple key/value store based on GDBM. Values are stored as JSON strings,
+	to allow for more complex values than GDBM itself can provide. Faster codecs can be
+	used for new databases, see codec, and other storage backends, see backend.
+
+	This class implements the full MutableMapping ABC, which means that after using open(),
+	or using with, this class behaves as a dict. All changes will be saved to disk after
+	using close() or ending the with statement.
+
+	Optionally, decoded values of recently used keys are kept in an LRU cache, see
+	cache_size.
+
+	Many changes can be applied at once using transaction() or update(), which sync to
+	disk only once. Alternatively, set_group_commit() syncs after a number of changes
+	or a delay, instead of after every change.
+
+	Optionally, a sorted index of all keys is kept in memory, see index. It makes
+	iter_prefix(), iter_range() and len() cheap for large databases.
+
+	Databases created with a ttl store an expiry time with every value, see set().
+	Reading an expired key raises a KeyError, and removes it unless the database is
+	read-only. Iteration skips expired keys. Expired keys that are not read stay in the
+	file until sweep() is called, and are included by len() until then.
+	"""
+
+	def __init__(self, path, mode = "c", sync=True, cache_size=0, cache_mode=CACHE_COPY, codec="json", index=False, ttl=None, backend=None):
+		"""
+		Store the given parameters internally and prepare for opening the database later.
+
+		Arguments
+		---------
+		path: string
+			Path where to create or open the database
+		mode: string
+			What mode to use when opening the database:
+			- "r" (read-only)
+			- "w" (read-write)
+			- "c" (read-write, create when not exists)
+			- "n" (read-write, always create new file)
+		sync: boolean
+			If set to True, data will be flushed to disk after every change.
+		cache_size: int
+			Number of decoded values to cache. The cache is disabled when 0.
+		cache_mode: string
+			How cached values are protected against changes by the caller:
+			- CACHE_COPY: every lookup returns a fresh copy. Values are cached in marshal
+			  format, which decodes several times faster than JSON.
+			- CACHE_READONLY: lookups return read-only values, where dicts are
+			  ReadOnlyDicts and lists are tuples. This is faster than copying.
+		codec: string
+			Name of the codec to encode values with when creating a new database, see
+			chaos.db.codec. Existing databases are always read and written with the codec
+			recorded in their format header, use migrate_simple_db() to convert them.
+		index: boolean
+			If set to True, keep a sorted list of all keys in memory. It is saved next to
+			the database in <path>.keys when closing, and loaded again when opening, unless
+			the database was changed without it, in which case it is rebuilt with a full
+			scan. Changes made by other processes while the database is open are not seen.
+		ttl: int
+			Default number of seconds keys live, or 0 to keep keys forever unless given a
+			ttl in set(). A new database created with a ttl, including 0, stores expiry
+			times. Databases that do, are opened with expiry support regardless of ttl.
+		backend: string
+			Name of the backend to store a new database with, see chaos.db.backend:
+			- "gdbm": a GDBM file, the default when the gdbm module is available.
+			- "sqlite": an SQLite database in WAL mode, the default otherwise.
+			- "log": an append-only log, in pure Python.
+			Existing databases are always opened with the backend they were created with.
+		"""
+		if not cache_mode in (CACHE_COPY, CACHE_READONLY):
+			raise Exception("Unknown cache mode {0}".format(cache_mode))
+
+		self.path = path
+		self.mode = mode
+		self.sync = sync
+		self.db = None
+		self.backend_name = backend
+		self.backend = None
+		self.new_codec = codec
+		self.codec = JsonCodec()
+		self.has_header = False
+		# Syncing is done by SimpleDb itself, instead of using the "s" mode of GDBM
+		self.lock = threading.RLock()
+		# Changes of the running transaction, only visible to the Thread that runs it
+		self.pending = None
+		self.pending_thread = None
+		self.unsynced = 0
+		self.group_writes = None
+		self.group_delay = None
+		self.flusher = None
+		self.cache_size = cache_size
+		self.cache_mode = cache_mode
+		self.cache = collections.OrderedDict()
+		self.hits = 0
+		self.misses = 0
+		self.evictions = 0
+		self.use_index = index
+		self.index = None
+		self.index_signature = None
+		self.open_signature = None
+		self.ttl = ttl
+		self.expires = False
+		self.expired = 0
+		self.swept = 0
+		self.sweeps = 0
+		self.last_sweep = None
+		self.sweep_interval = None
+		self.sweep_reorganize = True
+		self.sweeper = None
+		self.walks = 0
+		self.expire_later = []
+
+	def _checkopen(self):
+		if self.db == None:
+			raise RuntimeError("SimpleDb was not opened")
+
+	def open(self):
+		"""
+		Open the GDBM database internally.
+		"""
+		return self.__enter__()
+
+	def close(self):
+		"""
+		Close the internal GDBM database.
+		"""
+		self.__exit__(None, None, None)
+
+	def set_group_commit(self, writes=None, delay=None):
+		"""
+		Instead of syncing to disk after every change, sync after $writes changes, or
+		$delay milliseconds after a change, whichever comes first. A Scheduler thread
+		handles the delay. Call without arguments to sync after every change again.
+
+		Changes are visible immediately, but the most recent changes can be lost when
+		the process crashes. Only has effect if sync is True.
+
+		Arguments
+		---------
+		writes: int
+			Number of changes after which to sync.
+		delay: int
+			Maximum number of milliseconds between a change and the next sync.
+		"""
+		with self.lock:
+			self._stop_flusher()
+			self.group_writes = writes
+			self.group_delay = delay
+			if self.db is not None:
+				self.flush()
+				self._start_flusher()
+
+	def _start_flusher(self):
+		if self.sync and self.group_delay:
+			self.flusher = Scheduler(self.group_delay / 1000.0, self.flush, "simpledb.flusher")
+			self.flusher.daemon = True
+			self.flusher.start()
+
+	def _stop_flusher(self):
+		if self.flusher:
+			self.flusher.stop = True
+			self.flusher = None
+
+	def flush(self):
+		"""
+		Sync all changes to disk now, if any were not synced yet.
+		"""
+		with self.lock:
+			if self.db is not None and self.unsynced:
+				self.db.sync()
+				self.unsynced = 0
+
+	def _commit(self, writes):
+		# Must be called with self.lock held, after applying $writes changes.
+		if not self.sync:
+			return
+		self.unsynced += writes
+		if not (self.group_writes or self.group_delay) or (self.group_writes and self.unsynced >= self.group_writes):
+			self.db.sync()
+			self.unsynced = 0
+
+	@contextlib.contextmanager
+	def transaction(self):
+		"""
+		Buffer all changes made inside the with statement in memory, and apply them in
+		one pass, followed by a single sync, at the end of it:
+
+			with db.transaction():
+				db["a"] = 1
+				del db["b"]
+
+		Inside the transaction, reads see the buffered changes. If an exception is raised,
+		all changes are discarded. Other threads do not see the changes until the
+		transaction ends, and can not make changes or iterate over the keys until then.
+		Nested transactions are part of the outer transaction.
+		"""
+		self._checkopen()
+		with self.lock:
+			if self.pending is not None:
+				yield self
+				return
+
+			self.pending_thread = threading.current_thread()
+			self.pending = {}
+			try:
+				yield self
+			except BaseException:
+				self.pending = self.pending_thread = None
+				raise
+
+			pending, self.pending = self.pending, None
+			self.pending_thread = None
+			added, removed = [], []
+			for key, value in pending.items():
+				if value is DELETED:
+					if key in self.db:
+						del(self.db[key])
+						removed.append(key)
+				else:
+					if self.index is not None and not key in self.db:
+						added.append(key)
+					self.db[key] = value
+			self._index_add(added)
+			self._index_remove(removed)
+			if pending and self.sync:
+				self.db.sync()
+				self.unsynced = 0
+
+	def _pending(self):
+		# Returns the changes of the transaction run by the current Thread, or None
+		pending = self.pending
+		if pending is not None and self.pending_thread is threading.current_thread():
+			return pending
+		return None
+
+	def update(self, *args, **kwargs):
+		"""
+		Like dict.update(), but all changes are applied at once, see set_many().
+		"""
+		self.set_many(dict(*args, **kwargs).items())
+
+	def get_many(self, keys, default=MISSING, ordered=False):
+		"""
+		Retrieve the values of many keys at once.
+
+		Returns a dict of key to value. Missing keys are left out, or get $default if it
+		is given. With $ordered = True, returns a list of values in the order of the keys
+		instead, and raises a KeyError for missing keys if no $default is given.
+
+		Arguments
+		---------
+		keys: iterable
+			The keys to retrieve.
+		default: object
+			Value to use for missing keys.
+		ordered: boolean
+			If True, return a list instead of a dict.
+		"""
+		self._checkopen()
+		values = [] if ordered else {}
+		if self.cache_size or self._pending() is not None:
+			get = self.__getitem__
+		else:
+			get = self._get_raw
+
+		for key in keys:
+			try:
+				value = get(key)
+			except KeyError:
+				if default is not MISSING:
+					value = default
+				elif ordered:
+					raise
+				else:
+					continue
+			if ordered:
+				values.append(value)
+			else:
+				values[key] = value
+		return values
+
+	def _get_raw(self, key):
+		# Lookup without cache or transaction, used by get_many()
+		if key == HEADER_KEY:
+			raise KeyError(key)
+		if self.expires:
+			return self.codec.decode(self._unpack(key, self.db[key])[1])
+		return self.codec.decode(self.db[key])
+
+	def _exists(self, key):
+		# Checks whether a key exists without decoding its value
+		if key == HEADER_KEY:
+			return False
+		pending = self._pending()
+		if pending is not None and key in pending:
+			return pending[key] is not DELETED
+		return key in self.db
+
+	def set_many(self, items, ttl=None):
+		"""
+		Set many keys at once, followed by a single sync. All values are encoded before
+		anything is written, so a value that can not be encoded changes nothing.
+
+		Arguments
+		---------
+		items: dict or iterable
+			A dict, or an iterable of (key, value) tuples.
+		ttl: int
+			Number of seconds the keys live, see set().
+		"""
+		self._checkopen()
+		if isinstance(items, collections.Mapping):
+			items = items.items()
+		encode = self.codec.encode
+		prefix = self._expiry(ttl)
+		encoded = []
+		for key, value in items:
+			if key == HEADER_KEY:
+				raise KeyError("Key {0} is reserved".format(key))
+			encoded.append((key, prefix + encode(value)))
+
+		with self.lock:
+			for key, value in encoded:
+				self.cache.pop(key, None)
+			if self.pending is not None:
+				self.pending.update(encoded)
+				return
+			db = self.db
+			if self.index is not None:
+				self._index_add(set(key for key, value in encoded if not key in db))
+			for key, value in encoded:
+				db[key] = value
+			if encoded:
+				self._commit(len(encoded))
+
+	def delete_many(self, keys, ignore_missing=True):
+		"""
+		Delete many keys at once, followed by a single sync. Returns the number of keys
+		that were deleted.
+
+		Arguments
+		---------
+		keys: iterable
+			The keys to delete.
+		ignore_missing: boolean
+			If False, raise a KeyError before deleting anything when a key is missing.
+		"""
+		self._checkopen()
+		with self.lock:
+			existing = []
+			for key in set(keys):
+				if self._exists(key):
+					existing.append(key)
+				elif not ignore_missing:
+					raise KeyError(key)
+
+			for key in existing:
+				self.cache.pop(key, None)
+			if self.pending is not None:
+				for key in existing:
+					self.pending[key] = DELETED
+				return len(existing)
+			db = self.db
+			for key in existing:
+				del(db[key])
+			self._index_remove(existing)
+			if existing:
+				self._commit(len(existing))
+			return len(existing)
+
+	def _index_add(self, keys):
+		# Adds keys that are not in the index yet
+		if self.index is None or not keys:
+			return
+		if len(keys) == 1:
+			for key in keys:
+				bisect.insort(self.index, key)
+		else:
+			# Sorting a sorted list with a run of new keys appended is close to linear
+			self.index.extend(keys)
+			self.index.sort()
+
+	def _index_remove(self, keys):
+		# Removes keys that are in the index
+		if self.index is None or not keys:
+			return
+		if len(keys) < 16:
+			index = self.index
+			for key in keys:
+				position = bisect.bisect_left(index, key)
+				if position < len(index) and index[position] == key:
+					del(index[position])
+		else:
+			keys = set(keys)
+			self.index = [key for key in self.index if not key in keys]
+
+	def _file_signature(self):
+		# Empty files are left out, as opening a database may create an empty log
+		signature = []
+		for name in self.backend.data_files(self.path):
+			if os.path.exists(name):
+				stat = os.stat(name)
+				if stat.st_size:
+					signature.append([name, stat.st_ino, stat.st_size, stat.st_mtime])
+		return signature
+
+	def _load_index(self, current):
+		# $current is the signature of the opened files, or None to not use a saved index
+		if current is not None:
+			try:
+				with open(self.path + INDEX_SUFFIX, "rb") as f:
+					version, signature, index = marshal.load(f)
+				if version == INDEX_VERSION and signature == current:
+					self.index = index
+					self.index_signature = signature
+					return
+			except (IOError, OSError, EOFError, ValueError, TypeError):
+				pass
+		key = self.db.firstkey()
+		index = []
+		while key != None:
+			if key != HEADER_KEY:
+				index.append(key)
+			key = self.db.nextkey(key)
+		index.sort()
+		self.index = index
+		self.index_signature = None
+
+	def _index_stale(self):
+		# Returns True if the database may have been changed by other connections while
+		# it was open, so the index may be missing their changes. Must be called before
+		# closing.
+		changed_elsewhere = getattr(self.db, "changed_elsewhere", None)
+		if changed_elsewhere is not None:
+			return changed_elsewhere()
+		if self.mode == "r":
+			return self._file_signature() != self.open_signature
+		# Other backends allow a single writer, which is this one
+		return False
+
+	def _save_index(self):
+		# Called after closing the database, so the signature matches the final file
+		temp_path = "{0}{1}.{2}.tmp".format(self.path, INDEX_SUFFIX, os.getpid())
+		try:
+			signature = self._file_signature()
+			if signature == self.index_signature:
+				return
+			with open(temp_path, "wb") as f:
+				marshal.dump((INDEX_VERSION, signature, self.index), f)
+			os.rename(temp_path, self.path + INDEX_SUFFIX)
+		except (IOError, OSError):
+			# A missing or stale index is rebuilt on the next open
+			if os.path.exists(temp_path):
+				os.unlink(temp_path)
+
+	def iter_range(self, start=None, end=None):
+		"""
+		Iterate over the keys from $start up to, but not including, $end, in sorted
+		order. Without an index, or inside a transaction, this is a full scan.
+
+		Arguments
+		---------
+		start: string
+			First key, or None to start at the lowest key.
+		end: string
+			Key to stop before, or None to continue to the highest key.
+		"""
+		self._checkopen()
+		if self.index is None or self._pending() is not None:
+			keys = sorted(key for key in self if (start is None or key >= start) and (end is None or key < end))
+			return iter(keys)
+
+		index = self.index
+		first = 0 if start is None else bisect.bisect_left(index, start)
+		last = len(index) if end is None else bisect.bisect_left(index, end)
+		# A copy, so changes while iterating do not skip keys
+		return iter(index[first:last])
+
+	def _prefix_end(self, prefix):
+		# The first string after all strings starting with prefix, None if there is none
+		end = prefix.rstrip(b"\xff")
+		if not end:
+			return None
+		return end[:-1] + chr(ord(end[-1]) + 1)
+
+	def iter_prefix(self, prefix):
+		"""
+		Iterate over the keys starting with $prefix, in sorted order. Without an index,
+		or inside a transaction, this is a full scan.
+
+		Arguments
+		---------
+		prefix: string
+			The prefix to look for.
+		"""
+		return self.iter_range(prefix or None, self._prefix_end(prefix))
+
+	def count_range(self, start=None, end=None):
+		"""
+		Count the keys from $start up to, but not including, $end. See iter_range().
+		"""
+		self._checkopen()
+		if self.index is None or self._pending() is not None:
+			return sum(1 for key in self.iter_range(start, end))
+		first = 0 if start is None else bisect.bisect_left(self.index, start)
+		last = len(self.index) if end is None else bisect.bisect_left(self.index, end)
+		return max(0, last - first)
+
+	def count_prefix(self, prefix):
+		"""
+		Count the keys starting with $prefix. See iter_prefix().
+		"""
+		return self.count_range(prefix or None, self._prefix_end(prefix))
+
+	def cache_stats(self):
+		"""
+		Returns a dict with the size, capacity, hits, misses and evictions of the cache.
+		"""
+		return {
+			"size": len(self.cache),
+			"capacity": self.cache_size,
+			"hits": self.hits,
+			"misses": self.misses,
+			"evictions": self.evictions
+		}
+
+	def clear_cache(self):
+		"""
+		Remove all values from the cache. The statistics are kept.
+		"""
+		with self.lock:
+			self.cache.clear()
+
+	def dumpvalue(self, key):
+		"""
+		Retrieves the given key, and returns it as a JSON encoded string.
+		"""
+		self._checkopen()
+		if key == HEADER_KEY:
+			raise KeyError(key)
+		if isinstance(self.codec, JsonCodec) and not key in (self._pending() or {}):
+			return self._unpack(key, self.db[key])[1]
+		return json.dumps(self[key])
+
+	def _expiry(self, ttl):
+		# Returns the expiry prefix for a new value with the given ttl
+		if not self.expires:
+			if ttl:
+				raise Exception("SimpleDb {0} does not store expiry times".format(self.path))
+			return b""
+		if ttl is None:
+			ttl = self.ttl
+		return EXPIRY.pack(time.time() + ttl if ttl else 0.0)
+
+	def _unpack(self, key, value):
+		# Returns the expiry time and the encoded value of a stored value. Raises a
+		# KeyError when it expired.
+		if not self.expires:
+			return 0.0, value
+		expires_at = EXPIRY.unpack_from(value)[0]
+		if expires_at and expires_at <= time.time():
+			self._expire(key)
+			raise KeyError(key)
+		return expires_at, value[EXPIRY.size:]
+
+	def _expire(self, key):
+		# Removes a key that was found to be expired, unless it was changed meanwhile
+		self.expired += 1
+		if self.mode == "r" or self.pending is not None:
+			return
+		with self.lock:
+			if self.walks:
+				# Removing a key while walking over the keys can end the walk early
+				self.expire_later.append(key)
+				return
+			self._remove_expired(key)
+
+	def _remove_expired(self, key):
+		with self.lock:
+			self.cache.pop(key, None)
+			if not key in self.db:
+				return
+			expires_at = EXPIRY.unpack_from(self.db[key])[0]
+			if expires_at and expires_at <= time.time():
+				del(self.db[key])
+				self._index_remove([key])
+				self._commit(1)
+
+	def set(self, key, value, ttl=None):
+		"""
+		Set a key, like db[key] = value, but with a ttl.
+
+		Arguments
+		---------
+		key: string
+			The key to set.
+		value: object
+			The value, which must be encodable by the codec of the database.
+		ttl: int
+			Number of seconds the key lives, 0 to keep it forever, or None to use the ttl
+			the database was opened with. Only databases created with a ttl support it.
+		"""
+		self._checkopen()
+		if key == HEADER_KEY:
+			raise KeyError("Key {0} is reserved".format(key))
+		value = self._expiry(ttl) + self.codec.encode(value)
+		with self.lock:
+			self.cache.pop(key, None)
+			if self.pending is not None:
+				self.pending[key] = value
+				return
+			if self.index is not None and not key in self.db:
+				bisect.insort(self.index, key)
+			self.db[key] = value
+			self._commit(1)
+
+	def get_ttl(self, key):
+		"""
+		Returns the number of seconds until a key expires, or None if it never expires.
+		Raises a KeyError if the key does not exist or expired.
+		"""
+		self._checkopen()
+		if key == HEADER_KEY:
+			raise KeyError(key)
+		pending = self._pending()
+		if pending is not None and key in pending:
+			if pending[key] is DELETED:
+				raise KeyError(key)
+			value = pending[key]
+		else:
+			value = self.db[key]
+		expires_at = self._unpack(key, value)[0]
+		return max(0.0, expires_at - time.time()) if expires_at else None
+
+	def set_sweep_interval(self, interval=None, reorganize=True):
+		"""
+		Call sweep() every $interval seconds in a Scheduler thread, while the database is
+		open. Call without arguments to stop sweeping.
+
+		Arguments
+		---------
+		interval: int
+			Number of seconds between sweeps.
+		reorganize: boolean
+			Passed to sweep().
+		"""
+		with self.lock:
+			self._stop_sweeper()
+			self.sweep_interval = interval
+			self.sweep_reorganize = reorganize
+			if self.db is not None:
+				self._start_sweeper()
+
+	def _start_sweeper(self):
+		if self.sweep_interval and self.expires and self.mode != "r":
+			self.sweeper = Scheduler(self.sweep_interval, self._sweep, "simpledb.sweeper")
+			self.sweeper.daemon = True
+			self.sweeper.start()
+
+	def _stop_sweeper(self):
+		if self.sweeper:
+			self.sweeper.stop = True
+			self.sweeper = None
+
+	def _sweep(self):
+		if self.db is not None:
+			self.sweep(self.sweep_reorganize)
+
+	def sweep(self, reorganize=True):
+		"""
+		Remove all expired keys. Returns the number of keys removed.
+
+		Other threads can keep using the database while it is scanned, only the removal
+		and reorganization block them.
+
+		Arguments
+		---------
+		reorganize: boolean
+			If True, and keys were removed, reorganize the GDBM file afterwards, so the
+			space they used is given back to the file system.
+		"""
+		self._checkopen()
+		if self.mode == "r":
+			raise Exception("Can not sweep read-only SimpleDb {0}".format(self.path))
+		if not self.expires:
+			return 0
+
+		now = time.time()
+		db = self.db
+		expired = []
+		key = db.firstkey()
+		while key != None:
+			if key != HEADER_KEY:
+				expires_at = EXPIRY.unpack_from(db[key])[0]
+				if expires_at and expires_at <= now:
+					expired.append(key)
+			key = db.nextkey(key)
+
+		removed = []
+		with self.lock:
+			for key in expired:
+				# Changes made since the scan are kept
+				if not key in db:
+					continue
+				expires_at = EXPIRY.unpack_from(db[key])[0]
+				if expires_at and expires_at <= now:
+					del(db[key])
+					self.cache.pop(key, None)
+					removed.append(key)
+			self._index_remove(removed)
+			if removed:
+				if reorganize:
+					db.reorganize()
+				db.sync()
+				self.unsynced = 0
+			self.swept += len(removed)
+			self.sweeps += 1
+			self.last_sweep = time.time()
+		return len(removed)
+
+	def expiry_stats(self):
+		"""
+		Returns a dict with the number of keys found expired when read (expired), the
+		number of keys removed by sweep() (swept), the number of sweeps, the time of the
+		last sweep and the size of the database file in bytes.
+		"""
+		return {
+			"expired": self.expired,
+			"swept": self.swept,
+			"sweeps": self.sweeps,
+			"last_sweep": self.last_sweep,
+			"size": sum(os.path.getsize(name) for name in self._files() if os.path.exists(name))
+		}
+
+	def _files(self):
+		# All files that may belong to the database
+		if self.backend is None:
+			return [self.path]
+		return self.backend.files(self.path)
+
+	def _read_header(self):
+		self.has_header = HEADER_KEY in self.db
+		if self.has_header:
+			header = json.loads(self.db[HEADER_KEY])
+			if header["version"] > FORMAT_VERSION:
+				raise RuntimeError("SimpleDb {0} has unsupported format version {1}".format(self.path, header["version"]))
+			self.codec = get_codec(header["codec"])
+			self.expires = header.get("ttl", False)
+		elif (self.new_codec != JsonCodec.name or self.ttl is not None) and self.mode != "r" and len(self.db) == 0:
+			# Only new databases get a header, JSON databases stay readable for older versions
+			self.codec = get_codec(self.new_codec)
+			self.expires = self.ttl is not None
+			header = {"codec": self.codec.name, "version": 1}
+			if self.expires:
+				header.update(version=2, ttl=True)
+			self.db[HEADER_KEY] = json.dumps(header)
+			self.db.sync()
+			self.has_header = True
+		else:
+			self.codec = JsonCodec()
+			self.expires = False
+
+		if self.ttl and not self.expires:
+			raise RuntimeError("SimpleDb {0} was created without a ttl, and does not store expiry times".format(self.path))
+
+	def __enter__(self):
+		detected = detect_backend(self.path) if self.mode != "n" else None
+		if detected and self.backend_name and detected != self.backend_name:
+			raise RuntimeError("SimpleDb {0} uses the {1} backend, not {2}".format(self.path, detected, self.backend_name))
+		self.backend = get_backend(detected or self.backend_name or get_default_backend())
+		self.db = self.backend.open(self.path, self.mode)
+		try:
+			self._read_header()
+			if self.use_index:
+				self.open_signature = self._file_signature()
+				# The index saved next to a database that was just replaced is stale
+				self._load_index(self.open_signature if self.mode != "n" else None)
+		except Exception:
+			self.db.close()
+			self.db = None
+			raise
+		self._start_flusher()
+		self._start_sweeper()
+		return self
+
+	def __exit__(self, exc_type, exc_value, traceback):
+		self._checkopen()
+		with self.lock:
+			self._stop_flusher()
+			self._stop_sweeper()
+			self.db.sync()
+			stale = self.index is not None and self._index_stale()
+			self.db.close()
+			self.db = None
+			self.unsynced = 0
+			if self.index is not None:
+				# A stale index is not saved, the next open rebuilds it
+				if not stale:
+					self._save_index()
+				self.index = None
+			# Other processes may change the database while it is closed
+			self.cache.clear()
+
+	def __getitem__(self, key):
+		self._checkopen()
+		pending = self._pending()
+		if pending is not None and key in pending:
+			if pending[key] is DELETED:
+				raise KeyError(key)
+			return self.codec.decode(self._unpack(key, pending[key])[1])
+
+		if not self.cache_size:
+			if key == HEADER_KEY:
+				raise KeyError(key)
+			if self.expires:
+				return self.codec.decode(self._unpack(key, self.db[key])[1])
+			return self.codec.decode(self.db[key])
+
+		# The cache is shared by all threads. A miss is read under the lock as well, so a
+		# concurrent change can not be overwritten by the old value.
+		with self.lock:
+			# Cached values are stored with their expiry time
+			cached = self.cache.pop(key, None)
+			if cached is not None and cached[0] and cached[0] <= time.time():
+				cached = None
+
+			if cached is not None:
+				self.hits += 1
+				self.cache[key] = cached
+			else:
+				self.misses += 1
+				if key == HEADER_KEY:
+					raise KeyError(key)
+				expires_at, value = self._unpack(key, self.db[key])
+				value = self.codec.decode(value)
+				if self.cache_mode == CACHE_READONLY:
+					value = _freeze(value)
+					self.cache[key] = (expires_at, value)
+				else:
+					try:
+						self.cache[key] = (expires_at, marshal.dumps(value))
+					except ValueError:
+						# Not a builtin type, can not be copied cheaply
+						return value
+				while len(self.cache) > self.cache_size:
+					self.cache.popitem(last=False)
+					self.evictions += 1
+				return value
+
+		value = cached[1]
+		if self.cache_mode == CACHE_COPY:
+			value = marshal.loads(value)
+		return value
+
+	def __setitem__(self, key, value):
+		self.set(key, value)
+
+	def __delitem__(self, key):
+		self._checkopen()
+		if key == HEADER_KEY:
+			raise KeyError(key)
+		with self.lock:
+			self.cache.pop(key, None)
+			if self.pending is not None:
+				if not self._exists(key):
+					raise KeyError(key)
+				self.pending[key] = DELETED
+				return
+			del(self.db[key])
+			self._index_remove([key])
+			self._commit(1)
+
+	def _expired(self, value):
+		# Returns True if a stored value has expired
+		if not self.expires:
+			return False
+		expires_at = EXPIRY.unpack_from(value)[0]
+		return expires_at and expires_at <= time.time()
+
+	def __iter__(self):
+		self._checkopen()
+		pending = self._pending() or {}
+		db = self.db
+		with self.lock:
+			self.walks += 1
+
+		try:
+			key = db.firstkey()
+			while key != None:
+				if key != HEADER_KEY:
+					value = pending.get(key)
+					if value is None:
+						if self.expires and self._expired(db[key]):
+							self._expire(key)
+						else:
+							yield key
+					elif value is not DELETED and not self._expired(value):
+						yield key
+				key = db.nextkey(key)
+
+			for pending_key, value in list(pending.items()):
+				if value is not DELETED and not pending_key in db and not self._expired(value):
+					yield pending_key
+		finally:
+			# Keys that expired during the walk are removed once no walk is running
+			with self.lock:
+				self.walks -= 1
+				if not self.walks and self.expire_later:
+					expire_later, self.expire_later = self.expire_later, []
+					if self.db is not None and self.pending is None:
+						for key in expire_later:
+							self._remove_expired(key)
+
+		if key == None:
+			raise StopIteration()
+
+	def __len__(self):
+		self._checkopen()
+		if self._pending():
+			return sum(1 for key in self)
+		if self.index is not None:
+			return len(self.index)
+		return len(self.db) - (1 if self.has_header else 0)
@@ -0,0 +1,240 @@
+# Copyright (c) 2014 Nick Douma < n.douma [at] nekoconeko . nl >
+#
+# This file is part of chaos, a.k.a. python-chaos .
+#
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation; either
+# version 3.0 of the License, or (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with this library. If not, see
+# <http://www.gnu.org/licenses/>.
+
+"""
+Immutable, memory-mapped snapshots of a SimpleDb.
+
+A snapshot is a single file with all records, followed by an open-addressing hash
+table of their offsets, similar to a constant database (CDB). Lookups are O(1) and
+read straight from the page cache, so any number of processes can share one snapshot
+without loading it. A new snapshot is written to a temporary file and renamed over the
+old one, and readers switch to it automatically.
+
+File layout, all integers little-endian:
+
+	header: magic "CHSNAP01", record count (Q), table offset (Q), table slots (Q),
+	        codec name (16s)
+	records: key length (I), value length (I), key, encoded value
+	table: per slot the hash of the key (I), unused (I), record offset (Q), where an
+	       offset of 0 marks an empty slot
+"""
+
+from __future__ import absolute_import
+import collections, mmap, os, struct, time, zlib
+from .simpledb import SimpleDb
+from .codec import get_codec
+
+MAGIC = b"CHSNAP01"
+HEADER = struct.Struct("<8sQQQ16s")
+RECORD = struct.Struct("<II")
+SLOT = struct.Struct("<IIQ")
+
+def _hash(key):
+	return zlib.crc32(key) & 0xffffffff
+
+def write_snapshot(path, snapshot_path):
+	"""
+	Write a snapshot of the SimpleDb at $path to $snapshot_path. Values are copied in
+	their encoded form, so the snapshot uses the codec of the database. Expired keys are
+	left out, and values in a snapshot never expire. The snapshot is
+	written to a temporary file first, and atomically replaces $snapshot_path when it is
+	complete. Returns the number of keys written.
+
+	Arguments
+	---------
+	path: string
+		Path of the database.
+	snapshot_path: string
+		Path of the snapshot.
+	"""
+	temp_path = "{0}.{1}.tmp".format(snapshot_path, os.getpid())
+	entries = []
+	try:
+		with SimpleDb(path, mode="r", sync=False) as db:
+			with open(temp_path, "wb") as output:
+				output.write(b"\0" * HEADER.size)
+				offset = HEADER.size
+				for key in db:
+					# Copy the encoded value, without decoding it
+					try:
+						value = db._unpack(key, db.db[key])[1]
+					except KeyError:
+						continue
+					output.write(RECORD.pack(len(key), len(value)))
+					output.write(key)
+					output.write(value)
+					entries.append((_hash(key), offset))
+					offset += RECORD.size + len(key) + len(value)
+
+				# Keep the table at most half full, with a power of two number of slots
+				slots = 1
+				while slots < 2 * len(entries):
+					slots *= 2
+				mask = slots - 1
+				table = [None] * slots
+				for entry in entries:
+					slot = entry[0] & mask
+					while table[slot] is not None:
+						slot = (slot + 1) & mask
+					table[slot] = entry
+				empty = SLOT.pack(0, 0, 0)
+				for entry in table:
+					output.write(SLOT.pack(entry[0], 0, entry[1]) if entry else empty)
+
+				output.seek(0)
+				output.write(HEADER.pack(MAGIC, len(entries), offset, slots, db.codec.name.encode("ascii")))
+				output.flush()
+				os.fsync(output.fileno())
+		os.rename(temp_path, snapshot_path)
+	except Exception:
+		if os.path.exists(temp_path):
+			os.unlink(temp_path)
+		raise
+	return len(entries)
+
+class Snapshot(collections.Mapping):
+	"""
+	Read-only, dict-like access to a snapshot written by write_snapshot().
+
+	The file is memory-mapped, get_raw() returns the encoded value without copying it.
+	Every $check_interval seconds, a lookup checks whether the snapshot file was
+	replaced, and if so, switches to the new file. Call reload() to check immediately.
+	"""
+
+	def __init__(self, path, check_interval=1.0):
+		"""
+		Open the snapshot.
+
+		Arguments
+		---------
+		path: string
+			Path of the snapshot.
+		check_interval: float
+			Minimum number of seconds between checks for a new snapshot. Use None to
+			never switch automatically.
+		"""
+		self.path = path
+		self.check_interval = check_interval
+		self.map = None
+		self.inode = None
+		self.checked = 0
+		self._open()
+
+	def _open(self):
+		with open(self.path, "rb") as f:
+			stat = os.fstat(f.fileno())
+			data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+		magic, count, table_offset, slots, codec = HEADER.unpack_from(data, 0)
+		if magic != MAGIC:
+			data.close()
+			raise RuntimeError("{0} is not a snapshot".format(self.path))
+
+		# The old map is not closed, as values returned by get_raw() may still use it.
+		# It is unmapped when the last of them is released.
+		self.map = data
+		self.count = count
+		self.table_offset = table_offset
+		self.mask = slots - 1
+		self.codec = get_codec(codec.rstrip(b"\0").decode("ascii"))
+		self.inode = (stat.st_dev, stat.st_ino)
+		self.checked = time.time()
+
+	def reload(self):
+		"""
+		Switch to the snapshot file that is currently at the path, if it was replaced.
+		Returns True if a new snapshot was loaded.
+
+		Values returned by get_raw() before reloading stay valid, and keep the old
+		snapshot mapped until they are released.
+		"""
+		self.checked = time.time()
+		stat = os.stat(self.path)
+		if (stat.st_dev, stat.st_ino) == self.inode:
+			return False
+		self._open()
+		return True
+
+	def close(self):
+		"""
+		Unmap the snapshot.
+		"""
+		if self.map is not None:
+			self.map.close()
+			self.map = None
+
+	def __enter__(self):
+		return self
+
+	def __exit__(self, exc_type, exc_value, traceback):
+		self.close()
+
+	def _find(self, key):
+		# Returns the offset and length of the encoded value of key, or None
+		if self.check_interval is not None and time.time() - self.checked > self.check_interval:
+			self.reload()
+
+		data = self.map
+		key_hash = _hash(key)
+		slot = key_hash & self.mask
+		while True:
+			slot_hash, unused, offset = SLOT.unpack_from(data, self.table_offset + slot * SLOT.size)
+			if offset == 0:
+				return None
+			if slot_hash == key_hash:
+				key_length, value_length = RECORD.unpack_from(data, offset)
+				start = offset + RECORD.size
+				if key_length == len(key) and data[start:start + key_length] == key:
+					return start + key_length, value_length
+			slot = (slot + 1) & self.mask
+
+	def get_raw(self, key):
+		"""
+		Return the encoded value of a key without copying it, as a memoryview on Python 3,
+		or a buffer on Python 2. Raises KeyError if the key does not exist.
+		"""
+		found = self._find(key)
+		if found is None:
+			raise KeyError(key)
+		offset, length = found
+		try:
+			return buffer(self.map, offset, length)
+		except NameError:
+			return memoryview(self.map)[offset:offset + length]
+
+	def __getitem__(self, key):
+		found = self._find(key)
+		if found is None:
+			raise KeyError(key)
+		offset, length = found
+		return self.codec.decode(self.map[offset:offset + length])
+
+	def __contains__(self, key):
+		return self._find(key) is not None
+
+	def __iter__(self):
+		data = self.map
+		offset = HEADER.size
+		for i in range(self.count):
+			key_length, value_length = RECORD.unpack_from(data, offset)
+			start = offset + RECORD.size
+			yield data[start:start + key_length]
+			offset = start + key_length + value_length
+
+	def __len__(self):
+		return self.count
@@ -0,0 +1,121 @@
+# Copyright (c) 2014 Nick Douma < n.douma [at] nekoconeko . nl >
+#
+# This file is part of chaos, a.k.a. python-chaos .
+#
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation; either
+# version 3.0 of the License, or (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with this library. If not, see
+# <http://www.gnu.org/licenses/>.
+
+"""
+Command line tool for maintaining SimpleDb databases.
+
+Usage: python -m chaos.db.tool migrate <path> <codec>
+       python -m chaos.db.tool export [--format text|jsonl] [--output FILE] <path>
+       python -m chaos.db.tool import [--format text|jsonl] [--input FILE] <path>
+       python -m chaos.db.tool snapshot <path> <snapshot>
+       python -m chaos.db.tool sweep [--no-reorganize] <path>
+
+When installed, the tool is also available as chaos-db.
+"""
+
+from __future__ import absolute_import, print_function
+import sys
+from argparse import ArgumentParser
+from .simpledb import SimpleDb, migrate_simple_db, export_simple_db, import_simple_db, FORMAT_TEXT, FORMAT_JSONL
+from .snapshot import write_snapshot
+from .codec import codec_list
+from .backend import backend_list
+
+def migrate(args):
+	if migrate_simple_db(args.path, args.codec):
+		print("Migrated {0} to {1}".format(args.path, args.codec))
+	else:
+		print("{0} already uses {1}".format(args.path, args.codec))
+
+def export(args):
+	output = open(args.output, "w") if args.output else sys.stdout
+	try:
+		count = export_simple_db(args.path, output, args.format)
+	finally:
+		if args.output:
+			output.close()
+	sys.stderr.write("Exported {0} keys from {1}\n".format(count, args.path))
+
+def import_(args):
+	input = open(args.input) if args.input else sys.stdin
+	try:
+		count = import_simple_db(args.path, input, args.format, args.batch_size, "n" if args.replace else "c", args.codec, args.backend)
+	finally:
+		if args.input:
+			input.close()
+	sys.stderr.write("Imported {0} keys into {1}\n".format(count, args.path))
+
+def snapshot(args):
+	count = write_snapshot(args.path, args.snapshot)
+	sys.stderr.write("Wrote {0} keys from {1} to {2}\n".format(count, args.path, args.snapshot))
+
+def sweep(args):
+	with SimpleDb(args.path, mode="w") as db:
+		count = db.sweep(args.reorganize)
+		stats = db.expiry_stats()
+	sys.stderr.write("Removed {0} expired keys from {1}, which is now {2} bytes\n".format(count, args.path, stats["size"]))
+
+def get_argparse():
+	"""
+	Create the ArgumentParser for this tool, with a sub command per action.
+	"""
+	parser = ArgumentParser(description="Maintain SimpleDb databases")
+	commands = parser.add_subparsers(dest="command")
+
+	parser_migrate = commands.add_parser("migrate", help="Convert a database to another codec")
+	parser_migrate.add_argument("path", help="Path of the database")
+	parser_migrate.add_argument("codec", choices=sorted(codec_list), help="Codec to convert to")
+	parser_migrate.set_defaults(action=migrate)
+
+	parser_export = commands.add_parser("export", help="Write a database to a file, line by line")
+	parser_export.add_argument("path", help="Path of the database")
+	parser_export.add_argument("--format", choices=[FORMAT_TEXT, FORMAT_JSONL], default=FORMAT_JSONL, help="Output format")
+	parser_export.add_argument("--output", metavar="FILE", help="File to write to, defaults to stdout")
+	parser_export.set_defaults(action=export)
+
+	parser_import = commands.add_parser("import", help="Read a database from a file written by export")
+	parser_import.add_argument("path", help="Path of the database")
+	parser_import.add_argument("--format", choices=[FORMAT_TEXT, FORMAT_JSONL], default=FORMAT_JSONL, help="Input format")
+	parser_import.add_argument("--input", metavar="FILE", help="File to read from, defaults to stdin")
+	parser_import.add_argument("--batch-size", type=int, default=1000, help="Number of keys to write at once")
+	parser_import.add_argument("--replace", action="store_true", default=False, help="Replace the database instead of adding to it")
+	parser_import.add_argument("--codec", choices=sorted(codec_list), default="json", help="Codec to use for a new database")
+	parser_import.add_argument("--backend", choices=sorted(backend_list), help="Backend to use for a new database")
+	parser_import.set_defaults(action=import_)
+
+	parser_snapshot = commands.add_parser("snapshot", help="Write a read-only, memory-mapped snapshot of a database")
+	parser_snapshot.add_argument("path", help="Path of the database")
+	parser_snapshot.add_argument("snapshot", help="Path of the snapshot, replaced atomically if it exists")
+	parser_snapshot.set_defaults(action=snapshot)
+
+	parser_sweep = commands.add_parser("sweep", help="Remove expired keys from a database with a ttl")
+	parser_sweep.add_argument("path", help="Path of the database")
+	parser_sweep.add_argument("--no-reorganize", dest="reorganize", action="store_false", default=True, help="Do not shrink the file afterwards")
+	parser_sweep.set_defaults(action=sweep)
+
+	return parser
+
+def main(argv=None):
+	"""
+	Entry point of the tool.
+	"""
+	args = get_argparse().parse_args(argv)
+	args.action(args)
+
+if __name__ == "__main__":
+	main(sys.argv[1:])
@@ -0,0 +1,197 @@
+# Copyright (c) 2014 Nick Douma < n.douma [at] nekoconeko . nl >
+#
+# This file is part of chaos, a.k.a. python-chaos .
+#
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation; either
+# version 3.0 of the License, or (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with this library. If not, see
+# <http://www.gnu.org/licenses/>.
+
+"""
+Helper functions for placing processes on CPU cores, on Linux.
+
+The CPU topology is read from /sys. Affinity is set using sched_setaffinity, from the
+os module where available, or through libc otherwise.
+"""
+
+from __future__ import absolute_import
+import ctypes, ctypes.util, glob, os, re
+
+# Placement policies
+PIN = "pin"
+ROUND_ROBIN = "round-robin"
+NUMA_SPREAD = "numa-spread"
+
+CPU_SETSIZE = 1024
+
+class cpu_set_t(ctypes.Structure):
+	_fields_ = [("bits", ctypes.c_ulong * (CPU_SETSIZE // (8 * ctypes.sizeof(ctypes.c_ulong))))]
+
+_libc = None
+
+def _get_libc():
+	global _libc
+	if _libc is None:
+		_libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+	return _libc
+
+def parse_cpulist(cpulist):
+	"""
+	Parse a CPU list as used in /sys, such as "0-3,8,10-11", into a sorted list of ints.
+
+	Parameters
+	----------
+	cpulist: string
+		The CPU list to parse.
+	"""
+	cpus = set()
+	for part in cpulist.strip().split(","):
+		if not part:
+			continue
+		if "-" in part:
+			first, last = part.split("-")
+			cpus.update(range(int(first), int(last) + 1))
+		else:
+			cpus.add(int(part))
+	return sorted(cpus)
+
+def set_affinity(pid, cpus):
+	"""
+	Restrict the given process to the given CPUs.
+
+	Parameters
+	----------
+	pid: int
+		The process id, or 0 for the current process.
+	cpus: list of int
+		The CPUs the process may run on.
+	"""
+	if hasattr(os, "sched_setaffinity"):
+		os.sched_setaffinity(pid, cpus)
+		return
+
+	mask = cpu_set_t()
+	bits = 8 * ctypes.sizeof(ctypes.c_ulong)
+	for cpu in cpus:
+		mask.bits[cpu // bits] |= 1 << (cpu % bits)
+	if _get_libc().sched_setaffinity(pid, ctypes.sizeof(mask), ctypes.byref(mask)) != 0:
+		errno = ctypes.get_errno()
+		raise OSError(errno, os.strerror(errno))
+
+def get_affinity(pid):
+	"""
+	Return a sorted list of the CPUs the given process may run on.
+
+	Parameters
+	----------
+	pid: int
+		The process id, or 0 for the current process.
+	"""
+	if hasattr(os, "sched_getaffinity"):
+		return sorted(os.sched_getaffinity(pid))
+
+	mask = cpu_set_t()
+	bits = 8 * ctypes.sizeof(ctypes.c_ulong)
+	if _get_libc().sched_getaffinity(pid, ctypes.sizeof(mask), ctypes.byref(mask)) != 0:
+		errno = ctypes.get_errno()
+		raise OSError(errno, os.strerror(errno))
+	return [cpu for cpu in range(CPU_SETSIZE) if mask.bits[cpu // bits] & (1 << (cpu % bits))]
+
+def get_cpus():
+	"""
+	Return a sorted list of CPUs available to the current process.
+	"""
+	try:
+		return get_affinity(0)
+	except (OSError, AttributeError):
+		with open("/sys/devices/system/cpu/online") as online:
+			return parse_cpulist(online.read())
+
+def get_numa_nodes():
+	"""
+	Return a dict of NUMA node number to a sorted list of its CPUs that are available
+	to the current process. Without NUMA information, all CPUs are in node 0.
+	"""
+	available = set(get_cpus())
+	nodes = {}
+	for path in glob.glob("/sys/devices/system/node/node*/cpulist"):
+		node = int(re.search(r"node(\d+)", path).group(1))
+		with open(path) as cpulist:
+			cpus = [cpu for cpu in parse_cpulist(cpulist.read()) if cpu in available]
+		if cpus:
+			nodes[node] = cpus
+
+	if not nodes:
+		nodes[0] = sorted(available)
+	return nodes
+
+class Placement(object):
+	"""
+	Decides which CPUs the n-th process of a group should run on.
+
+	PIN places all processes on the given CPUs. ROUND_ROBIN places every process on a
+	single CPU, cycling through the CPUs. NUMA_SPREAD places every process on all CPUs
+	of a NUMA node, cycling through the nodes.
+	"""
+	def __init__(self, policy, cpus=None):
+		"""
+		Parameters
+		----------
+		policy: string
+			One of PIN, ROUND_ROBIN or NUMA_SPREAD.
+		cpus: int or list of int
+			The CPUs to use. Required for PIN, defaults to all available CPUs otherwise.
+		"""
+		if not policy in (PIN, ROUND_ROBIN, NUMA_SPREAD):
+			raise Exception("Unknown placement policy {0}".format(policy))
+		if isinstance(cpus, int):
+			cpus = [cpus]
+		if policy == PIN and not cpus:
+			raise Exception("Placement policy {0} needs a list of CPUs".format(policy))
+
+		self.policy = policy
+		self.cpus = sorted(cpus) if cpus else get_cpus()
+		self.nodes = None
+		if policy == NUMA_SPREAD:
+			nodes = get_numa_nodes()
+			self.nodes = [[cpu for cpu in nodes[node] if cpu in self.cpus] for node in sorted(nodes)]
+			self.nodes = [node for node in self.nodes if node] or [self.cpus]
+
+	def getCpus(self, index):
+		"""
+		Return the list of CPUs for the process with the given index.
+
+		Parameters
+		----------
+		index: int
+			Index of the process within its group, starting at 0.
+		"""
+		if self.policy == PIN:
+			return list(self.cpus)
+		if self.policy == ROUND_ROBIN:
+			return [self.cpus[index % len(self.cpus)]]
+		return list(self.nodes[index % len(self.nodes)])
+
+	def apply(self, pid, index):
+		"""
+		Set the affinity of the given process to the CPUs for the given index, and return
+		the CPUs the process is actually allowed to run on.
+
+		Parameters
+		----------
+		pid: int
+			The process id.
+		index: int
+			Index of the process within its group, starting at 0.
+		"""
+		set_affinity(pid, self.getCpus(index))
+		return get_affinity(pid)
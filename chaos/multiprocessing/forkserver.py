@@ -0,0 +1,363 @@
+# Copyright (c) 2014 Nick Douma < n.douma [at] nekoconeko . nl >
+#
+# This file is part of chaos, a.k.a. python-chaos .
+#
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation; either
+# version 3.0 of the License, or (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with this library. If not, see
+# <http://www.gnu.org/licenses/>.
+
+"""
+A fork server, for starting worker processes quickly from a small, clean process.
+
+The server is a fresh Python interpreter that imports a list of modules once, and then
+forks a new child for every worker that is started through it. Children share the
+preloaded modules with the server using copy-on-write, and do not inherit the memory
+of the (possibly large) main process.
+
+	server = ForkServer(preload=["json", "mymodule.heavy"])
+	server.start()
+	workers.registerWorker("worker", ForkServerProcess(server, target=mymodule.work))
+
+Targets and their arguments are pickled, so targets must be importable functions,
+not functions defined in __main__.
+
+This module is also the server itself, when started as
+python -m chaos.multiprocessing.forkserver.
+"""
+
+from __future__ import absolute_import
+import errno, logging, multiprocessing, os, pickle, random, shutil, signal, subprocess
+import sys, tempfile, threading, time, traceback
+from multiprocessing import util
+from multiprocessing.connection import Client, Listener
+
+class ForkServer(object):
+	"""
+	Handle to a fork server process. Start it with start(), before starting any
+	ForkServerProcess that uses it.
+	"""
+	def __init__(self, preload=(), name="forkserver"):
+		"""
+		Parameters
+		----------
+		preload: list of string
+			Names of modules the server imports before forking any children.
+		name: string
+			Descriptive name of this server.
+		"""
+		self.logger = logging.getLogger(name)
+		self.name = name
+		self.preload = list(preload)
+		self.authkey = os.urandom(32)
+		self.directory = None
+		self.address = None
+		self.process = None
+
+	def start(self, timeout=60):
+		"""
+		Start the server process, and wait until it has imported its modules and is
+		ready to fork children.
+
+		Parameters
+		----------
+		timeout: int
+			Maximum number of seconds to wait for the server to be ready.
+		"""
+		self.directory = tempfile.mkdtemp(prefix="chaos-forkserver-")
+		self.address = os.path.join(self.directory, "socket")
+		config = {
+			"address": self.address,
+			"authkey": self.authkey,
+			"preload": self.preload,
+			"path": sys.path,
+			"name": self.name
+		}
+
+		self.logger.info("Starting fork server {0}".format(self.name))
+		# The server must be able to import this module, before it receives sys.path. Only
+		# the directory holding chaos is passed, as other directories, such as the one of
+		# the running script, may hold modules that shadow the standard library.
+		env = dict(os.environ)
+		env["PYTHONPATH"] = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+		self.process = subprocess.Popen([sys.executable, "-m", "chaos.multiprocessing.forkserver"],
+			stdin=subprocess.PIPE, close_fds=True, env=env)
+		self.process.stdin.write(pickle.dumps(config, 2))
+		self.process.stdin.close()
+
+		deadline = time.time() + timeout
+		while not os.path.exists(self.address):
+			if self.process.poll() is not None or time.time() > deadline:
+				self.stop()
+				self.logger.error("Fork server {0} failed to start".format(self.name))
+				raise Exception("Fork server {0} failed to start".format(self.name))
+			time.sleep(0.01)
+		self.logger.debug("Fork server {0} is ready with pid {1}".format(self.name, self.process.pid))
+
+	def connect(self):
+		"""
+		Return a new connection to the server.
+		"""
+		if not self.address:
+			self.logger.error("Fork server {0} was not started!".format(self.name))
+			raise Exception("Fork server {0} was not started!".format(self.name))
+		return Client(self.address, family="AF_UNIX", authkey=self.authkey)
+
+	def stop(self, timeout=5):
+		"""
+		Stop the server process. Children that are still running are not stopped, but
+		their exit codes can no longer be retrieved.
+
+		Parameters
+		----------
+		timeout: int
+			Maximum number of seconds to wait for the server to exit, before it is killed.
+		"""
+		if self.process and self.process.poll() is None:
+			try:
+				conn = self.connect()
+				conn.send(("stop",))
+				conn.close()
+			except (EOFError, IOError, OSError):
+				pass
+
+			deadline = time.time() + timeout
+			while self.process.poll() is None and time.time() < deadline:
+				time.sleep(0.01)
+			if self.process.poll() is None:
+				self.logger.warning("Fork server {0} did not stop in time, killing".format(self.name))
+				self.process.kill()
+				self.process.wait()
+
+		if self.directory:
+			shutil.rmtree(self.directory, ignore_errors=True)
+		self.directory = None
+		self.address = None
+		self.logger.info("Stopped fork server {0}".format(self.name))
+
+class ForkServerPopen(object):
+	"""
+	Replaces the Popen object of a multiprocessing.Process, for a Process that was
+	forked by a ForkServer. The connection to the server stays open until the child
+	exits, at which point the server sends its exit code.
+	"""
+	def __init__(self, process_obj):
+		self.returncode = None
+		self.conn = process_obj.server.connect()
+		self.conn.send(("spawn", process_obj._target, process_obj._args, process_obj._kwargs, process_obj.name))
+		reply = self.conn.recv()
+		if reply[0] != "pid":
+			self.conn.close()
+			raise Exception("Fork server failed to start {0}: {1}".format(process_obj.name, reply[1]))
+		self.pid = reply[1]
+		self.sentinel = self.conn.fileno()
+
+	def poll(self, flag=os.WNOHANG):
+		if self.returncode is None:
+			try:
+				if flag != os.WNOHANG or self.conn.poll():
+					self.returncode = self.conn.recv()[1]
+			except (EOFError, IOError, OSError):
+				# The server died, the exit code is lost
+				self.returncode = -1
+			if self.returncode is not None:
+				self.conn.close()
+		return self.returncode
+
+	def wait(self, timeout=None):
+		if self.returncode is None and timeout is not None:
+			try:
+				if not self.conn.poll(timeout):
+					return None
+			except (EOFError, IOError, OSError):
+				pass
+		return self.poll(0)
+
+	def terminate(self):
+		self._signal(signal.SIGTERM)
+
+	def kill(self):
+		self._signal(signal.SIGKILL)
+
+	def _signal(self, signum):
+		if self.returncode is None:
+			try:
+				os.kill(self.pid, signum)
+			except OSError as e:
+				if e.errno != errno.ESRCH:
+					raise
+
+	def close(self):
+		self.conn.close()
+
+class ForkServerProcess(multiprocessing.Process):
+	"""
+	A Process that is forked by a ForkServer, instead of by the current process. It can
+	be used like any other Process, including registering it with Workers.
+	"""
+	_Popen = ForkServerPopen
+
+	def __init__(self, server, target=None, name=None, args=(), kwargs=None):
+		"""
+		Parameters
+		----------
+		server: ForkServer
+			The started server to fork from.
+		target: function pointer
+			An importable function, to run in the child.
+		name: string
+			Descriptive name of the process.
+		args: tuple
+			Positional arguments to pass to target.
+		kwargs: dict
+			Keyword arguments to pass to target.
+		"""
+		super(ForkServerProcess, self).__init__(target=target, name=name, args=args, kwargs=kwargs or {})
+		self.server = server
+
+def _run_child(target, args, kwargs, name):
+	# Runs in a freshly forked child of the server, never returns.
+	code = 0
+	try:
+		signal.signal(signal.SIGINT, signal.default_int_handler)
+		random.seed()
+		multiprocessing.current_process().name = name
+		util._run_after_forkers()
+		target(*args, **kwargs)
+	except SystemExit as e:
+		if e.code is None:
+			code = 0
+		elif isinstance(e.code, int):
+			code = e.code
+		else:
+			sys.stderr.write("{0}\n".format(e.code))
+			code = 1
+	except BaseException:
+		sys.stderr.write("Process {0}:\n".format(name))
+		traceback.print_exc()
+		code = 1
+	finally:
+		try:
+			sys.stdout.flush()
+			sys.stderr.flush()
+		finally:
+			os._exit(code)
+
+def serve(listener, logger):
+	"""
+	Accept requests on the given Listener until a stop request is received. Every
+	spawn request forks a child. A reaper thread sends the exit code of every child
+	over the connection it was requested on.
+	"""
+	children = {}
+	exited = {}
+	lock = threading.Condition()
+
+	def reap():
+		while True:
+			with lock:
+				while not children:
+					lock.wait()
+			try:
+				pid, status = os.waitpid(-1, 0)
+			except OSError as e:
+				if e.errno == errno.ECHILD:
+					time.sleep(0.1)
+				continue
+			code = os.WEXITSTATUS(status) if os.WIFEXITED(status) else -os.WTERMSIG(status)
+			with lock:
+				conn = children.pop(pid, None)
+				if conn is None:
+					exited[pid] = code
+					continue
+			_send_exit(conn, code)
+
+	reaper = threading.Thread(target=reap, name="reaper")
+	reaper.daemon = True
+	reaper.start()
+
+	while True:
+		try:
+			conn = listener.accept()
+			request = conn.recv()
+		except Exception:
+			logger.exception("Failed to accept a request")
+			continue
+
+		if request[0] == "stop":
+			conn.close()
+			return
+
+		if request[0] != "spawn":
+			conn.send(("error", "unknown request {0}".format(request[0])))
+			conn.close()
+			continue
+
+		target, args, kwargs, name = request[1:]
+		try:
+			pid = os.fork()
+		except OSError as e:
+			conn.send(("error", str(e)))
+			conn.close()
+			continue
+
+		if pid == 0:
+			# Closing the listener would remove its socket, the child simply never uses it
+			conn.close()
+			for other in list(children.values()):
+				other.close()
+			_run_child(target, args, kwargs, name)
+
+		conn.send(("pid", pid))
+		with lock:
+			if pid in exited:
+				code = exited.pop(pid)
+			else:
+				children[pid] = conn
+				lock.notify()
+				continue
+		_send_exit(conn, code)
+
+def _send_exit(conn, code):
+	try:
+		conn.send(("exit", code))
+	except (IOError, OSError):
+		pass
+	conn.close()
+
+def main():
+	"""
+	Entry point of the server process. Reads its configuration as a pickled dict from
+	stdin, preloads modules, and serves requests.
+	"""
+	# Interrupts are meant for the main process, which stops the server itself
+	signal.signal(signal.SIGINT, signal.SIG_IGN)
+	stdin = getattr(sys.stdin, "buffer", sys.stdin)
+	config = pickle.loads(stdin.read())
+	sys.path = config["path"]
+	logger = logging.getLogger(config["name"])
+
+	for module in config["preload"]:
+		try:
+			__import__(module)
+		except Exception:
+			logger.exception("Failed to preload module {0}".format(module))
+
+	# Only start listening once everything is imported, the client waits for the socket
+	listener = Listener(config["address"], family="AF_UNIX", authkey=config["authkey"])
+	try:
+		serve(listener, logger)
+	finally:
+		listener.close()
+
+if __name__ == "__main__":
+	main()
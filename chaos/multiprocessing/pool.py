@@ -0,0 +1,365 @@
+# Copyright (c) 2014 Nick Douma < n.douma [at] nekoconeko . nl >
+#
+# This file is part of chaos, a.k.a. python-chaos .
+#
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation; either
+# version 3.0 of the License, or (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with this library. If not, see
+# <http://www.gnu.org/licenses/>.
+
+""" A supervised pool of identical worker processes. """
+
+from __future__ import absolute_import
+import multiprocessing, logging, threading, time
+from .workers import stop_processes
+from .proc import get_rss
+from ..threading.scheduler import Scheduler
+
+class PoolWorker(multiprocessing.Process):
+	"""
+	A single Process started by a WorkerPool.
+
+	Inside the worker, multiprocessing.current_process() returns this object. The target
+	should regularly call shouldStop(), and return when it returns True. When the pool
+	recycles workers after a number of tasks, the target should call taskDone() after
+	every task.
+	"""
+	def __init__(self, pool_name, index, target, args, kwargs):
+		super(PoolWorker, self).__init__(target=target, name="{0}-{1}".format(pool_name, index), args=args, kwargs=kwargs)
+		self.index = index
+		self.stop_event = multiprocessing.Event()
+		self.tasks = multiprocessing.Value("L", 0)
+		self.started_at = None
+		self.cpus = None
+
+	def shouldStop(self):
+		"""
+		Returns True if this worker was asked to stop.
+		"""
+		return self.stop_event.is_set()
+
+	def requestStop(self):
+		"""
+		Ask this worker to stop, by having shouldStop() return True.
+		"""
+		self.stop_event.set()
+
+	def taskDone(self):
+		"""
+		Count a finished task.
+		"""
+		with self.tasks.get_lock():
+			self.tasks.value += 1
+
+	def getTasks(self):
+		"""
+		Returns the number of tasks this worker finished.
+		"""
+		return self.tasks.value
+
+class WorkerPool(object):
+	"""
+	Keeps a number of identical worker Processes alive.
+
+	Every worker occupies a numbered slot. When a worker dies without being asked to
+	stop, a new worker is started in its slot after a backoff, which doubles for every
+	consecutive restart of that slot. The number of slots can be changed at runtime
+	using scale().
+
+	Workers can be recycled after a number of tasks, when their memory usage grows too
+	large, or after a maximum age, see setRecycle(). A replacement is started before the
+	old worker is asked to stop, so the number of workers never drops.
+	"""
+	def __init__(self, name, target, count, args=(), kwargs=None, interval=1, backoff=1, max_backoff=60, retire_timeout=30):
+		"""
+		Initialize a new WorkerPool. No Processes are started until start() is called.
+
+		Parameters
+		----------
+		name: string
+			Descriptive name of this pool, workers are named <name>-<slot>.
+		target: function pointer
+			The function each worker runs.
+		count: int
+			Number of workers to keep alive.
+		args: tuple
+			Positional arguments to pass to target.
+		kwargs: dict
+			Keyword arguments to pass to target.
+		interval: int
+			Number of seconds between checks of the workers.
+		backoff: int
+			Number of seconds to wait before restarting a worker that died for the first time.
+		max_backoff: int
+			Maximum number of seconds to wait before restarting a worker. A worker that
+			stays alive for longer than this is considered healthy again.
+		retire_timeout: int
+			Number of seconds a worker that was asked to stop gets, before it is terminated.
+		"""
+		self.logger = logging.getLogger(name)
+		self.name = name
+		self.target = target
+		self.count = count
+		self.args = args
+		self.kwargs = kwargs or {}
+		self.interval = interval
+		self.backoff = backoff
+		self.max_backoff = max_backoff
+		self.retire_timeout = retire_timeout
+
+		self.slots = {}
+		self.retiring = {}
+		self.restarts = {}
+		self.failures = {}
+		self.restart_at = {}
+		self.recycles = {}
+		self.max_tasks = None
+		self.max_rss = None
+		self.max_age = None
+		self.placement = None
+		self.lock = threading.RLock()
+		self.supervisor = None
+		self.stopping = False
+
+	def setRecycle(self, max_tasks=None, max_rss=None, max_age=None):
+		"""
+		Replace workers that have done enough work. Each limit is disabled when None.
+
+		Parameters
+		----------
+		max_tasks: int
+			Replace a worker after it finished this many tasks, see PoolWorker.taskDone().
+		max_rss: int
+			Replace a worker when its resident set size exceeds this many bytes.
+		max_age: int
+			Replace a worker after it has been running for this many seconds.
+		"""
+		self.max_tasks = max_tasks
+		self.max_rss = max_rss
+		self.max_age = max_age
+
+	def setPlacement(self, placement):
+		"""
+		Place workers on CPU cores when they are started. Workers are numbered by their
+		slot, so a restarted or recycled worker gets the same CPUs as its predecessor.
+
+		Parameters
+		----------
+		placement: chaos.multiprocessing.affinity.Placement
+			The placement to use, or None to not place workers.
+		"""
+		self.placement = placement
+
+	def start(self):
+		"""
+		Start all workers, and a Scheduler thread that supervises them.
+		"""
+		self.logger.info("Starting pool {0} with {1} workers".format(self.name, self.count))
+		with self.lock:
+			self.stopping = False
+			for index in range(self.count):
+				self._spawn(index)
+
+		self.supervisor = Scheduler(self.interval, self.checkWorkers, "{0}.supervisor".format(self.name))
+		self.supervisor.daemon = True
+		self.supervisor.start()
+
+	def _spawn(self, index):
+		# Must be called with self.lock held.
+		worker = PoolWorker(self.name, index, self.target, self.args, self.kwargs)
+		worker.start()
+		worker.started_at = time.time()
+		if self.placement:
+			try:
+				worker.cpus = self.placement.apply(worker.pid, index)
+			except Exception as e:
+				self.logger.warning("Failed to place {0} on CPUs {1}: {2}".format(
+					worker.name, self.placement.getCpus(index), e))
+		self.slots[index] = worker
+		self.restarts.setdefault(index, 0)
+		self.failures.setdefault(index, 0)
+		self.recycles.setdefault(index, 0)
+		self.logger.debug("Started {0} with pid {1}".format(worker.name, worker.pid))
+		return worker
+
+	def _retire(self, worker):
+		# Must be called with self.lock held.
+		worker.requestStop()
+		self.retiring[worker.pid] = (worker, time.time() + self.retire_timeout)
+		self.logger.debug("Retiring {0} with pid {1}".format(worker.name, worker.pid))
+
+	def _recycleReason(self, worker, now):
+		if self.max_tasks is not None and worker.getTasks() >= self.max_tasks:
+			return "finished {0} tasks".format(worker.getTasks())
+		if self.max_age is not None and now - worker.started_at >= self.max_age:
+			return "is {0:.0f} seconds old".format(now - worker.started_at)
+		if self.max_rss is not None:
+			rss = get_rss(worker.pid)
+			if rss is not None and rss > self.max_rss:
+				return "uses {0} bytes of memory".format(rss)
+		return None
+
+	def scale(self, count):
+		"""
+		Change the number of workers. New workers are started immediately. Surplus
+		workers are asked to stop, starting with the highest slot, and are terminated
+		if they did not exit within retire_timeout seconds.
+
+		Parameters
+		----------
+		count: int
+			The new number of workers.
+		"""
+		with self.lock:
+			self.logger.info("Scaling pool {0} from {1} to {2} workers".format(self.name, self.count, count))
+			for index in range(self.count, count):
+				self._spawn(index)
+			for index in range(count, self.count):
+				worker = self.slots.pop(index, None)
+				if worker and worker.is_alive():
+					self._retire(worker)
+				self.restart_at.pop(index, None)
+			self.count = count
+
+	def checkWorkers(self):
+		"""
+		Restart workers that died without being asked to stop, after their backoff has
+		passed, replace workers that should be recycled, and clean up retiring workers.
+		Returns a list of restarted slots.
+		"""
+		restarted = []
+		now = time.time()
+
+		with self.lock:
+			if self.stopping:
+				return restarted
+
+			for index in range(self.count):
+				worker = self.slots.get(index)
+				if worker and worker.is_alive():
+					reason = self._recycleReason(worker, now)
+					if reason:
+						self.logger.info("Worker {0} {1}, recycling".format(worker.name, reason))
+						try:
+							self._spawn(index)
+						except Exception:
+							self.logger.exception("Failed to start a replacement for worker {0}".format(worker.name))
+							continue
+						self._retire(worker)
+						self.recycles[index] += 1
+					continue
+
+				if not index in self.restart_at:
+					if worker and now - worker.started_at > self.max_backoff:
+						self.failures[index] = 0
+					wait = min(self.max_backoff, self.backoff * 2 ** self.failures[index])
+					self.restart_at[index] = now + wait
+					self.failures[index] += 1
+					self.logger.warning("Worker {0}-{1} died with exit code {2}, restarting in {3} seconds".format(
+						self.name, index, worker.exitcode if worker else None, wait))
+				if now < self.restart_at[index]:
+					continue
+
+				try:
+					self._spawn(index)
+				except Exception:
+					self.logger.exception("Failed to restart worker {0}-{1}".format(self.name, index))
+					continue
+				del self.restart_at[index]
+				self.restarts[index] += 1
+				restarted.append(index)
+
+			for pid, (worker, deadline) in list(self.retiring.items()):
+				if not worker.is_alive():
+					worker.join()
+					del self.retiring[pid]
+				elif now > deadline:
+					self.logger.warning("Worker {0} did not stop in time, terminating".format(worker.name))
+					worker.terminate()
+
+		return restarted
+
+	def getWorkers(self):
+		"""
+		Retrieve the state of all workers, as a list of dicts with the keys index, name,
+		pid, state, started_at, restarts, recycles, tasks, cpus and exitcode. State is one of "running", "dead"
+		(waiting to be restarted) or "retiring".
+		"""
+		with self.lock:
+			result = []
+			for index in range(self.count):
+				worker = self.slots.get(index)
+				result.append({
+					"index": index,
+					"name": worker.name if worker else None,
+					"pid": worker.pid if worker else None,
+					"state": "running" if worker and worker.is_alive() else "dead",
+					"started_at": worker.started_at if worker else None,
+					"restarts": self.restarts.get(index, 0),
+					"recycles": self.recycles.get(index, 0),
+					"tasks": worker.getTasks() if worker else None,
+					"cpus": worker.cpus if worker else None,
+					"exitcode": worker.exitcode if worker else None
+				})
+			for worker, deadline in self.retiring.values():
+				result.append({
+					"index": worker.index,
+					"name": worker.name,
+					"pid": worker.pid,
+					"state": "retiring",
+					"started_at": worker.started_at,
+					"restarts": self.restarts.get(worker.index, 0),
+					"recycles": self.recycles.get(worker.index, 0),
+					"tasks": worker.getTasks(),
+					"cpus": worker.cpus,
+					"exitcode": worker.exitcode
+				})
+			return result
+
+	def getProcesses(self):
+		"""
+		Retrieve a dict of name to Process of all workers, including retiring ones.
+		"""
+		with self.lock:
+			processes = dict((worker.name, worker) for worker in self.slots.values())
+			for worker, deadline in self.retiring.values():
+				processes["{0}.{1}".format(worker.name, worker.pid)] = worker
+			return processes
+
+	def requestStop(self):
+		"""
+		Stop supervising, and ask all workers to stop. Use stop() to also wait for them.
+		"""
+		with self.lock:
+			self.stopping = True
+			if self.supervisor:
+				self.supervisor.stop = True
+				self.supervisor = None
+			for worker in self.getProcesses().values():
+				worker.requestStop()
+
+	def stop(self, timeout=10, grace=5):
+		"""
+		Ask all workers to stop, and wait for them to exit. Workers that are still alive
+		after $timeout seconds are terminated, and killed after another $grace seconds.
+
+		Returns the summary of stop_processes().
+		"""
+		start = time.time()
+		self.requestStop()
+		summary = stop_processes(self.getProcesses(), start + timeout, grace, self.logger)
+		with self.lock:
+			self.slots = {}
+			self.retiring = {}
+			self.restart_at = {}
+		self.logger.info("Stopped pool {0} in {1:.1f} seconds".format(self.name, time.time() - start))
+		return summary
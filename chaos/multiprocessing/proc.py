@@ -0,0 +1,80 @@
+# Copyright (c) 2014 Nick Douma < n.douma [at] nekoconeko . nl >
+#
+# This file is part of chaos, a.k.a. python-chaos .
+#
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation; either
+# version 3.0 of the License, or (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with this library. If not, see
+# <http://www.gnu.org/licenses/>.
+
+""" Helper functions for reading process information from /proc, on Linux. """
+
+from __future__ import absolute_import
+import os
+
+PAGE_SIZE = os.sysconf("SC_PAGE_SIZE")
+
+def get_rss(pid):
+	"""
+	Return the resident set size of the given process in bytes, or None if the
+	process does not exist (anymore).
+
+	Parameters
+	----------
+	pid: int
+		The process id.
+	"""
+	try:
+		with open("/proc/{0}/statm".format(pid)) as statm:
+			return int(statm.read().split()[1]) * PAGE_SIZE
+	except (IOError, OSError, IndexError, ValueError):
+		return None
+
+CLOCK_TICKS = os.sysconf("SC_CLK_TCK")
+
+def get_stats(pid):
+	"""
+	Return a dict with resource usage of the given process, or None if the process does
+	not exist (anymore). The keys are:
+
+	- cpu: user plus system CPU time, in seconds.
+	- rss: resident set size, in bytes.
+	- voluntary_switches: number of voluntary context switches.
+	- involuntary_switches: number of involuntary context switches.
+	- fds: number of open file descriptors, or None if they can not be read.
+
+	Parameters
+	----------
+	pid: int
+		The process id.
+	"""
+	try:
+		with open("/proc/{0}/stat".format(pid)) as stat:
+			# The process name may contain spaces, fields are counted from its end
+			fields = stat.read().rsplit(")", 1)[1].split()
+		with open("/proc/{0}/status".format(pid)) as status:
+			lines = dict(line.split(":", 1) for line in status if ":" in line)
+	except (IOError, OSError, IndexError, ValueError):
+		return None
+
+	stats = {
+		"cpu": float(int(fields[11]) + int(fields[12])) / CLOCK_TICKS,
+		"rss": int(fields[21]) * PAGE_SIZE,
+		"voluntary_switches": int(lines.get("voluntary_ctxt_switches", 0)),
+		"involuntary_switches": int(lines.get("nonvoluntary_ctxt_switches", 0)),
+		"fds": None
+	}
+	try:
+		stats["fds"] = len(os.listdir("/proc/{0}/fd".format(pid)))
+	except (IOError, OSError):
+		pass
+	return stats
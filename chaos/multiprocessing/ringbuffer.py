@@ -0,0 +1,237 @@
+# Copyright (c) 2014 Nick Douma < n.douma [at] nekoconeko . nl >
+#
+# This file is part of chaos, a.k.a. python-chaos .
+#
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation; either
+# version 3.0 of the License, or (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with this library. If not, see
+# <http://www.gnu.org/licenses/>.
+
+"""
+Ring buffers in shared memory, for passing bytes between processes.
+
+Unlike multiprocessing.Queue, messages are not pickled and do not pass through a pipe.
+They are copied into shared memory once, and can be read without copying them again.
+A ring buffer must be created before the processes using it are started.
+"""
+
+from __future__ import absolute_import
+import contextlib, ctypes, multiprocessing, struct, time
+from multiprocessing.sharedctypes import RawArray
+
+try:
+	from Queue import Empty, Full
+except ImportError:
+	from queue import Empty, Full
+
+# The header holds the write position, followed by the read position. Both only ever
+# increase, and each is only written by one side.
+POSITION = struct.Struct("Q")
+WRITE, READ = 0, POSITION.size
+# Every message is prefixed by its length.
+LENGTH = struct.Struct("I")
+# Length marking that the rest of the buffer is unused, and the next message starts at 0.
+WRAP = 0xFFFFFFFF
+
+class RingBuffer(object):
+	"""
+	A single-producer, single-consumer ring buffer of byte messages in shared memory.
+
+	Exactly one process may call put(), and exactly one process may call get() or
+	read(). Use MPMCRingBuffer if there are more.
+	"""
+	def __init__(self, size=1048576):
+		"""
+		Allocate the shared memory. A single message can be at most $size - 4 bytes.
+
+		Parameters
+		----------
+		size: int
+			Size of the data area in bytes.
+		"""
+		self.size = size
+		self.header = RawArray(ctypes.c_ubyte, 2 * POSITION.size)
+		self.data = RawArray(ctypes.c_ubyte, size)
+		self.view = memoryview(self.data)
+		if hasattr(self.view, "cast"):
+			self.view = self.view.cast("B")
+		self.items = multiprocessing.Semaphore(0)
+
+	def _positions(self):
+		return POSITION.unpack_from(self.header, WRITE)[0], POSITION.unpack_from(self.header, READ)[0]
+
+	def put(self, data, block=True, timeout=None):
+		"""
+		Copy a message into the buffer. When the buffer is full, wait until there is room,
+		or raise Full when not blocking or when the timeout passes.
+
+		Messages are never split, so a message larger than the free space at the end of
+		the buffer waits until the buffer is empty.
+
+		Parameters
+		----------
+		data: bytes, bytearray or memoryview
+			The message to write.
+		block: boolean
+			If False, raise Full immediately when there is no room.
+		timeout: float
+			Maximum number of seconds to wait for room.
+		"""
+		length = len(data)
+		if length + LENGTH.size > self.size:
+			raise ValueError("Message of {0} bytes does not fit in a buffer of {1} bytes".format(length, self.size))
+
+		deadline = None if timeout is None else time.time() + timeout
+		pause = 0.00005
+		while True:
+			write, read = self._positions()
+			if write == read and write % self.size:
+				# The buffer is empty, so no consumer is using it. Start at the beginning,
+				# otherwise a message larger than half the buffer might never fit.
+				write = read = write + self.size - write % self.size
+				POSITION.pack_into(self.header, READ, read)
+				POSITION.pack_into(self.header, WRITE, write)
+			offset = write % self.size
+			needed = LENGTH.size + length
+			# Messages never wrap around, skip the unused end of the buffer instead
+			skip = self.size - offset if self.size - offset < needed else 0
+			if self.size - (write - read) >= skip + needed:
+				break
+			if not block or (deadline is not None and time.time() > deadline):
+				raise Full()
+			time.sleep(pause)
+			pause = min(pause * 2, 0.01)
+
+		if skip:
+			if skip >= LENGTH.size:
+				LENGTH.pack_into(self.data, offset, WRAP)
+			write += skip
+			offset = 0
+
+		LENGTH.pack_into(self.data, offset, length)
+		self.view[offset + LENGTH.size:offset + needed] = data
+		POSITION.pack_into(self.header, WRITE, write + needed)
+		self.items.release()
+
+	def _acquire(self, block, timeout):
+		if block and timeout is not None:
+			acquired = self.items.acquire(True, timeout)
+		else:
+			acquired = self.items.acquire(block)
+		if not acquired:
+			raise Empty()
+
+	def _next(self):
+		# Returns the offset and length of the next message, and the new read position.
+		read = POSITION.unpack_from(self.header, READ)[0]
+		offset = read % self.size
+		if self.size - offset < LENGTH.size or LENGTH.unpack_from(self.data, offset)[0] == WRAP:
+			read += self.size - offset
+			offset = 0
+		length = LENGTH.unpack_from(self.data, offset)[0]
+		return offset + LENGTH.size, length, read + LENGTH.size + length
+
+	def _release(self, read):
+		POSITION.pack_into(self.header, READ, read)
+
+	@contextlib.contextmanager
+	def read(self, block=True, timeout=None):
+		"""
+		Read the next message without copying it. Use as follows:
+
+			with ring.read() as view:
+				handle(view)
+
+		The memoryview is only valid inside the with statement, its space is given back
+		to the producer afterwards. Raises Empty when there is no message.
+
+		Parameters
+		----------
+		block: boolean
+			If False, raise Empty immediately when there is no message.
+		timeout: float
+			Maximum number of seconds to wait for a message.
+		"""
+		self._acquire(block, timeout)
+		offset, length, read = self._next()
+		view = self.view[offset:offset + length]
+		try:
+			yield view
+		finally:
+			if hasattr(view, "release"):
+				view.release()
+			self._release(read)
+
+	def get(self, block=True, timeout=None):
+		"""
+		Return a copy of the next message as bytes. Raises Empty when there is no message.
+
+		Parameters
+		----------
+		block: boolean
+			If False, raise Empty immediately when there is no message.
+		timeout: float
+			Maximum number of seconds to wait for a message.
+		"""
+		# Avoids the overhead of the read() context manager, which matters for small messages
+		self._acquire(block, timeout)
+		offset, length, read = self._next()
+		data = self.view[offset:offset + length].tobytes()
+		self._release(read)
+		return data
+
+class MPMCRingBuffer(RingBuffer):
+	"""
+	A multi-producer, multi-consumer ring buffer of byte messages in shared memory.
+
+	Producers and consumers are serialized by a lock per side, so a producer and a
+	consumer never wait for each other.
+	"""
+	def __init__(self, size=1048576):
+		super(MPMCRingBuffer, self).__init__(size)
+		self.put_lock = multiprocessing.Lock()
+		self.get_lock = multiprocessing.Lock()
+
+	def put(self, data, block=True, timeout=None):
+		"""
+		See RingBuffer.put().
+		"""
+		with self.put_lock:
+			super(MPMCRingBuffer, self).put(data, block, timeout)
+
+	@contextlib.contextmanager
+	def read(self, block=True, timeout=None):
+		"""
+		See RingBuffer.read().
+		"""
+		self._acquire(block, timeout)
+		with self.get_lock:
+			offset, length, read = self._next()
+			view = self.view[offset:offset + length]
+			try:
+				yield view
+			finally:
+				if hasattr(view, "release"):
+					view.release()
+				self._release(read)
+	read.__doc__ = RingBuffer.read.__doc__
+
+	def get(self, block=True, timeout=None):
+		"""
+		See RingBuffer.get().
+		"""
+		self._acquire(block, timeout)
+		with self.get_lock:
+			offset, length, read = self._next()
+			data = self.view[offset:offset + length].tobytes()
+			self._release(read)
+		return data
@@ -0,0 +1,454 @@
+# Copyright (c) 2014 Nick Douma < n.douma [at] nekoconeko . nl >
+#
+# This file is part of chaos, a.k.a. python-chaos .
+#
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation; either
+# version 3.0 of the License, or (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with this library. If not, see
+# <http://www.gnu.org/licenses/>.
+
+"""
+Dispatching many small tasks to a pool of worker processes.
+
+Instead of a single shared queue, every worker has its own inbox queue. Tasks are sent
+to the inboxes in batches, round-robin, and a worker runs a batch from a local deque
+without touching any queue. A worker whose inbox is empty steals queued batches from
+the inboxes of its siblings. Results are sent back in batches as well.
+"""
+
+from __future__ import absolute_import
+import collections, itertools, logging, multiprocessing, random, threading, time, traceback
+from .pool import WorkerPool
+
+try:
+	import cPickle as pickle
+except ImportError:
+	import pickle
+
+try:
+	import Queue as queue
+except ImportError:
+	import queue
+
+class TaskError(Exception):
+	"""
+	Raised by TaskResult.get() when a task raised an exception that could not be sent
+	back to the main process, when the worker running the task died, or when the pool
+	was shut down before the task ran.
+	"""
+	pass
+
+class TaskResult(object):
+	"""
+	The pending result of a task submitted to a TaskPool.
+	"""
+	__slots__ = ("pool", "task_id", "done", "success", "value", "traceback", "callbacks")
+
+	def __init__(self, pool, task_id):
+		self.pool = pool
+		self.task_id = task_id
+		self.done = False
+		self.success = None
+		self.value = None
+		self.traceback = None
+		self.callbacks = None
+
+	def ready(self):
+		"""
+		Returns True if the task has finished.
+		"""
+		return self.done
+
+	def successful(self):
+		"""
+		Returns True if the task finished without raising an exception, or None if it did
+		not finish yet.
+		"""
+		return self.success
+
+	def get(self, timeout=None):
+		"""
+		Wait for the task to finish, and return its return value, or raise the exception
+		it raised. Raises queue.Empty when the timeout passes first.
+
+		Parameters
+		----------
+		timeout: float
+			Maximum number of seconds to wait.
+		"""
+		if not self.done:
+			self.pool.flush()
+			self.pool._wait(self, timeout)
+			if not self.done:
+				raise queue.Empty()
+		if not self.success:
+			raise self.value
+		return self.value
+
+	def addCallback(self, callback):
+		"""
+		Call the given function with this TaskResult when the task has finished. The
+		callback runs on the result collector Thread of the pool, or immediately if the
+		task has already finished.
+
+		Parameters
+		----------
+		callback: function pointer
+			The function to call.
+		"""
+		with self.pool.finished:
+			if not self.done:
+				if self.callbacks is None:
+					self.callbacks = []
+				self.callbacks.append(callback)
+				return
+		callback(self)
+
+def _take(inboxes, own, others, timeout):
+	# Returns a batch from the own inbox, a batch stolen from a sibling, or None
+	try:
+		return inboxes[own].get_nowait()
+	except queue.Empty:
+		pass
+	random.shuffle(others)
+	for other in others:
+		try:
+			return inboxes[other].get_nowait()
+		except queue.Empty:
+			pass
+	try:
+		return inboxes[own].get(True, timeout)
+	except queue.Empty:
+		return None
+
+def _encode(done):
+	try:
+		return pickle.dumps(done, pickle.HIGHEST_PROTOCOL)
+	except Exception:
+		pass
+	# Something in the batch can not be pickled, replace it by a TaskError
+	safe = []
+	for task_id, success, value, tb in done:
+		try:
+			pickle.dumps(value, pickle.HIGHEST_PROTOCOL)
+		except Exception as e:
+			success, value = False, TaskError("Failed to send the result of task {0}: {1!r}".format(task_id, e))
+		safe.append((task_id, success, value, tb))
+	return pickle.dumps(safe, pickle.HIGHEST_PROTOCOL)
+
+def work(inboxes, results, poll=0.05):
+	"""
+	Main loop of a TaskPool worker. Runs until the worker is asked to stop, the batch
+	it is running is finished first. Before running a batch, the worker claims it by
+	sending its id, so the batch can be failed when the worker dies.
+	"""
+	worker = multiprocessing.current_process()
+	own = worker.index % len(inboxes)
+	others = [index for index in range(len(inboxes)) if index != own]
+	local = collections.deque()
+
+	while not worker.shouldStop():
+		batch = _take(inboxes, own, others, poll)
+		if batch is None:
+			continue
+
+		batch_id, tasks = batch
+		results.put((batch_id, worker.pid, None))
+		local.extend(tasks)
+		done = []
+		while local:
+			task_id, action, args, kwargs = local.popleft()
+			try:
+				done.append((task_id, True, action(*args, **kwargs), None))
+			except Exception as e:
+				done.append((task_id, False, e, traceback.format_exc()))
+			worker.taskDone()
+		results.put((batch_id, worker.pid, _encode(done)))
+
+class TaskPool(object):
+	"""
+	Runs submitted functions on a WorkerPool, batching small tasks and letting idle
+	workers steal work from busy ones.
+
+	The underlying WorkerPool is available as the pool attribute, and can be registered
+	with Workers.registerPool(), so it is stopped by Workers.stopAll(). Functions and
+	their arguments must be picklable.
+
+	When a worker dies, all tasks of the batch it was running fail with a TaskError,
+	including the ones it already finished. They are not resubmitted, as they may be
+	what killed the worker.
+	"""
+	def __init__(self, name, workers=4, batch_size=32, **kwargs):
+		"""
+		Initialize a new TaskPool. No Processes are started until start() is called.
+
+		Parameters
+		----------
+		name: string
+			Descriptive name of this TaskPool, also used for its WorkerPool.
+		workers: int
+			Number of worker Processes.
+		batch_size: int
+			Number of tasks that are sent to a worker at once. Use 1 for long running tasks.
+		**kwargs
+			Keyword arguments to pass to the WorkerPool, such as backoff.
+		"""
+		if workers < 1:
+			raise Exception("TaskPool {0} needs at least one worker".format(name))
+
+		self.logger = logging.getLogger(name)
+		self.name = name
+		self.batch_size = batch_size
+		self.inboxes = [multiprocessing.Queue() for i in range(workers)]
+		self.results = multiprocessing.Queue()
+		self.pool = WorkerPool(name, work, workers, args=(self.inboxes, self.results), **kwargs)
+
+		self.counter = itertools.count()
+		self.batch_counter = itertools.count()
+		self.next_inbox = 0
+		self.buffer = []
+		self.pending = {}
+		# Task ids of every batch that was sent, and did not finish yet
+		self.batches = {}
+		# Batch id claimed by every worker pid, and pids that were found dead. Only
+		# used by the collector Thread.
+		self.running = {}
+		self.reaped = set()
+		self.lock = threading.Lock()
+		# Notified by the collector after every batch of results
+		self.finished = threading.Condition(threading.Lock())
+		self.collector = None
+
+	def start(self):
+		"""
+		Start the worker Processes, and the Thread that collects their results.
+		"""
+		self.collector = threading.Thread(target=self._collect, name="{0}.collector".format(self.name))
+		self.collector.daemon = True
+		self.collector.start()
+		self.pool.start()
+
+	def submit(self, action, *args, **kwargs):
+		"""
+		Queue a function for execution, and return a TaskResult for it. The task is sent
+		to a worker when batch_size tasks are queued, when flush() is called, or when its
+		result is waited for.
+
+		Parameters
+		----------
+		action: function pointer
+			The function to call.
+		*args
+			Positional arguments to pass to action.
+		**kwargs:
+			Keyword arguments to pass to action.
+		"""
+		with self.lock:
+			task_id = next(self.counter)
+			result = self.pending[task_id] = TaskResult(self, task_id)
+			self.buffer.append((task_id, action, args, kwargs))
+			if len(self.buffer) >= self.batch_size:
+				self._send()
+		return result
+
+	def map(self, action, iterable, ordered=True):
+		"""
+		Call a function for every item of an iterable, and return a generator of the
+		return values. Raises the exception of the first failed task that is reached.
+
+		Parameters
+		----------
+		action: function pointer
+			The function to call with every item.
+		iterable: iterable
+			The items.
+		ordered: boolean
+			If True, return values are generated in the order of the items. If False,
+			they are generated as soon as the tasks finish.
+		"""
+		results = []
+		batch = []
+		empty = {}
+		for item in iterable:
+			batch.append(((item,), empty))
+			if len(batch) >= self.batch_size:
+				results.extend(self._submitBatch(action, batch))
+				batch = []
+		results.extend(self._submitBatch(action, batch))
+		self.flush()
+		if ordered:
+			return (result.get() for result in results)
+		return (result.get() for result in as_completed(results))
+
+	def _submitBatch(self, action, batch):
+		# Submits a list of (args, kwargs) while taking the lock only once
+		results = []
+		with self.lock:
+			for args, kwargs in batch:
+				task_id = next(self.counter)
+				result = self.pending[task_id] = TaskResult(self, task_id)
+				self.buffer.append((task_id, action, args, kwargs))
+				results.append(result)
+			if len(self.buffer) >= self.batch_size:
+				self._send()
+		return results
+
+	def flush(self):
+		"""
+		Send all queued tasks to the workers, even if the batch is not full.
+		"""
+		with self.lock:
+			self._send()
+
+	def _send(self):
+		# Must be called with self.lock held.
+		if not self.buffer:
+			return
+		batch_id = next(self.batch_counter)
+		self.batches[batch_id] = [task[0] for task in self.buffer]
+		self.inboxes[self.next_inbox].put((batch_id, self.buffer))
+		self.next_inbox = (self.next_inbox + 1) % len(self.inboxes)
+		self.buffer = []
+
+	def _collect(self):
+		# Messages are (batch_id, pid, None) when a worker claims a batch, (batch_id, pid,
+		# results) when it finished it, and (None, pid, None) when it was found dead.
+		next_check = time.time() + self.pool.interval
+		while True:
+			try:
+				message = self.results.get(True, self.pool.interval)
+			except queue.Empty:
+				message = ()
+			if message is None:
+				return
+
+			if message:
+				batch_id, pid, done = message
+				if batch_id is None:
+					self.reaped.discard(pid)
+					batch_id = self.running.pop(pid, None)
+					if batch_id is not None:
+						self._failBatch(batch_id, "worker with pid {0} died".format(pid))
+				elif done is None:
+					self.running[pid] = batch_id
+				else:
+					if self.running.get(pid) == batch_id:
+						del self.running[pid]
+					with self.lock:
+						self.batches.pop(batch_id, None)
+					self._finish(pickle.loads(done))
+
+			if time.time() >= next_check:
+				next_check = time.time() + self.pool.interval
+				self._reap()
+
+	def _reap(self):
+		# Anything a dead worker sent is already in the results queue, so a notice put
+		# behind it is received only after its last results.
+		alive = set(worker.pid for worker in self.pool.getProcesses().values() if worker.is_alive())
+		for pid in self.running:
+			if not pid in alive and not pid in self.reaped:
+				self.reaped.add(pid)
+				self.results.put((None, pid, None))
+
+	def _failBatch(self, batch_id, reason):
+		with self.lock:
+			task_ids = self.batches.pop(batch_id, ())
+		self.logger.warning("TaskPool {0} failed {1} tasks, {2}".format(self.name, len(task_ids), reason))
+		self._finish([(task_id, False, TaskError("Task {0} failed, {1}".format(task_id, reason)), None) for task_id in task_ids])
+
+	def _finish(self, done):
+		callbacks = []
+		with self.lock:
+			results = [(self.pending.pop(task_id, None), success, value, tb) for task_id, success, value, tb in done]
+		with self.finished:
+			for result, success, value, tb in results:
+				if result:
+					result.success, result.value, result.traceback = success, value, tb
+					result.done = True
+					if result.callbacks:
+						callbacks.append(result)
+			self.finished.notify_all()
+
+		for result in callbacks:
+			for callback in result.callbacks:
+				try:
+					callback(result)
+				except Exception:
+					self.logger.exception("TaskPool {0} caught an exception in a callback!".format(self.name))
+			result.callbacks = None
+
+	def _wait(self, result, timeout):
+		deadline = None if timeout is None else time.time() + timeout
+		with self.finished:
+			while not result.done:
+				if deadline is None:
+					self.finished.wait()
+				elif deadline > time.time():
+					self.finished.wait(deadline - time.time())
+				else:
+					return
+
+	def getPending(self):
+		"""
+		Returns the number of tasks that did not finish yet.
+		"""
+		with self.lock:
+			return len(self.pending)
+
+	def shutdown(self, wait=True, timeout=10, grace=5):
+		"""
+		Stop the workers. If $wait = True, first wait for all submitted tasks to finish.
+		Tasks that did not run fail with a TaskError.
+
+		Parameters
+		----------
+		wait: boolean
+			If True, let all submitted tasks finish first.
+		timeout: int
+			Maximum number of seconds to wait for the workers to exit, see WorkerPool.stop().
+		grace: int
+			Maximum number of seconds to wait for terminated workers to exit.
+		"""
+		if wait:
+			self.flush()
+			with self.lock:
+				pending = list(self.pending.values())
+			for result in pending:
+				self._wait(result, None)
+		summary = self.pool.stop(timeout, grace)
+		self.results.put(None)
+		self.collector.join()
+		with self.lock:
+			task_ids = list(self.pending)
+			self.batches = {}
+			self.buffer = []
+		self._finish([(task_id, False, TaskError("Task {0} failed, TaskPool {1} was shut down".format(task_id, self.name)), None) for task_id in task_ids])
+		self.logger.debug("TaskPool {0} stopped".format(self.name))
+		return summary
+
+def as_completed(results):
+	"""
+	Generate the given TaskResults in the order in which their tasks finish.
+
+	Parameters
+	----------
+	results: list of TaskResult
+		The results to wait for.
+	"""
+	finished = queue.Queue()
+	for result in results:
+		result.addCallback(finished.put)
+	for pool in set(result.pool for result in results):
+		pool.flush()
+	for i in range(len(results)):
+		yield finished.get()
@@ -0,0 +1,116 @@
+# Copyright (c) 2014 Nick Douma < n.douma [at] nekoconeko . nl >
+#
+# This file is part of chaos, a.k.a. python-chaos .
+#
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation; either
+# version 3.0 of the License, or (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with this library. If not, see
+# <http://www.gnu.org/licenses/>.
+
+""" Rolling resource usage histories of worker processes. """
+
+from __future__ import absolute_import
+import collections, threading, time
+from .proc import get_stats
+
+class Telemetry(object):
+	"""
+	Keeps a short history of /proc samples for a group of processes, and summarizes it.
+
+	Rates are calculated over the whole history of a process, so a longer window gives
+	smoother numbers.
+	"""
+	def __init__(self, window=60):
+		"""
+		Parameters
+		----------
+		window: int
+			Number of samples to keep per process.
+		"""
+		self.window = window
+		self.lock = threading.Lock()
+		self.history = {}
+
+	def sample(self, processes):
+		"""
+		Take one sample of every given process that is alive. Histories of processes that
+		are not given anymore, or were replaced by a new process under the same name, are
+		dropped.
+
+		Parameters
+		----------
+		processes: dict
+			Dict of name to multiprocessing.Process.
+		"""
+		now = time.time()
+		samples = {}
+		for name, process in processes.items():
+			if process.pid is None or not process.is_alive():
+				continue
+			stats = get_stats(process.pid)
+			if stats is not None:
+				stats["time"] = now
+				samples[name] = (process.pid, stats)
+
+		with self.lock:
+			for name in list(self.history):
+				if not name in samples:
+					del self.history[name]
+			for name, (pid, stats) in samples.items():
+				pid_history = self.history.get(name)
+				if pid_history is None or pid_history[0] != pid:
+					pid_history = self.history[name] = (pid, collections.deque(maxlen=self.window))
+				pid_history[1].append(stats)
+
+	def snapshot(self):
+		"""
+		Return a dict with a "workers" dict of name to the latest sample of each process,
+		extended with rates over its history, and a "total" dict that sums them.
+
+		Per process, the keys are pid, cpu, rss, voluntary_switches, involuntary_switches
+		and fds as reported by chaos.multiprocessing.proc.get_stats(), plus:
+
+		- cpu_percent: CPU usage, 100 is one full core.
+		- rss_growth: change in RSS, in bytes per second.
+		- switches_per_second: context switches per second.
+		- samples: number of samples in the history.
+
+		Rates are None until there are two samples.
+		"""
+		with self.lock:
+			histories = dict((name, (pid, list(samples))) for name, (pid, samples) in self.history.items())
+
+		workers = {}
+		total = {"workers": 0, "cpu_percent": 0.0, "rss": 0, "rss_growth": 0.0, "switches_per_second": 0.0, "fds": 0}
+		for name, (pid, samples) in histories.items():
+			first, last = samples[0], samples[-1]
+			elapsed = last["time"] - first["time"]
+			worker = dict(last)
+			del worker["time"]
+			worker["pid"] = pid
+			worker["samples"] = len(samples)
+			worker["cpu_percent"] = worker["rss_growth"] = worker["switches_per_second"] = None
+			if elapsed > 0:
+				switches = (last["voluntary_switches"] + last["involuntary_switches"]
+					- first["voluntary_switches"] - first["involuntary_switches"])
+				worker["cpu_percent"] = 100 * (last["cpu"] - first["cpu"]) / elapsed
+				worker["rss_growth"] = (last["rss"] - first["rss"]) / elapsed
+				worker["switches_per_second"] = switches / elapsed
+			workers[name] = worker
+
+			total["workers"] += 1
+			total["rss"] += worker["rss"]
+			total["fds"] += worker["fds"] or 0
+			for key in ("cpu_percent", "rss_growth", "switches_per_second"):
+				total[key] += worker[key] or 0.0
+
+		return {"workers": workers, "total": total}
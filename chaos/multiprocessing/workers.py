@@ -19,18 +19,97 @@
 """ Helper functions for working with python multiprocessing. """
 
 from __future__ import absolute_import
-import multiprocessing, logging, os
+import multiprocessing, logging, os, signal, time
+from .affinity import Placement, PIN
+from .telemetry import Telemetry
+from ..threading.scheduler import Scheduler
+
+def join_processes(processes, deadline):
+	"""
+	Join the given Processes until they exit, or until the deadline passes. Returns
+	a dict of the Processes that are still alive.
+
+	Parameters
+	----------
+	processes: dict
+		Dict of name to multiprocessing.Process.
+	deadline: float
+		UNIX timestamp after which to stop waiting.
+	"""
+	alive = {}
+	for name, process in processes.items():
+		if process.is_alive():
+			process.join(max(0, deadline - time.time()))
+		if process.is_alive():
+			alive[name] = process
+	return alive
+
+def stop_processes(processes, deadline, grace, logger):
+	"""
+	Wait for the given Processes to exit until the deadline passes. Processes that
+	are still alive are terminated and given $grace seconds to exit, after which they
+	are killed.
+
+	Returns a dict with lists of names of Processes that were "stopped", "terminated"
+	and "killed".
+
+	Parameters
+	----------
+	processes: dict
+		Dict of name to multiprocessing.Process.
+	deadline: float
+		UNIX timestamp after which to stop waiting, and start terminating.
+	grace: int
+		Maximum number of seconds to wait for all terminated Processes to exit.
+	logger: logging.Logger
+		Logger to report escalations to.
+	"""
+	summary = {"stopped": [], "terminated": [], "killed": []}
+	alive = join_processes(processes, deadline)
+	summary["stopped"] = [name for name in processes if name not in alive]
+
+	if alive:
+		for name, process in alive.items():
+			logger.warning("Failed to stop {0}, terminating".format(process.name))
+			process.terminate()
+		still_alive = join_processes(alive, time.time() + grace)
+		summary["terminated"] = [name for name in alive if name not in still_alive]
+
+		for name, process in still_alive.items():
+			logger.warning("Failed to terminate {0}, killing".format(process.name))
+			try:
+				os.kill(process.pid, signal.SIGKILL)
+			except OSError:
+				pass
+			process.join(1)
+			summary["killed"].append(name)
+
+	return summary
 
 class Workers(object):
 	"""
 	Container to register and handle multiple Worker processes.
+
+	Besides single Workers, supervised pools of identical Workers can be registered,
+	see chaos.multiprocessing.pool.WorkerPool.
+
+	Workers can be placed on CPU cores when they are started, see registerWorker(),
+	startAll() and chaos.multiprocessing.affinity.
+
+	The resource usage of all Workers can be sampled periodically, see startTelemetry().
 	"""
 	worker_list = {}
+	pool_list = {}
+	ring_list = {}
+	placement_list = {}
+	placed_list = {}
+	telemetry = None
+	telemetry_scheduler = None
 
 	def __init__(self):
 		self.logger = logging.getLogger(__name__)
 
-	def registerWorker(self, name, worker):
+	def registerWorker(self, name, worker, placement=None):
 		"""
 		Register a new Worker, under the given descriptive name.
 
@@ -42,6 +121,9 @@ class Workers(object):
 			Name to register the given worker under.
 		worker: multiprocessing.Process, or a subclass
 			Process object to register.
+		placement: int, list of int or chaos.multiprocessing.affinity.Placement
+			CPU or CPUs to pin the worker to when it is started. Overrides the placement
+			passed to startAll().
 		"""
 		if not isinstance(worker, multiprocessing.Process):
 			self.logger.error("Process {0} is not actually a Process!".format(name))
@@ -52,6 +134,10 @@ class Workers(object):
 			raise Exception("Process {0} already registered!".format(name))
 
 		self.worker_list[name] = worker
+		if placement is not None:
+			if not isinstance(placement, Placement):
+				placement = Placement(PIN, placement)
+			self.placement_list[name] = placement
 		self.logger.debug("Registered worker {0}".format(name))
 
 		return worker
@@ -97,46 +183,284 @@ class Workers(object):
 			raise Exception("Worker {0} is not registered!".format(name))
 
 		del self.worker_list[name]
+		self.ring_list.pop(name, None)
+		self.placement_list.pop(name, None)
+		self.placed_list.pop(name, None)
 		self.logger.debug("Unregistered worker {0}".format(name))
 
-	def startAll(self):
+	def registerPool(self, name, pool):
+		"""
+		Register a new WorkerPool, under the given descriptive name.
+
+		Trying to register multiple pools under the same name will raise an Exception.
+
+		Parameters
+		----------
+		name: string
+			Name to register the given pool under.
+		pool: chaos.multiprocessing.pool.WorkerPool
+			Pool to register.
+		"""
+		if name in self.pool_list:
+			self.logger.error("Pool {0} already registered!".format(name))
+			raise Exception("Pool {0} already registered!".format(name))
+
+		self.pool_list[name] = pool
+		self.logger.debug("Registered pool {0}".format(name))
+
+		return pool
+
+	def getPools(self):
+		"""
+		Retrieve a list of names of all registered WorkerPools.
+		"""
+		return self.pool_list.keys()
+
+	def getPool(self, name):
+		"""
+		Retrieve the WorkerPool registered under the given name.
+
+		If the given name does not exists in the pool list, an Exception is raised.
+
+		Parameters
+		----------
+		name: string
+			Name of the WorkerPool to retrieve
+		"""
+		if not name in self.pool_list:
+			self.logger.error("Pool {0} is not registered!".format(name))
+			raise Exception("Pool {0} is not registered!".format(name))
+
+		return self.pool_list[name]
+
+	def unregisterPool(self, name):
+		"""
+		Unregister the WorkerPool registered under the given name. Make sure that the
+		pool is properly stopped first.
+
+		Parameters
+		----------
+		name: string
+			Name of the WorkerPool to unregister
+		"""
+		if not name in self.pool_list:
+			self.logger.error("Pool {0} is not registered!".format(name))
+			raise Exception("Pool {0} is not registered!".format(name))
+
+		del self.pool_list[name]
+		self.ring_list.pop(name, None)
+		self.logger.debug("Unregistered pool {0}".format(name))
+
+	def attachRing(self, name, ring):
+		"""
+		Attach a RingBuffer to the Worker or WorkerPool registered under the given name.
+		This must be done before the Worker is started. Inside the Worker, the RingBuffer
+		can be retrieved using getRing().
+
+		Parameters
+		----------
+		name: string
+			Name of the Worker or WorkerPool.
+		ring: chaos.multiprocessing.ringbuffer.RingBuffer
+			The RingBuffer to attach.
+		"""
+		if not name in self.worker_list and not name in self.pool_list:
+			self.logger.error("Worker {0} is not registered!".format(name))
+			raise Exception("Worker {0} is not registered!".format(name))
+
+		if name in self.worker_list and self.worker_list[name].pid is not None:
+			self.logger.error("Worker {0} was already started!".format(name))
+			raise Exception("Worker {0} was already started!".format(name))
+
+		self.ring_list[name] = ring
+		self.logger.debug("Attached ring buffer to {0}".format(name))
+
+		return ring
+
+	def getRing(self, name):
+		"""
+		Retrieve the RingBuffer attached to the Worker or WorkerPool with the given name.
+		This also works inside the Worker itself.
+
+		Parameters
+		----------
+		name: string
+			Name of the Worker or WorkerPool.
+		"""
+		if not name in self.ring_list:
+			self.logger.error("Worker {0} has no ring buffer!".format(name))
+			raise Exception("Worker {0} has no ring buffer!".format(name))
+
+		return self.ring_list[name]
+
+	def _place(self, name, process, placement, index):
+		try:
+			self.placed_list[name] = placement.apply(process.pid, index)
+			self.logger.debug("Placed {0} on CPUs {1}".format(process.name, self.placed_list[name]))
+		except Exception as e:
+			self.logger.warning("Failed to place {0} on CPUs {1}: {2}".format(process.name, placement.getCpus(index), e))
+
+	def startAll(self, placement=None):
 		"""
-		Start all registered Workers.
+		Start all registered Workers and WorkerPools.
+
+		Parameters
+		----------
+		placement: chaos.multiprocessing.affinity.Placement
+			Placement of the Workers that were registered without one. Workers are
+			numbered in order of their names. WorkerPools have their own placement,
+			see WorkerPool.setPlacement().
 		"""
 		self.logger.info("Starting all workers...")
 
-		for worker in self.getWorkers():
+		index = 0
+		for worker in sorted(self.getWorkers()):
 			process = self.getWorker(worker)
 			self.logger.debug("Starting {0}".format(process.name))
 			process.start()
+			if worker in self.placement_list:
+				self._place(worker, process, self.placement_list[worker], 0)
+			elif placement is not None:
+				self._place(worker, process, placement, index)
+				index += 1
+
+		for name in self.getPools():
+			self.getPool(name).start()
 
 		self.logger.info("Started all workers")
 
-	def stopAll(self, timeout=10, stop=False):
+	def getProcesses(self):
+		"""
+		Retrieve a dict of name to Process of all Workers, including the workers of
+		WorkerPools, which are named <pool name>/<worker name>.
+		"""
+		processes = dict((name, self.getWorker(name)) for name in self.getWorkers())
+		for pool_name in self.getPools():
+			for name, process in self.getPool(pool_name).getProcesses().items():
+				processes["{0}/{1}".format(pool_name, name)] = process
+		return processes
+
+	def startTelemetry(self, interval=5, window=60):
+		"""
+		Start a Scheduler thread that samples the CPU time, RSS, context switches and open
+		file descriptors of all Workers from /proc. See getTelemetry().
+
+		Parameters
+		----------
+		interval: int
+			Number of seconds between samples.
+		window: int
+			Number of samples to keep per Worker.
+		"""
+		if Workers.telemetry_scheduler:
+			self.logger.error("Telemetry is already running!")
+			raise Exception("Telemetry is already running!")
+
+		Workers.telemetry = Telemetry(window)
+		Workers.telemetry_scheduler = Scheduler(interval, self.sampleTelemetry, "workers.telemetry", startNow=True)
+		Workers.telemetry_scheduler.daemon = True
+		Workers.telemetry_scheduler.start()
+
+	def sampleTelemetry(self):
+		"""
+		Take one telemetry sample of all Workers now.
+		"""
+		if Workers.telemetry is None:
+			Workers.telemetry = Telemetry()
+		Workers.telemetry.sample(self.getProcesses())
+
+	def getTelemetry(self):
+		"""
+		Retrieve a snapshot of the telemetry of all Workers, see
+		chaos.multiprocessing.telemetry.Telemetry.snapshot(). Returns None if no samples
+		were taken yet.
+		"""
+		if Workers.telemetry is None:
+			return None
+		return Workers.telemetry.snapshot()
+
+	def stopTelemetry(self):
+		"""
+		Stop sampling telemetry. The collected telemetry stays available.
+		"""
+		if Workers.telemetry_scheduler:
+			Workers.telemetry_scheduler.stop = True
+			Workers.telemetry_scheduler = None
+
+	def getPlacement(self):
+		"""
+		Retrieve a dict of name to the list of CPUs of all Workers that were placed,
+		as reported by the kernel. Workers of WorkerPools are named
+		<pool name>/<worker name>.
+		"""
+		placement = dict(self.placed_list)
+		for pool_name in self.getPools():
+			for worker in self.getPool(pool_name).getWorkers():
+				if worker["cpus"] is not None:
+					placement["{0}/{1}".format(pool_name, worker["name"])] = worker["cpus"]
+		return placement
+
+	def stopAll(self, timeout=10, stop=False, grace=5, signum=None):
 		"""
 		Stop all registered Workers. This is method assumes that the Worker has already
-		received a stop message somehow, and simply joins the Process until it dies, as 
-		follows:
+		received a stop message somehow, and waits for all Processes to die, as follows:
+
+		1. If $signum is set, this signal is sent to all Workers at once.
+		2. All Workers are joined, until they exit or until $timeout seconds have passed.
+		   The timeout is shared by all Workers.
+		3. Workers that are still alive are terminated, and are given another $grace
+		   seconds to exit.
+		4. Workers that are still alive after that are killed.
+		5. All Workers are unregistered.
+		6. If $stop = True, the main process is killed.
 
-		1. The Worker is retrieved.
-		2. The Worker is joined, and will wait until the Worker exits.
-		3. The Worker is unregistered.
-		4. If $stop = True, the main process is killed.
+		WorkerPools are asked to stop their workers first, after which their workers are
+		handled like any other Worker, under the name <pool name>/<worker name>. The
+		WorkerPools are unregistered as well. Telemetry sampling is stopped.
+
+		Returns a dict with lists of names of Workers that were "stopped", "terminated"
+		and "killed", and the "duration" of the shutdown in seconds.
+
+		Parameters
+		----------
+		timeout: int
+			Maximum number of seconds to wait for all Workers to exit by themselves.
+		stop: boolean
+			If True, kill the main process after stopping all Workers.
+		grace: int
+			Maximum number of seconds to wait for all terminated Workers to exit.
+		signum: int
+			Signal to send to all Workers before waiting, for example signal.SIGINT.
 		"""
 		self.logger.info("Stopping all workers...")
+		start = time.time()
 
-		for worker in self.getWorkers():
-			process = self.getWorker(worker)
-			self.logger.debug("Stopping {0}".format(process.name))
-			if process.is_alive():
-				process.join(timeout)
+		self.stopTelemetry()
+		pools = dict((name, self.getPool(name)) for name in self.getPools())
+		for pool in pools.values():
+			pool.requestStop()
+		workers = self.getProcesses()
+
+		if signum is not None:
+			for name, process in workers.items():
 				if process.is_alive():
-					self.logger.warning("Failed to stop {0}, terminating".format(process.name))
-					process.terminate()
-			self.unregisterWorker(worker)
+					self.logger.debug("Sending signal {0} to {1}".format(signum, process.name))
+					os.kill(process.pid, signum)
 
-		self.logger.info("Stopped all workers")
+		summary = stop_processes(workers, start + timeout, grace, self.logger)
+
+		for name in list(self.getWorkers()):
+			self.unregisterWorker(name)
+		for name in pools:
+			pools[name].stop(timeout=0, grace=0)
+			self.unregisterPool(name)
+
+		summary["duration"] = time.time() - start
+		self.logger.info("Stopped all workers in {0:.1f} seconds: {1} stopped, {2} terminated, {3} killed".format(
+			summary["duration"], len(summary["stopped"]), len(summary["terminated"]), len(summary["killed"])))
 
 		if stop:
 			self.logger.fatal("Comitting suicide")
 			os._exit(0)
+
+		return summary
@@ -0,0 +1,241 @@
+# Copyright (c) 2014 Nick Douma < n.douma [at] nekoconeko . nl >
+#
+# This file is part of chaos, a.k.a. python-chaos .
+#
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation; either
+# version 3.0 of the License, or (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with this library. If not, see
+# <http://www.gnu.org/licenses/>.
+
+"""
+Cron-expression and calendar based triggers, for use with Scheduler and SchedulerPool.
+
+A trigger can be passed instead of a delay in seconds. The trigger then determines
+when the next run takes place, using its getNextRun() method.
+"""
+
+from __future__ import absolute_import
+import bisect, datetime, numbers, threading, time
+
+MACROS = {
+	"@yearly": "0 0 1 1 *",
+	"@annually": "0 0 1 1 *",
+	"@monthly": "0 0 1 * *",
+	"@weekly": "0 0 * * 0",
+	"@daily": "0 0 * * *",
+	"@midnight": "0 0 * * *",
+	"@hourly": "0 * * * *"
+}
+
+MONTHS = ["jan", "feb", "mar", "apr", "may", "jun", "jul", "aug", "sep", "oct", "nov", "dec"]
+WEEKDAYS = ["sun", "mon", "tue", "wed", "thu", "fri", "sat"]
+
+# (name, lowest value, highest value, names)
+FIELDS = [
+	("minute", 0, 59, None),
+	("hour", 0, 23, None),
+	("day", 1, 31, None),
+	("month", 1, 12, MONTHS),
+	("weekday", 0, 7, WEEKDAYS)
+]
+
+# Never look further ahead than this many years for a matching time
+SEARCH_YEARS = 10
+
+_compiled = {}
+_compiled_lock = threading.Lock()
+
+def _parse_value(value, low, names):
+	if names and value.lower() in names:
+		return names.index(value.lower()) + (1 if low == 1 else 0)
+	return int(value)
+
+def _parse_field(field, name, low, high, names):
+	"""
+	Parse a single cron field into a sorted tuple of allowed values.
+	"""
+	values = set()
+	for part in field.split(","):
+		step = 1
+		if "/" in part:
+			part, step = part.split("/", 1)
+			step = int(step)
+			if step < 1:
+				raise ValueError("Invalid step in {0} field: {1}".format(name, field))
+
+		if part == "*":
+			start, end = low, high
+		elif "-" in part:
+			start, end = part.split("-", 1)
+			start, end = _parse_value(start, low, names), _parse_value(end, low, names)
+		else:
+			start = _parse_value(part, low, names)
+			end = high if step > 1 else start
+
+		if start < low or end > high or start > end:
+			raise ValueError("Value out of range in {0} field: {1}".format(name, field))
+		values.update(range(start, end + 1, step))
+
+	return tuple(sorted(values))
+
+def compile_expression(expression):
+	"""
+	Compile a cron expression into a tuple of allowed values per field. Compiled
+	expressions are cached, so every expression is only parsed once.
+
+	The expression has five fields: minute, hour, day of month, month and day of week.
+	Each field may contain *, values, ranges (1-5), steps (*/15, 0-30/10) and lists (1,15).
+	Months and days of week may be given by their three letter english name. The
+	macros @yearly, @annually, @monthly, @weekly, @daily, @midnight and @hourly are
+	also supported.
+
+	As with cron, if both day of month and day of week are restricted, a time matches
+	when either of them matches. A field starting with *, such as */2, is not
+	restricted, and then a time matches when both of them match.
+
+	Returns a tuple: (minutes, hours, days, months, weekdays, day_any, weekday_any)
+
+	Parameters
+	----------
+	expression: string
+		The cron expression to compile.
+	"""
+	with _compiled_lock:
+		if expression in _compiled:
+			return _compiled[expression]
+
+	fields = MACROS.get(expression.strip().lower(), expression).split()
+	if len(fields) != 5:
+		raise ValueError("Cron expression must have 5 fields: {0}".format(expression))
+
+	parsed = [_parse_field(field, *spec) for field, spec in zip(fields, FIELDS)]
+	# Sunday may be given as both 0 and 7
+	weekdays = tuple(sorted(set(day % 7 for day in parsed[4])))
+	result = (parsed[0], parsed[1], parsed[2], parsed[3], weekdays,
+		fields[2].startswith("*"), fields[4].startswith("*"))
+
+	with _compiled_lock:
+		_compiled[expression] = result
+	return result
+
+class CronTrigger(object):
+	"""
+	Determines run times using a cron expression, in local time.
+	"""
+	def __init__(self, expression):
+		"""
+		Compile the given expression. An invalid expression raises a ValueError.
+
+		Parameters
+		----------
+		expression: string
+			Cron expression, see compile_expression() for the supported syntax.
+		"""
+		self.expression = expression
+		(self.minutes, self.hours, self.days, self.months, self.weekdays,
+			self.day_any, self.weekday_any) = compile_expression(expression)
+
+	def __repr__(self):
+		return "{0}({1!r})".format(self.__class__.__name__, self.expression)
+
+	def _matchDay(self, moment):
+		day = moment.day in self.days
+		# datetime uses monday=0, cron uses sunday=0
+		weekday = (moment.weekday() + 1) % 7 in self.weekdays
+		# Like cron, a field starting with * (including steps like */2) counts as
+		# unrestricted, and then both fields must match
+		if self.day_any or self.weekday_any:
+			return day and weekday
+		return day or weekday
+
+	def getNext(self, after):
+		"""
+		Return the first datetime after the given datetime that matches this expression.
+
+		Parameters
+		----------
+		after: datetime.datetime
+			The returned datetime is strictly later than this.
+		"""
+		moment = after.replace(second=0, microsecond=0) + datetime.timedelta(minutes=1)
+		limit = moment.year + SEARCH_YEARS
+
+		while moment.year <= limit:
+			if moment.month not in self.months:
+				index = bisect.bisect_left(self.months, moment.month)
+				if index < len(self.months):
+					moment = moment.replace(month=self.months[index], day=1, hour=0, minute=0)
+				else:
+					moment = moment.replace(year=moment.year + 1, month=self.months[0], day=1, hour=0, minute=0)
+				continue
+
+			if not self._matchDay(moment):
+				moment = moment.replace(hour=0, minute=0) + datetime.timedelta(days=1)
+				continue
+
+			if moment.hour not in self.hours:
+				index = bisect.bisect_left(self.hours, moment.hour)
+				if index < len(self.hours):
+					moment = moment.replace(hour=self.hours[index], minute=0)
+				else:
+					moment = moment.replace(hour=0, minute=0) + datetime.timedelta(days=1)
+				continue
+
+			index = bisect.bisect_left(self.minutes, moment.minute)
+			if index < len(self.minutes):
+				return moment.replace(minute=self.minutes[index])
+			moment = moment.replace(minute=0) + datetime.timedelta(hours=1)
+
+		raise ValueError("Cron expression {0} never matches".format(self.expression))
+
+	def getNextRun(self, after):
+		"""
+		Return the first matching time after the given time, as a UNIX timestamp.
+
+		Parameters
+		----------
+		after: float
+			UNIX timestamp, the returned timestamp is strictly later than this.
+		"""
+		moment = self.getNext(datetime.datetime.fromtimestamp(after))
+		return time.mktime(moment.timetuple())
+
+class CalendarTrigger(CronTrigger):
+	"""
+	Determines run times from calendar fields, instead of a cron expression.
+
+	Every field may be None (any value), a single value or a list of values. Fields
+	follow the cron conventions: month 1-12, day 1-31, weekday 0-6 with 0 being sunday.
+	"""
+	def __init__(self, minute=0, hour=None, day=None, month=None, weekday=None):
+		"""
+		Build the equivalent cron expression and compile it.
+
+		For example, CalendarTrigger(minute=15, hour=2) runs every day at 02:15.
+
+		Parameters
+		----------
+		minute: int or list of ints
+		hour: int or list of ints
+		day: int or list of ints
+		month: int or list of ints
+		weekday: int or list of ints
+		"""
+		fields = []
+		for value in (minute, hour, day, month, weekday):
+			if value is None:
+				fields.append("*")
+			elif isinstance(value, numbers.Integral):
+				fields.append(str(value))
+			else:
+				fields.append(",".join(str(v) for v in value))
+		super(CalendarTrigger, self).__init__(" ".join(fields))
@@ -0,0 +1,134 @@
+# Copyright (c) 2014 Nick Douma < n.douma [at] nekoconeko . nl >
+#
+# This file is part of chaos, a.k.a. python-chaos .
+#
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation; either
+# version 3.0 of the License, or (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with this library. If not, see
+# <http://www.gnu.org/licenses/>.
+
+""" A small, fixed-size pool of Threads for executing functions. """
+
+from __future__ import absolute_import
+import threading, logging
+
+try:
+	import Queue as queue
+except ImportError:
+	import queue
+
+class Executor(object):
+	"""
+	Executes submitted functions on a fixed number of worker Threads.
+
+	Functions are queued in the order they are submitted, and picked up by the
+	first idle worker. Exceptions raised by a function are logged, and will NOT
+	cause the worker to die.
+	"""
+	def __init__(self, name, workers=4):
+		"""
+		Initialize a new Executor. No Threads are started until start() is called.
+
+		Parameters
+		----------
+		name: string
+			Descriptive name of this Executor, used to name the worker Threads.
+		workers: int
+			Number of worker Threads to start.
+		"""
+		if workers < 1:
+			raise Exception("Executor {0} needs at least one worker".format(name))
+
+		self.logger = logging.getLogger(name)
+		self.name = name
+		self.workers = workers
+		self.queue = queue.Queue()
+		self.threads = []
+		self.active = 0
+		self.lock = threading.Lock()
+
+	def start(self):
+		"""
+		Start the worker Threads.
+		"""
+		for i in range(self.workers):
+			thread = threading.Thread(target=self._work, name="{0}-{1}".format(self.name, i))
+			thread.daemon = True
+			thread.start()
+			self.threads.append(thread)
+		self.logger.debug("Executor {0} started {1} workers".format(self.name, self.workers))
+
+	def submit(self, action, args=(), kwargs=None, callback=None):
+		"""
+		Queue a function for execution by one of the workers.
+
+		Parameters
+		----------
+		action: function pointer
+			The function to call.
+		args: tuple
+			Positional arguments to pass to action.
+		kwargs: dict
+			Keyword arguments to pass to action.
+		callback: function pointer
+			If set, this function is called with the return value of action,
+			or with None if action raised an exception.
+		"""
+		self.queue.put((action, args, kwargs or {}, callback))
+
+	def getActive(self):
+		"""
+		Returns the number of workers that are currently running a function.
+		"""
+		with self.lock:
+			return self.active
+
+	def shutdown(self, wait=True):
+		"""
+		Stop all worker Threads, after they finished all queued functions.
+
+		Parameters
+		----------
+		wait: boolean
+			If True, block until all workers have exited.
+		"""
+		for thread in self.threads:
+			self.queue.put(None)
+		if wait:
+			for thread in self.threads:
+				thread.join()
+		self.threads = []
+		self.logger.debug("Executor {0} stopped".format(self.name))
+
+	def _work(self):
+		while True:
+			item = self.queue.get()
+			if item is None:
+				break
+			action, args, kwargs, callback = item
+			result = None
+
+			with self.lock:
+				self.active += 1
+			try:
+				result = action(*args, **kwargs)
+			except Exception:
+				self.logger.exception("Executor {0} caught an exception!".format(self.name))
+			finally:
+				with self.lock:
+					self.active -= 1
+
+			if callback:
+				try:
+					callback(result)
+				except Exception:
+					self.logger.exception("Executor {0} caught an exception in a callback!".format(self.name))
@@ -19,9 +19,221 @@
 """ Helper functions for making Threads execute periodically. """
 
 from __future__ import absolute_import
-import threading, datetime, time, logging
+import threading, datetime, time, logging, heapq, hashlib, numbers, random, socket
+from .executor import Executor
+from .stats import RunStats
 
-class Scheduler(threading.Thread):
+# The delay is counted from the end of the previous run
+FIXED_DELAY = "fixed-delay"
+# The delay is counted from the planned start of the previous run
+FIXED_RATE = "fixed-rate"
+
+# Run every missed run back to back, until the schedule has caught up
+CATCH_UP = "catch-up"
+# Run once for all missed runs, and continue with the original schedule
+COALESCE = "coalesce"
+# Drop all missed runs, and continue with the next run in the future
+SKIP = "skip"
+
+class SchedulePolicy(object):
+	"""
+	Timing policy shared by Scheduler and ScheduledJob.
+
+	By default, the delay is counted from the moment the previous run finished,
+	and a run never overlaps with itself. Use setPolicy() to change this.
+
+	A run that takes longer than the delay is counted in overruns, runs that
+	were dropped because of an overrun are counted in skipped.
+
+	Instead of a delay in seconds, a trigger may be used, such as a CronTrigger.
+	A trigger is any object with a getNextRun(after) method, which returns the UNIX
+	timestamp of the first run after the given UNIX timestamp.
+
+	Use setSpread() to move runs away from the exact moment they are planned, so
+	that the same job on many hosts does not run at the same moment.
+
+	Statistics about all runs are kept in stats, use getStats() for a snapshot.
+	"""
+	def _initPolicy(self, delay):
+		self.trigger = delay if hasattr(delay, "getNextRun") else None
+		self.offset = 0
+		self.jitter = 0
+		self.lastJitter = 0
+		self.policy = FIXED_DELAY
+		self.missed = CATCH_UP
+		self.concurrency = 1
+		self.running = 0
+		self.overruns = 0
+		self.skipped = 0
+		self.policy_lock = threading.Lock()
+		self.stats = RunStats()
+
+	def setPolicy(self, policy=FIXED_DELAY, missed=CATCH_UP, concurrency=1):
+		"""
+		Set the timing policy of this schedule.
+
+		Parameters
+		----------
+		policy: string
+			FIXED_DELAY (default): the delay is counted from the end of the previous run.
+			FIXED_RATE: the delay is counted from the planned start of the previous run.
+		missed: string
+			What to do with runs that were missed because a run took longer than the delay,
+			only used with FIXED_RATE:
+			CATCH_UP (default): run all missed runs back to back.
+			COALESCE: run once for all missed runs.
+			SKIP: drop all missed runs.
+		concurrency: int
+			Maximum number of runs that may execute at the same time. When higher than 1,
+			runs are started at a fixed rate on a pool of threads, and a run that is due
+			while all threads are busy is skipped.
+		"""
+		if policy not in (FIXED_DELAY, FIXED_RATE):
+			raise Exception("Unknown policy {0}".format(policy))
+		if missed not in (CATCH_UP, COALESCE, SKIP):
+			raise Exception("Unknown missed run policy {0}".format(missed))
+		if concurrency < 1:
+			raise Exception("Concurrency must be at least 1")
+
+		self.policy = policy
+		self.missed = missed
+		self.concurrency = concurrency
+
+	def setSpread(self, spread=True, jitter=0, key=None):
+		"""
+		Spread the runs of this schedule over time. Both methods below keep the average
+		number of runs the same.
+
+		Parameters
+		----------
+		spread: boolean or int
+			When True, all runs are shifted by a fixed offset between 0 and the delay.
+			When a number, the offset is between 0 and this many seconds, which is required
+			when using a trigger. The offset is derived from key, so it stays the same
+			when the schedule is created again, but differs between hosts.
+		jitter: int
+			Every run is moved by a random amount between -jitter and +jitter seconds.
+			The next run is planned as if no jitter was applied, so jitter does not add up.
+		key: string
+			Used to derive the offset. Defaults to the hostname followed by the name of
+			this schedule.
+		"""
+		if spread is True:
+			if self.trigger:
+				raise Exception("Spread for {0} must be given in seconds".format(self.name))
+			spread = self.delay
+
+		offset = 0
+		if spread:
+			if key is None:
+				key = "{0}/{1}".format(socket.gethostname(), self.name)
+			digest = hashlib.md5(key.encode("utf-8")).hexdigest()
+			offset = int(digest[:8], 16) / float(0x100000000) * spread
+
+		with self.policy_lock:
+			# Interval schedules only need their first run shifted, the delay keeps the
+			# offset for all following runs. Triggers add the offset in _nextAfter.
+			self.planned += offset - self.offset
+			self.nextRun = self.planned
+			self.offset = offset
+			self.jitter = jitter
+		self.logger.info("{0} is offset by {1:.1f} seconds, with {2} seconds jitter".format(self.name, offset, jitter))
+
+	def getStats(self):
+		"""
+		Return a snapshot of the runtime statistics of this schedule as a dict, see
+		RunStats.snapshot(). The overrun and skip counters, the number of running runs,
+		the spread offset, the last applied jitter and the next planned run are included.
+		"""
+		snapshot = self.stats.snapshot()
+		with self.policy_lock:
+			snapshot.update({
+				"overruns": self.overruns,
+				"skipped": self.skipped,
+				"running": self.running,
+				"offset": self.offset,
+				"jitter": self.lastJitter,
+				"next_run": self.nextRun
+			})
+		return snapshot
+
+	def _nextAfter(self, moment):
+		if self.trigger:
+			return self.trigger.getNextRun(moment - self.offset) + self.offset
+		return moment + self.delay
+
+	def _planFirst(self, startNow):
+		now = time.time()
+		if startNow is True:
+			self.planned = now
+		else:
+			if isinstance(startNow, numbers.Integral):
+				now += startNow
+			self.planned = self._nextAfter(now)
+		return self.planned
+
+	def _applyJitter(self):
+		# Must be called with self.policy_lock held.
+		if self.jitter:
+			self.lastJitter = random.uniform(-self.jitter, self.jitter)
+		return self.planned + self.lastJitter
+
+	def _checkOverrun(self, started, finished):
+		# Must be called with self.policy_lock held.
+		if finished > self._nextAfter(started):
+			self.overruns += 1
+			self.logger.warning("{0} overran its delay of {1}".format(self.name, self.delay))
+
+	def _planAfterRun(self, started, finished):
+		# Used when runs are sequential: plan the next run after the previous finished.
+		with self.policy_lock:
+			self._checkOverrun(started, finished)
+
+			if self.policy == FIXED_DELAY:
+				self.planned = self._nextAfter(finished)
+			else:
+				self.planned = self._skipMissed(self._nextAfter(self.planned), finished)
+			return self._applyJitter()
+
+	def _planAfterDispatch(self, now):
+		# Used when runs are concurrent: plan the next run as soon as one is started.
+		with self.policy_lock:
+			self.planned = self._skipMissed(self._nextAfter(self.planned), now)
+			return self._applyJitter()
+
+	def _skipMissed(self, nextRun, now):
+		if nextRun > now or self.missed == CATCH_UP:
+			return nextRun
+
+		# Find the last run that should have started by now
+		behind = 0
+		following = self._nextAfter(nextRun)
+		while following <= now:
+			behind += 1
+			nextRun, following = following, self._nextAfter(following)
+
+		if self.missed == SKIP:
+			behind += 1
+			nextRun = following
+		self.skipped += behind
+		return nextRun
+
+	def _acquireRun(self):
+		# Returns False if the maximum number of concurrent runs has been reached.
+		with self.policy_lock:
+			if self.running >= self.concurrency:
+				self.skipped += 1
+				self.logger.warning("{0} is still running, skipping run".format(self.name))
+				return False
+			self.running += 1
+			return True
+
+	def _releaseRun(self, started, finished):
+		with self.policy_lock:
+			self.running -= 1
+			self._checkOverrun(started, finished)
+
+class Scheduler(threading.Thread, SchedulePolicy):
 	"""
 	A single thread that is automatically called with a specific interval.
 
@@ -33,8 +245,9 @@ class Scheduler(threading.Thread):
 
 		Parameters
 		----------
-		delay: int
-			The delay between consequtive runs of this thread, in seconds.
+		delay: int or trigger
+			The delay between consequtive runs of this thread, in seconds. Alternatively,
+			a trigger such as CronTrigger that determines when to run.
 		action: function pointer
 			The function to call.
 		name: string
@@ -50,6 +263,7 @@ class Scheduler(threading.Thread):
 
 		self.logger = logging.getLogger(name)
 		super(Scheduler, self).__init__(None, None, name, None, None)
+		self._initPolicy(delay)
 
 		self.delay = delay
 		self.main_action = action
@@ -59,16 +273,17 @@ class Scheduler(threading.Thread):
 
 		self.stop = False
 		now = datetime.datetime.now()
+		self.nextRun = self._planFirst(startNow)
 		if startNow is True:
 			self.lastRun = datetime.datetime.min
 			self.logger.debug("Thread {0} will start immediately".format(name))
 		else:
 			self.lastRun = now
-			if isinstance(startNow, (int, long)):
+			if isinstance(startNow, numbers.Integral):
 				self.lastRun += datetime.timedelta(seconds=startNow)
-			wait = (self.lastRun - now).seconds + delay
+			wait = self.nextRun - time.time()
 			self.logger.debug("Thread {0} will start in {1} seconds".format(name, wait))
-	
+
 	def setStartAction(self, action, *args, **kwargs):
 		"""
 		Set a function to call when run() is called, before the main action is called.
@@ -86,7 +301,7 @@ class Scheduler(threading.Thread):
 		self.init_action = action
 		self.init_args = args
 		self.init_kwargs = kwargs
-	
+
 	def setStopAction(self, action, *args, **kwargs):
 		"""
 		Set a function to call when run() is stopping, after the main action is called.
@@ -104,6 +319,26 @@ class Scheduler(threading.Thread):
 		self.stop_args = args
 		self.stop_kwargs = kwargs
 
+	def _runMain(self, planned):
+		self.logger.debug("Thread {0} is running".format(self.name))
+		started = time.time()
+		failed = False
+		try:
+			self.main_action(*self.main_args, **self.main_kwargs)
+		except Exception:
+			failed = True
+			self.logger.exception("Thread {0} generated an exception!".format(self.name))
+
+		finished = time.time()
+		self.stats.record(planned, started, finished, failed)
+		self.lastRun = datetime.datetime.now()
+		self.logger.debug("Thread {0} is done".format(self.name))
+		return started, finished
+
+	def _runConcurrent(self, planned):
+		started, finished = self._runMain(planned)
+		self._releaseRun(started, finished)
+
 	def run(self):
 		"""
 		Calls the defined action every $interval seconds. Optionally calls an action before
@@ -117,21 +352,333 @@ class Scheduler(threading.Thread):
 			self.logger.debug("Thread {0} is calling its init action")
 			self.init_action(*self.init_args, **self.init_kwargs)
 
+		executor = None
+		if self.concurrency > 1:
+			executor = Executor(self.name, self.concurrency)
+			executor.start()
+
 		while not self.stop:
 			self.logger.debug("Delay is {0}".format(self.delay))
-			if (datetime.datetime.now() - self.lastRun).total_seconds() > self.delay:
-				self.logger.debug("Thread {0} is running".format(self.name))
-				try:
-					self.main_action(*self.main_args, **self.main_kwargs)
-				except Exception:
-					self.logger.exception("Thread {0} generated an exception!".format(self.name))
+			now = time.time()
+			if now >= self.nextRun:
+				if executor:
+					if self._acquireRun():
+						executor.submit(self._runConcurrent, (self.nextRun,))
+					self.nextRun = self._planAfterDispatch(now)
+				else:
+					started, finished = self._runMain(self.nextRun)
+					self.nextRun = self._planAfterRun(started, finished)
+			time.sleep(max(0, min(1, self.nextRun - time.time())))
 
-				self.lastRun = datetime.datetime.now()
-				self.logger.debug("Thread {0} is done".format(self.name))
-			time.sleep(1)
+		if executor:
+			executor.shutdown()
 
 		if hasattr(self, "stop_action"):
 			self.logger.debug("Thread {0} is calling its stop action")
 			self.stop_action(*self.stop_args, **self.stop_kwargs)
 
 		self.logger.debug("Thread {0} is exiting main loop".format(self.name))
+
+class ScheduledJob(SchedulePolicy):
+	"""
+	A single periodic job, executed by a SchedulerPool.
+
+	The timing semantics are the same as those of Scheduler, including the timing
+	policy set by setPolicy().
+	"""
+	def __init__(self, delay, action, name, startNow=False, *args, **kwargs):
+		"""
+		Initialize a new ScheduledJob.
+
+		Parameters
+		----------
+		delay: int or trigger
+			The delay between consequtive runs of this job, in seconds. Alternatively,
+			a trigger such as CronTrigger that determines when to run.
+		action: function pointer
+			The function to call.
+		name: string
+			Descriptive name of this job.
+		startNow: boolean
+			When True, this job will run immediately when the pool is started.
+			When False, this job will run now+interval seconds when the pool is started.
+		*args
+			Positional arguments to pass to action.
+		**kwargs:
+			Keyword arguments to pass to action.
+		"""
+		self.logger = logging.getLogger(name)
+		self._initPolicy(delay)
+
+		self.delay = delay
+		self.main_action = action
+		self.name = name
+		self.main_args = args
+		self.main_kwargs = kwargs
+		self.started = False
+		self.init_lock = threading.Lock()
+
+		self.nextRun = self._planFirst(startNow)
+		if startNow is True:
+			self.logger.debug("Job {0} will start immediately".format(name))
+		else:
+			self.logger.debug("Job {0} will start in {1} seconds".format(name, self.nextRun - time.time()))
+
+	def setStartAction(self, action, *args, **kwargs):
+		"""
+		Set a function to call before the main action is called for the first time.
+
+		Parameters
+		----------
+		action: function pointer
+			The function to call.
+		*args
+			Positional arguments to pass to action.
+		**kwargs:
+			Keyword arguments to pass to action.
+		"""
+		self.init_action = action
+		self.init_args = args
+		self.init_kwargs = kwargs
+
+	def setStopAction(self, action, *args, **kwargs):
+		"""
+		Set a function to call when the SchedulerPool running this job is stopping.
+
+		Parameters
+		----------
+		action: function pointer
+			The function to call.
+		*args
+			Positional arguments to pass to action.
+		**kwargs:
+			Keyword arguments to pass to action.
+		"""
+		self.stop_action = action
+		self.stop_args = args
+		self.stop_kwargs = kwargs
+
+	def run(self, planned):
+		"""
+		Calls the start action if this is the first run, followed by the main action.
+		Returns a tuple with the start and end time of the main action.
+
+		Exceptions in the main action are logged, and will NOT stop the job from being
+		scheduled again. If the start action raises an exception, it is logged, the main
+		action is skipped, and the start action is tried again on the next run.
+
+		Parameters
+		----------
+		planned: float
+			UNIX timestamp of when this run should have started, used for statistics.
+		"""
+		with self.init_lock:
+			if not self.started:
+				if hasattr(self, "init_action"):
+					self.logger.debug("Job {0} is calling its init action".format(self.name))
+					try:
+						self.init_action(*self.init_args, **self.init_kwargs)
+					except Exception:
+						self.logger.exception("Job {0} failed to call its init action, retrying on the next run".format(self.name))
+						now = time.time()
+						self.stats.record(planned, now, now, True)
+						return now, now
+				self.started = True
+
+		self.logger.debug("Job {0} is running".format(self.name))
+		started = time.time()
+		failed = False
+		try:
+			self.main_action(*self.main_args, **self.main_kwargs)
+		except Exception:
+			failed = True
+			self.logger.exception("Job {0} generated an exception!".format(self.name))
+
+		finished = time.time()
+		self.stats.record(planned, started, finished, failed)
+		self.logger.debug("Job {0} is done".format(self.name))
+		return started, finished
+
+class SchedulerPool(threading.Thread):
+	"""
+	A single thread that runs many periodic jobs.
+
+	All jobs are kept in a heap ordered by their next run time. This thread sleeps
+	until the first job is due, and hands due jobs to an Executor with a fixed number
+	of worker threads. Unless a job allows concurrent runs, it is scheduled again
+	after its run has finished, so it never runs concurrently with itself.
+
+	To stop the pool, set stop to True. Jobs that are running will be allowed to finish.
+	"""
+	def __init__(self, name, workers=4):
+		"""
+		Initialize a new SchedulerPool thread.
+
+		Parameters
+		----------
+		name: string
+			Descriptive name of this thread.
+		workers: int
+			Number of threads available for running due jobs.
+		"""
+		self.logger = logging.getLogger(name)
+		super(SchedulerPool, self).__init__(None, None, name, None, None)
+
+		self.name = name
+		self.executor = Executor(name, workers)
+		self.condition = threading.Condition()
+		self.jobs = {}
+		self.heap = []
+		self.counter = 0
+
+		self.stop = False
+
+	def addJob(self, delay, action, name, startNow=False, *args, **kwargs):
+		"""
+		Create and schedule a new ScheduledJob. The parameters are the same as those of Scheduler.
+
+		Trying to add multiple jobs under the same name will raise an Exception.
+
+		Parameters
+		----------
+		delay: int or trigger
+			The delay between consequtive runs of this job, in seconds. Alternatively,
+			a trigger such as CronTrigger that determines when to run.
+		action: function pointer
+			The function to call.
+		name: string
+			Descriptive name of this job.
+		startNow: boolean
+			When True, this job will run immediately when the pool is started.
+			When False, this job will run now+interval seconds when the pool is started.
+		*args
+			Positional arguments to pass to action.
+		**kwargs:
+			Keyword arguments to pass to action.
+		"""
+		with self.condition:
+			if name in self.jobs:
+				self.logger.error("Job {0} already registered!".format(name))
+				raise Exception("Job {0} already registered!".format(name))
+
+			job = ScheduledJob(delay, action, name, startNow, *args, **kwargs)
+			self.jobs[name] = job
+			self._schedule(job)
+		self.logger.debug("Added job {0}".format(name))
+
+		return job
+
+	def getJobs(self):
+		"""
+		Retrieve a list of names of all jobs.
+		"""
+		return self.jobs.keys()
+
+	def getJob(self, name):
+		"""
+		Retrieve the ScheduledJob with the given name.
+
+		If the given name does not exists in the job list, an Exception is raised.
+
+		Parameters
+		----------
+		name: string
+			Name of the job to retrieve
+		"""
+		if not name in self.jobs:
+			self.logger.error("Job {0} is not registered!".format(name))
+			raise Exception("Job {0} is not registered!".format(name))
+
+		return self.jobs[name]
+
+	def removeJob(self, name):
+		"""
+		Remove the job with the given name. If the job is currently running, it is
+		allowed to finish, but it will not be scheduled again.
+
+		Parameters
+		----------
+		name: string
+			Name of the job to remove
+		"""
+		with self.condition:
+			if not name in self.jobs:
+				self.logger.error("Job {0} is not registered!".format(name))
+				raise Exception("Job {0} is not registered!".format(name))
+
+			del self.jobs[name]
+		self.logger.debug("Removed job {0}".format(name))
+
+	def getJobStats(self):
+		"""
+		Retrieve a snapshot of the runtime statistics of all jobs, as a dict of job
+		name to ScheduledJob.getStats().
+		"""
+		with self.condition:
+			jobs = self.jobs.items()
+		return dict((name, job.getStats()) for name, job in jobs)
+
+	def _schedule(self, job):
+		# Must be called with self.condition held. Removed jobs are left in the heap,
+		# and skipped once they are popped.
+		self.counter += 1
+		heapq.heappush(self.heap, (job.nextRun, self.counter, job))
+		self.condition.notify()
+
+	def _dispatch(self, job, now):
+		# Must be called with self.condition held.
+		if job.concurrency > 1:
+			if job._acquireRun():
+				self.executor.submit(self._runConcurrent, (job, job.nextRun))
+			job.nextRun = job._planAfterDispatch(now)
+			self._schedule(job)
+		else:
+			self.executor.submit(self._runJob, (job,))
+
+	def _runJob(self, job):
+		started, finished = job.run(job.nextRun)
+		with self.condition:
+			if self.jobs.get(job.name) is job and not self.stop:
+				job.nextRun = job._planAfterRun(started, finished)
+				self._schedule(job)
+
+	def _runConcurrent(self, job, planned):
+		started, finished = job.run(planned)
+		job._releaseRun(started, finished)
+
+	def run(self):
+		"""
+		Wait for the first job to become due, and hand it to the Executor. This is
+		repeated until stop is set to True. When stopping, the stop action of every
+		job is called, if defined.
+		"""
+		self.logger.debug("Thread {0} is entering main loop".format(self.name))
+		self.executor.start()
+
+		with self.condition:
+			while not self.stop:
+				now = time.time()
+				while self.heap and self.heap[0][0] <= now:
+					job = heapq.heappop(self.heap)[2]
+					if self.jobs.get(job.name) is not job:
+						continue
+					# The job was moved to a later time after it was scheduled, see setSpread()
+					if job.nextRun > now:
+						self._schedule(job)
+						continue
+					self._dispatch(job, now)
+
+				# Wake up at least every second, to notice stop being set
+				timeout = 1
+				if self.heap:
+					timeout = min(timeout, self.heap[0][0] - now)
+				self.condition.wait(timeout)
+
+		self.executor.shutdown()
+
+		for job in self.jobs.values():
+			if hasattr(job, "stop_action"):
+				self.logger.debug("Job {0} is calling its stop action".format(job.name))
+				job.stop_action(*job.stop_args, **job.stop_kwargs)
+
+		self.logger.debug("Thread {0} is exiting main loop".format(self.name))
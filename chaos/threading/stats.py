@@ -0,0 +1,97 @@
+# Copyright (c) 2014 Nick Douma < n.douma [at] nekoconeko . nl >
+#
+# This file is part of chaos, a.k.a. python-chaos .
+#
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation; either
+# version 3.0 of the License, or (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with this library. If not, see
+# <http://www.gnu.org/licenses/>.
+
+""" Runtime statistics for periodic jobs. """
+
+from __future__ import absolute_import
+import threading, collections, math
+
+class RunStats(object):
+	"""
+	Keeps cheap rolling statistics about the runs of a single job.
+
+	Recording a run is O(1). Percentiles are calculated from a window of the most
+	recent runs, only when a snapshot is taken.
+	"""
+	def __init__(self, window=1000):
+		"""
+		Parameters
+		----------
+		window: int
+			Number of recent runs to keep for calculating percentiles.
+		"""
+		self.lock = threading.Lock()
+		self.durations = collections.deque(maxlen=window)
+		self.runs = 0
+		self.failures = 0
+		self.total = 0.0
+		self.last = None
+		self.lag = None
+		self.totalLag = 0.0
+		self.maxLag = 0.0
+
+	def record(self, planned, started, finished, failed=False):
+		"""
+		Record a single run.
+
+		Parameters
+		----------
+		planned: float
+			UNIX timestamp of when the run should have started.
+		started: float
+			UNIX timestamp of when the run actually started.
+		finished: float
+			UNIX timestamp of when the run finished.
+		failed: boolean
+			True if the run raised an exception.
+		"""
+		duration = finished - started
+		lag = max(0.0, started - planned)
+		with self.lock:
+			self.runs += 1
+			if failed:
+				self.failures += 1
+			self.total += duration
+			self.last = duration
+			self.durations.append(duration)
+			self.lag = lag
+			self.totalLag += lag
+			self.maxLag = max(self.maxLag, lag)
+
+	def snapshot(self):
+		"""
+		Return the current statistics as a dict. Durations and lag are in seconds,
+		and are None if there were no runs yet.
+		"""
+		with self.lock:
+			durations = sorted(self.durations)
+			runs = self.runs
+			snapshot = {
+				"runs": runs,
+				"failures": self.failures,
+				"last": self.last,
+				"avg": self.total / runs if runs else None,
+				"p99": None,
+				"lag": self.lag,
+				"avg_lag": self.totalLag / runs if runs else None,
+				"max_lag": self.maxLag if runs else None
+			}
+
+		if durations:
+			snapshot["p99"] = durations[int(math.ceil(0.99 * len(durations))) - 1]
+		return snapshot
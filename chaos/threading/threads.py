@@ -19,18 +19,32 @@
 """ Helper functions for working with python multithreading. """
 
 from __future__ import absolute_import
-import threading, logging, os
+import threading, logging, os, time
+from .scheduler import Scheduler
 
 class Threads(object):
 	"""
 	Container to register and handle multiple Threads.
-	"""
-	thread_list = {}
 
+	Every instance keeps its own registry. Threads that were registered with a factory
+	can be supervised: when such a Thread dies, a new Thread is created by the factory
+	and started in its place, see supervise().
+	"""
 	def __init__(self):
 		self.logger = logging.getLogger(__name__)
+		self.thread_list = {}
+		self.factories = {}
+		self.restarts = {}
+		self.failures = {}
+		self.restart_at = {}
+		self.started_at = {}
+		self.lock = threading.RLock()
+		self.supervisor = None
+		self.stopping = False
+		self.backoff = 1
+		self.max_backoff = 300
 
-	def registerThread(self, name, thread):
+	def registerThread(self, name, thread, factory=None):
 		"""
 		Register a new Thread , under the given descriptive name.
 
@@ -42,16 +56,24 @@ class Threads(object):
 			Name to register the given thread under.
 		thread: threading.Thread, or a subclass
 			Thread object to register.
+		factory: function pointer
+			If set, this function is called without arguments to create a new Thread
+			when the registered Thread dies while being supervised.
 		"""
 		if not isinstance(thread, threading.Thread):
 			self.logger.error("Thread {0} is not actually a Thread!".format(name))
 			raise Exception("Thread {0} is not actually a Thread!".format(name))
 
-		if name in self.thread_list:
-			self.logger.error("Thread {0} already registered!".format(name))
-			raise Exception("Thread {0} already registered!".format(name))
+		with self.lock:
+			if name in self.thread_list:
+				self.logger.error("Thread {0} already registered!".format(name))
+				raise Exception("Thread {0} already registered!".format(name))
 
-		self.thread_list[name] = thread
+			self.thread_list[name] = thread
+			if factory:
+				self.factories[name] = factory
+				self.restarts[name] = 0
+				self.failures[name] = 0
 		self.logger.debug("Registered thread {0}".format(name))
 
 		return thread
@@ -92,52 +114,192 @@ class Threads(object):
 		name: string
 			Name of the Thread to unregister
 		"""
-		if not name in self.thread_list:
-			self.logger.error("Thread {0} is not registered!".format(name))
-			raise Exception("Thread {0} is not registered!".format(name))
+		with self.lock:
+			if not name in self.thread_list:
+				self.logger.error("Thread {0} is not registered!".format(name))
+				raise Exception("Thread {0} is not registered!".format(name))
 
-		del self.thread_list[name]
+			del self.thread_list[name]
+			for registry in (self.factories, self.restarts, self.failures, self.restart_at, self.started_at):
+				registry.pop(name, None)
 		self.logger.debug("Unregistered thread {0}".format(name))
 
+	def supervise(self, interval=5, backoff=1, max_backoff=300):
+		"""
+		Start a Scheduler thread that checks all registered Threads every $interval
+		seconds, see checkThreads(). The supervisor is stopped by stopAll().
+
+		Parameters
+		----------
+		interval: int
+			Number of seconds between checks.
+		backoff: int
+			Number of seconds to wait before restarting a Thread that died for the
+			first time. This doubles for every consecutive restart.
+		max_backoff: int
+			Maximum number of seconds to wait before restarting a Thread. A Thread that
+			stays alive for longer than this is considered healthy again.
+		"""
+		if self.supervisor:
+			raise Exception("Threads are already being supervised")
+
+		self.backoff = backoff
+		self.max_backoff = max_backoff
+		self.supervisor = Scheduler(interval, self.checkThreads, "{0}.supervisor".format(__name__))
+		self.supervisor.daemon = True
+		self.supervisor.start()
+		self.logger.info("Supervising threads every {0} seconds".format(interval))
+
+	def checkThreads(self):
+		"""
+		Restart every registered Thread that has a factory, and that died without being
+		asked to stop. A Thread that died is restarted after a backoff, which doubles
+		with every consecutive restart. Returns a list of names of restarted Threads.
+		"""
+		restarted = []
+		now = time.time()
+
+		with self.lock:
+			if self.stopping:
+				return restarted
+
+			for name, factory in self.factories.items():
+				thr = self.thread_list[name]
+				if thr.ident is None or thr.is_alive() or getattr(thr, "stop", False):
+					continue
+
+				if not name in self.restart_at:
+					if now - self.started_at.get(name, 0) > self.max_backoff:
+						self.failures[name] = 0
+					wait = min(self.max_backoff, self.backoff * 2 ** self.failures[name])
+					self.restart_at[name] = now + wait
+					self.failures[name] += 1
+					self.logger.warning("Thread {0} died, restarting in {1} seconds".format(name, wait))
+				if now < self.restart_at[name]:
+					continue
+
+				try:
+					new = factory()
+					if not isinstance(new, threading.Thread):
+						raise Exception("Factory of {0} did not return a Thread".format(name))
+					new.start()
+				except Exception:
+					self.logger.exception("Failed to restart thread {0}".format(name))
+					del self.restart_at[name]
+					continue
+
+				self.thread_list[name] = new
+				self.started_at[name] = now
+				self.restarts[name] += 1
+				del self.restart_at[name]
+				restarted.append(name)
+				self.logger.info("Restarted thread {0}, {1} restarts so far".format(name, self.restarts[name]))
+
+		return restarted
+
+	def getRestarts(self):
+		"""
+		Retrieve the number of restarts of every Thread that was registered with a factory.
+		"""
+		with self.lock:
+			return dict(self.restarts)
+
+	def getStats(self):
+		"""
+		Retrieve a snapshot of the runtime statistics of all registered Threads that
+		keep them, such as Scheduler, as a dict of name to statistics. Jobs of a
+		SchedulerPool are included as <pool name>.<job name>.
+		"""
+		stats = {}
+		for name, thread in self.thread_list.items():
+			if hasattr(thread, "getJobStats"):
+				for job, jobstats in thread.getJobStats().items():
+					stats["{0}.{1}".format(name, job)] = jobstats
+			elif hasattr(thread, "getStats"):
+				stats[name] = thread.getStats()
+		return stats
+
 	def startAll(self):
 		"""
 		Start all registered Threads.
 		"""
 		self.logger.info("Starting all threads...")
 
+		self.stopping = False
+		now = time.time()
 		for thread in self.getThreads():
 			thr = self.getThread(thread)
 			self.logger.debug("Starting {0}".format(thr.name))
+			self.started_at[thread] = now
 			thr.start()
 
 		self.logger.info("Started all threads")
 
-	def stopAll(self, stop=False):
+	def stopAll(self, stop=False, timeout=None):
 		"""
 		Stop all registered Threads. This is method assumes that the Thread is using
 		and internal variable called stop to control its main loop. Stopping a Thread
 		is achieved as follows:
 
-		1. The Thread is retrieved.
-		2. $thread.stop is set to False.
-		3. The Thread is joined, and will wait until the Thread exits.
-		4. The Thread is unregistered.
-		5. If $exit = True, the main process is killed.
+		1. $thread.stop is set to True for all Threads at once.
+		2. Every Thread is joined, until it exits or until $timeout seconds have passed
+		   since step 1. The timeout is shared by all Threads.
+		3. Every Thread that exited is unregistered. Threads that are still running stay
+		   registered, and are reported.
+		4. If $stop = True, the main process is killed.
+
+		Ensure that any registered Thread responds to having its stop property set to True,
+		else calling stopAll() without a timeout will result in a hung process.
 
-		Ensure that any registered Thread responds to having its stop property set to False,
-		else calling stopAll() will result in a hung process.
+		Returns a dict with a list of names of "stopped" and "running" Threads, and the
+		"duration" of the shutdown in seconds.
+
+		Parameters
+		----------
+		stop: boolean
+			If True, kill the main process after stopping all Threads.
+		timeout: int
+			Maximum number of seconds to wait for all Threads together. If None, wait
+			until all Threads have exited.
 		"""
 		self.logger.info("Stopping all threads...")
+		start = time.time()
+		deadline = None if timeout is None else start + timeout
 
-		for thread in self.getThreads():
-			thr = self.getThread(thread)
+		with self.lock:
+			self.stopping = True
+			if self.supervisor:
+				self.supervisor.stop = True
+				self.supervisor = None
+
+		names = self.getThreads()
+		for name in names:
+			thr = self.getThread(name)
 			self.logger.debug("Stopping {0}".format(thr.name))
 			thr.stop = True
-			thr.join()
-			self.unregisterThread(thread)
 
-		self.logger.info("Stopped all threads")
+		summary = {"stopped": [], "running": []}
+		for name in names:
+			thr = self.getThread(name)
+			if thr.is_alive():
+				if deadline is None:
+					thr.join()
+				else:
+					thr.join(max(0, deadline - time.time()))
+
+			if thr.is_alive():
+				self.logger.warning("Failed to stop {0} in time".format(thr.name))
+				summary["running"].append(name)
+			else:
+				summary["stopped"].append(name)
+				self.unregisterThread(name)
+
+		summary["duration"] = time.time() - start
+		self.logger.info("Stopped {0} threads in {1:.1f} seconds, {2} still running".format(
+			len(summary["stopped"]), summary["duration"], len(summary["running"])))
 
 		if stop:
 			self.logger.fatal("Comitting suicide")
 			os._exit(0)
+
+		return summary
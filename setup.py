@@ -47,11 +47,18 @@ setup(
 	packages=[
 		"chaos",
 		"chaos.amqp",
+		"chaos.asyncio",
+		"chaos.db",
 		"chaos.multiprocessing",
 		"chaos.threading"
 	],
 	install_requires=[
 		"configobj",
 		"pika>=0.9.5"
-	]
+	],
+	entry_points={
+		"console_scripts": [
+			"chaos-db = chaos.db.tool:main"
+		]
+	}
 )
@@ -0,0 +1,54 @@
+# Copyright (c) 2014 Nick Douma < n.douma [at] nekoconeko . nl >
+#
+# This file is part of chaos, a.k.a. python-chaos .
+#
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation; either
+# version 3.0 of the License, or (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with this library. If not, see
+# <http://www.gnu.org/licenses/>.
+
+from __future__ import absolute_import
+import datetime, os, sys, unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from chaos.threading.cron import CronTrigger
+
+def runs(expression, after, count):
+	trigger = CronTrigger(expression)
+	result = []
+	for i in range(count):
+		after = trigger.getNext(after)
+		result.append(after)
+	return result
+
+class CronTriggerTest(unittest.TestCase):
+	def test_day_step_and_weekday(self):
+		# */2 counts as unrestricted, so both the day and the weekday must match:
+		# odd days of the month that are mondays
+		for moment in runs("0 0 */2 * 1", datetime.datetime(2026, 1, 1), 10):
+			self.assertEqual(moment.weekday(), 0)
+			self.assertEqual(moment.day % 2, 1)
+			self.assertEqual((moment.hour, moment.minute), (0, 0))
+
+	def test_day_or_weekday(self):
+		# Both restricted, either may match
+		moments = runs("0 0 13 * 5", datetime.datetime(2026, 1, 1), 20)
+		self.assertTrue(all(moment.day == 13 or moment.weekday() == 4 for moment in moments))
+		self.assertTrue(any(moment.day == 13 and moment.weekday() != 4 for moment in moments))
+		self.assertTrue(any(moment.day != 13 for moment in moments))
+
+	def test_weekday_only(self):
+		moments = runs("30 6 * * 1-5", datetime.datetime(2026, 1, 1), 10)
+		self.assertTrue(all(moment.weekday() < 5 for moment in moments))
+
+if __name__ == "__main__":
+	unittest.main()
@@ -0,0 +1,61 @@
+# Copyright (c) 2014 Nick Douma < n.douma [at] nekoconeko . nl >
+#
+# This file is part of chaos, a.k.a. python-chaos .
+#
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation; either
+# version 3.0 of the License, or (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with this library. If not, see
+# <http://www.gnu.org/licenses/>.
+
+from __future__ import absolute_import
+import multiprocessing, os, sys, unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from chaos.multiprocessing.ringbuffer import RingBuffer, MPMCRingBuffer
+
+def consume(ring, count, results):
+	for i in range(count):
+		results.put(len(ring.get()))
+
+class RingBufferTest(unittest.TestCase):
+	def test_large_message_after_wrap(self):
+		ring = RingBuffer(1000)
+		ring.put(b"x" * 500)
+		self.assertEqual(ring.get(), b"x" * 500)
+		ring.put(b"y" * 600, timeout=1)
+		self.assertEqual(ring.get(), b"y" * 600)
+
+	def test_largest_message(self):
+		ring = MPMCRingBuffer(1000)
+		for i in range(5):
+			ring.put(b"a" * (i * 7))
+			ring.get()
+			ring.put(b"z" * 996, timeout=1)
+			self.assertEqual(ring.get(), b"z" * 996)
+
+	def test_large_messages_between_processes(self):
+		ring = RingBuffer(1000)
+		results = multiprocessing.Queue()
+		count = 200
+		process = multiprocessing.Process(target=consume, args=(ring, count, results))
+		process.start()
+		try:
+			for i in range(count):
+				ring.put(b"m" * (800 if i % 2 else 300), timeout=5)
+			self.assertEqual([results.get(timeout=5) for i in range(count)], [800 if i % 2 else 300 for i in range(count)])
+		finally:
+			process.join(5)
+			if process.is_alive():
+				process.terminate()
+
+if __name__ == "__main__":
+	unittest.main()
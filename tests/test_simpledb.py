@@ -0,0 +1,108 @@
+# Copyright (c) 2014 Nick Douma < n.douma [at] nekoconeko . nl >
+#
+# This file is part of chaos, a.k.a. python-chaos .
+#
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation; either
+# version 3.0 of the License, or (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with this library. If not, see
+# <http://www.gnu.org/licenses/>.
+
+from __future__ import absolute_import
+import os, shutil, sys, tempfile, threading, unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from chaos.db.simpledb import SimpleDb
+
+class TransactionTest(unittest.TestCase):
+	def setUp(self):
+		self.directory = tempfile.mkdtemp()
+		self.db = SimpleDb(os.path.join(self.directory, "test.db"), backend="sqlite")
+		self.db.open()
+		self.db.update(a=1, b=2)
+
+	def tearDown(self):
+		self.db.close()
+		shutil.rmtree(self.directory)
+
+	def read(self):
+		db = self.db
+		return (db.get_many(["a", "b", "c"]), "b" in db, db.get("c"), len(db))
+
+	def test_other_threads_do_not_see_changes(self):
+		changed, finish = threading.Event(), threading.Event()
+		inside = []
+
+		def change():
+			with self.db.transaction():
+				self.db["a"] = 10
+				self.db["c"] = 30
+				del self.db["b"]
+				inside.append(self.read())
+				changed.set()
+				finish.wait(5)
+
+		writer = threading.Thread(target=change)
+		writer.start()
+		self.assertTrue(changed.wait(5))
+		try:
+			self.assertEqual(self.read(), ({"a": 1, "b": 2}, True, None, 2))
+		finally:
+			finish.set()
+			writer.join()
+
+		self.assertEqual(inside, [({"a": 10, "c": 30}, False, 30, 2)])
+		self.assertEqual(self.read(), ({"a": 10, "c": 30}, False, 30, 2))
+		self.assertEqual(sorted(self.db), ["a", "c"])
+
+class IndexTest(unittest.TestCase):
+	def setUp(self):
+		self.directory = tempfile.mkdtemp()
+
+	def tearDown(self):
+		shutil.rmtree(self.directory)
+
+	def test_saved_index(self):
+		for backend in ("sqlite", "log"):
+			path = os.path.join(self.directory, backend + ".db")
+			with SimpleDb(path, index=True, backend=backend) as db:
+				db.update(a=1, b=2, c=3)
+			with SimpleDb(path, index=True) as db:
+				self.assertNotEqual(db.index_signature, None)
+				self.assertEqual(list(db.iter_range("b")), ["b", "c"])
+
+			# A new database does not use the index of the one it replaced
+			with SimpleDb(path, mode="n", index=True, backend=backend) as db:
+				self.assertEqual((len(db), list(db.iter_range())), (0, []))
+				db["d"] = 4
+			with SimpleDb(path, index=True) as db:
+				self.assertEqual((len(db), list(db.iter_range())), (1, ["d"]))
+
+class LogBackendTest(unittest.TestCase):
+	def setUp(self):
+		self.directory = tempfile.mkdtemp()
+
+	def tearDown(self):
+		shutil.rmtree(self.directory)
+
+	def test_delete_while_iterating(self):
+		with SimpleDb(os.path.join(self.directory, "test.db"), backend="log") as db:
+			db.update((key, 1) for key in "abcde")
+			seen = []
+			for key in db:
+				if not seen:
+					db.delete_many(other for other in "abcde" if other != key)
+				seen.append(key)
+			self.assertEqual(len(seen), 1)
+			self.assertEqual(len(db), 1)
+
+if __name__ == "__main__":
+	unittest.main()
@@ -0,0 +1,65 @@
+# Copyright (c) 2014 Nick Douma < n.douma [at] nekoconeko . nl >
+#
+# This file is part of chaos, a.k.a. python-chaos .
+#
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation; either
+# version 3.0 of the License, or (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with this library. If not, see
+# <http://www.gnu.org/licenses/>.
+
+from __future__ import absolute_import
+import os, signal, sys, time, unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from chaos.multiprocessing.tasks import TaskPool, TaskError
+
+def double_or_die(value):
+	if value == 5:
+		# Give the claim of the batch time to reach the main process
+		time.sleep(0.2)
+		os.kill(os.getpid(), signal.SIGKILL)
+	return value * 2
+
+class TaskPoolTest(unittest.TestCase):
+	def setUp(self):
+		self.pool = TaskPool("test-tasks", workers=2, batch_size=4, interval=0.1, backoff=0.1)
+		self.pool.start()
+
+	def tearDown(self):
+		self.pool.shutdown(wait=False, timeout=2, grace=1)
+
+	def test_map(self):
+		self.assertEqual(sorted(self.pool.map(double_or_die, [1, 2, 3], ordered=False)), [2, 4, 6])
+		self.assertEqual(list(self.pool.map(double_or_die, range(5))), [0, 2, 4, 6, 8])
+
+	def test_worker_killed_mid_batch(self):
+		results = [self.pool.submit(double_or_die, value) for value in range(12)]
+		self.pool.flush()
+		for value, result in enumerate(results):
+			if 4 <= value < 8:
+				self.assertRaises(TaskError, result.get, 10)
+			else:
+				self.assertEqual(result.get(10), value * 2)
+		self.assertEqual(self.pool.getPending(), 0)
+
+		# The pool keeps working, and map() does not hang on the lost batch
+		self.assertRaises(TaskError, list, self.pool.map(double_or_die, range(8)))
+		self.assertEqual(list(self.pool.map(double_or_die, range(3))), [0, 2, 4])
+
+	def test_shutdown_after_worker_died(self):
+		results = [self.pool.submit(double_or_die, value) for value in range(8)]
+		self.pool.shutdown(wait=True, timeout=2, grace=1)
+		self.assertTrue(all(result.ready() for result in results))
+		self.assertEqual([result.successful() for result in results], [True] * 4 + [False] * 4)
+
+if __name__ == "__main__":
+	unittest.main()